@@ -0,0 +1,728 @@
+#!/usr/bin/env python
+
+### Writer and reader for bigWig files (binary indexed tracks)
+
+## This module writes and reads bigWig files (version 4, as described in Kent et al.,
+## Bioinformatics 26:2204, 2010), with no dependencies other than numpy. The files can be
+## loaded directly in the UCSC and IGV genome browsers, and read by pyBigWig and the UCSC
+## tools. Layout of a file:
+##
+##   header (64 bytes)                 magic 0x888FFC26, version, number of zoom levels, offsets
+##   zoom headers (24 bytes each)      reduction level, offsets of zoom data and zoom index
+##   total summary (40 bytes)          bases covered, min, max, sum, sum of squares
+##   chromosome B+ tree                chromosome name -> (id, size)
+##   data count (8 bytes) + blocks     zlib-compressed sections of up to `itemsPerSlot' items,
+##                                     in bedGraph (start, end, value) or fixedStep (value) form
+##   R-tree index of the data blocks   (chrom, start, end) -> (offset, size) of each block
+##   for each zoom level: number of records (4 bytes), compressed blocks of summary records
+##   (chrom, start, end, bases covered, min, max, sum, sum of squares), and their R-tree index.
+##
+## All numbers are little-endian. Zoom level i summarizes the data in bins of 4^(i+1) times
+## the typical item size, so a region can be summarized by reading a number of records that
+## depends on the number of bins requested rather than on the size of the region.
+
+import sys
+import zlib
+import struct
+import tempfile
+
+import numpy as np
+
+import Script
+
+BIGWIG_MAGIC = 0x888FFC26
+BPT_MAGIC = 0x78CA8C91
+CIRTREE_MAGIC = 0x2468ACE0
+
+HEADER = struct.Struct("<IHHQQQHHQQIQ")
+ZOOMHEADER = struct.Struct("<IIQQ")
+SUMMARY = struct.Struct("<Qdddd")
+BPTHEADER = struct.Struct("<IIIIQQ")
+CIRHEADER = struct.Struct("<IIQIIIIQII")
+NODEHEADER = struct.Struct("<BBH")
+LEAFITEM = struct.Struct("<IIIIQQ")
+NODEITEM = struct.Struct("<IIIIQ")
+SECTIONHEADER = struct.Struct("<IIIIIBBH")
+
+BEDGRAPH_ITEM = np.dtype([('start', '<u4'), ('end', '<u4'), ('value', '<f4')])
+VARSTEP_ITEM = np.dtype([('start', '<u4'), ('value', '<f4')])
+ZOOM_RECORD = np.dtype([('chrom', '<u4'), ('start', '<u4'), ('end', '<u4'), ('valid', '<u4'),
+                        ('min', '<f4'), ('max', '<f4'), ('sum', '<f4'), ('sumsq', '<f4')])
+
+### Summaries
+
+def splitBins(starts, ends, edges):
+    """Split intervals `starts'-`ends' on the bin boundaries in `edges'. Returns a tuple (idx, bins,
+pstarts, pends) with the index of the interval each piece comes from, its bin, and its extent."""
+    nbins = len(edges) - 1
+    fb = np.clip(np.searchsorted(edges, starts, side='right') - 1, 0, nbins - 1)
+    lb = np.clip(np.searchsorted(edges, ends - 1, side='right') - 1, 0, nbins - 1)
+    nb = np.maximum(lb - fb + 1, 0)
+    idx = np.repeat(np.arange(len(starts)), nb)
+    bins = fb[idx] + (np.arange(len(idx)) - np.repeat(np.cumsum(nb) - nb, nb))
+    pstarts = np.maximum(starts[idx], edges[bins])
+    pends = np.minimum(ends[idx], edges[bins + 1])
+    good = pends > pstarts
+    return (idx[good], bins[good], pstarts[good], pends[good])
+
+def zoomRecords(chromId, starts, ends, values, reduction):
+    """Summarize the items (`starts', `ends', `values', sorted and not overlapping) of chromosome
+`chromId' in bins of `reduction' bases. Returns an array of ZOOM_RECORD with one record for
+each bin containing data."""
+    if len(starts) == 0:
+        return np.zeros(0, dtype=ZOOM_RECORD)
+    edges = np.arange(starts[0] // reduction, (ends[-1] - 1) // reduction + 2, dtype=np.int64) * reduction
+    (idx, bins, ps, pe) = splitBins(starts, ends, edges)
+    w = (pe - ps).astype(np.float64)
+    pv = values[idx].astype(np.float64)
+    heads = np.concatenate(([0], np.flatnonzero(np.diff(bins)) + 1))
+    rec = np.zeros(len(heads), dtype=ZOOM_RECORD)
+    rec['chrom'] = chromId
+    rec['start'] = ps[heads]
+    rec['end'] = np.maximum.reduceat(pe, heads)
+    rec['valid'] = np.add.reduceat(pe - ps, heads)
+    rec['min'] = np.minimum.reduceat(pv, heads)
+    rec['max'] = np.maximum.reduceat(pv, heads)
+    rec['sum'] = np.add.reduceat(pv * w, heads)
+    rec['sumsq'] = np.add.reduceat(pv * pv * w, heads)
+    return rec
+
+def binStats(recs, start, end, nbins, stat):
+    """Combine summary records `recs' (an array with fields start, end, valid, min, max, sum, sumsq)
+into `nbins' equal bins spanning `start'-`end'. Records overlapping a bin partially contribute
+in proportion to the overlap. `stat' is one of mean, min, max, sum, std, coverage. Returns an
+array of floats, with NaN for bins without data (0 for coverage)."""
+    edges = start + (np.arange(nbins + 1, dtype=np.int64) * (end - start)) // nbins
+    n = np.zeros(nbins)
+    s = np.zeros(nbins)
+    ss = np.zeros(nbins)
+    mn = np.full(nbins, np.inf)
+    mx = np.full(nbins, -np.inf)
+    if len(recs) > 0:
+        rstarts = recs['start'].astype(np.int64)
+        rends = recs['end'].astype(np.int64)
+        (idx, bins, ps, pe) = splitBins(rstarts, rends, edges)
+        frac = (pe - ps).astype(np.float64) / (rends - rstarts)[idx]
+        np.add.at(n, bins, recs['valid'][idx] * frac)
+        np.add.at(s, bins, recs['sum'][idx] * frac)
+        np.add.at(ss, bins, recs['sumsq'][idx] * frac)
+        np.minimum.at(mn, bins, recs['min'][idx])
+        np.maximum.at(mx, bins, recs['max'][idx])
+    if stat == "coverage":
+        return n / (edges[1:] - edges[:-1])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if stat == "mean":
+            result = s / n
+        elif stat == "min":
+            result = mn
+        elif stat == "max":
+            result = mx
+        elif stat == "sum":
+            result = s
+        elif stat == "std":
+            result = np.sqrt(np.maximum(ss - s * s / n, 0) / (n - 1))
+        else:
+            raise ValueError("Unknown statistic `{}'.".format(stat))
+    result[n == 0] = np.nan
+    return result
+
+### R-tree index
+
+def nodeBounds(items):
+    """Bounds (startChrom, startBase, endChrom, endBase) of a list of sorted R-tree items."""
+    end = max([ (it[2], it[3]) for it in items ])
+    return (items[0][0], items[0][1], end[0], end[1])
+
+def writeRTree(out, items, blockSize, itemsPerSlot):
+    """Write an R-tree index at the current position of `out'. `items' is a list of tuples
+(startChrom, startBase, endChrom, endBase, offset, size) describing the data blocks, sorted
+by position. Nodes are written from the root down, each with up to `blockSize' children."""
+    levels = [ [ items[i:i+blockSize] for i in range(0, max(len(items), 1), blockSize) ] ]
+    while len(levels[-1]) > 1:
+        bounds = [ nodeBounds(node) for node in levels[-1] ]
+        levels.append([ bounds[i:i+blockSize] for i in range(0, len(bounds), blockSize) ])
+    levels.reverse()
+
+    if items:
+        bounds = nodeBounds(items)
+        endOffset = max([ it[4] + it[5] for it in items ])
+    else:
+        bounds = (0, 0, 0, 0)
+        endOffset = out.tell()
+    out.write(CIRHEADER.pack(CIRTREE_MAGIC, blockSize, len(items), bounds[0], bounds[1], bounds[2], bounds[3],
+                             endOffset, itemsPerSlot, 0))
+
+    # Offset of each node: all nodes of a level are written before the next level
+    pos = out.tell()
+    offsets = []
+    for depth, nodes in enumerate(levels):
+        itemsize = LEAFITEM.size if depth == len(levels) - 1 else NODEITEM.size
+        offs = []
+        for node in nodes:
+            offs.append(pos)
+            pos += NODEHEADER.size + len(node) * itemsize
+        offsets.append(offs)
+    for depth, nodes in enumerate(levels):
+        leaf = (depth == len(levels) - 1)
+        child = 0
+        for node in nodes:
+            out.write(NODEHEADER.pack(1 if leaf else 0, 0, len(node)))
+            for it in node:
+                if leaf:
+                    out.write(LEAFITEM.pack(*it))
+                else:
+                    out.write(NODEITEM.pack(it[0], it[1], it[2], it[3], offsets[depth+1][child]))
+                    child += 1
+
+### Writer
+
+class BigWigWriter():
+    """Write a bigWig file in a single pass. Items are added with add() or addArrays(), sorted
+by position within each chromosome, with all items for a chromosome added together.
+Coordinates are 0-based, half-open (as in bedGraph). The data blocks for each chromosome
+are written to a temporary file as soon as the chromosome is complete, while the zoom
+records are kept in memory; close() assembles the final file. If `chromSizes' (a dictionary
+or a list of (name, size) tuples) is not supplied, the size of each chromosome is the end
+of its last item.
+
+  with BigWigWriter("track.bw", chromSizes) as bw:
+      bw.add("chr1", 0, 100, 2.5)
+      ...
+"""
+    filename = None
+    chromSizes = {}
+    itemsPerSlot = 1024         # Items per compressed block
+    blockSize = 256             # Children per node in the indexes
+    nzooms = 10                 # Maximum number of zoom levels
+    compress = True
+    reductions = None           # Zoom level reductions, set on the first chromosome
+    zooms = []                  # Zoom records for each zoom level
+    chroms = []                 # Chromosome names, in order of id
+    sizes = []                  # Chromosome sizes, in order of id
+    blocks = []                 # R-tree items for the data blocks (with offsets in tmp)
+    maxBlock = 0                # Size of the largest uncompressed block
+    tmp = None                  # Temporary file for the data blocks
+    chrom = None                # Current chromosome
+    lastEnd = 0
+
+    def __init__(self, filename, chromSizes=None, itemsPerSlot=1024, blockSize=256, nzooms=10, compress=True):
+        self.filename = filename
+        self.chromSizes = dict(chromSizes) if chromSizes else {}
+        self.itemsPerSlot = itemsPerSlot
+        self.blockSize = blockSize
+        self.nzooms = nzooms
+        self.compress = compress
+        self.zooms = []
+        self.chroms = []
+        self.sizes = []
+        self.blocks = []
+        self.starts = []
+        self.ends = []
+        self.values = []
+        self.total = [0, np.inf, -np.inf, 0.0, 0.0]
+        self.tmp = tempfile.TemporaryFile()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.tmp.close()
+
+    def add(self, chrom, start, end, value):
+        """Add an item covering bases `start' to `end' of `chrom' with value `value'."""
+        if chrom != self.chrom:
+            self.startChrom(chrom)
+        elif start < self.lastEnd:
+            raise ValueError("Items for chromosome {} are not sorted or overlap at position {}.".format(chrom, start))
+        self.starts.append(start)
+        self.ends.append(end)
+        self.values.append(value)
+        self.lastEnd = end
+
+    def addArrays(self, chrom, starts, ends, values):
+        """Add all items for chromosome `chrom' at once, from three arrays."""
+        self.startChrom(chrom)
+        self.starts = starts
+        self.ends = ends
+        self.values = values
+        self.flushChrom()
+
+    def startChrom(self, chrom):
+        self.flushChrom()
+        if chrom in self.chroms:
+            raise ValueError("Items for chromosome {} are not contiguous.".format(chrom))
+        self.chrom = chrom
+        self.lastEnd = 0
+
+    def writeBlock(self, data):
+        """Write a block of data to the temporary file, returning its offset and size."""
+        self.maxBlock = max(self.maxBlock, len(data))
+        if self.compress:
+            data = zlib.compress(data)
+        offset = self.tmp.tell()
+        self.tmp.write(data)
+        return (offset, len(data))
+
+    def flushChrom(self):
+        """Write the data blocks and compute the zoom records for the current chromosome."""
+        if self.chrom is None:
+            return
+        starts = np.asarray(self.starts, dtype=np.int64)
+        ends = np.asarray(self.ends, dtype=np.int64)
+        values = np.asarray(self.values, dtype=np.float32)
+        chromId = len(self.chroms)
+        self.chroms.append(self.chrom)
+        self.sizes.append(max(self.chromSizes.get(self.chrom, 0), int(ends[-1]) if len(ends) else 0))
+        self.chrom = None
+        self.starts = []
+        self.ends = []
+        self.values = []
+        if len(starts) == 0:
+            return
+        if np.any(starts[1:] < ends[:-1]) or np.any(ends <= starts):
+            raise ValueError("Items for chromosome {} are not sorted, overlap, or are empty.".format(self.chroms[-1]))
+
+        for i in range(0, len(starts), self.itemsPerSlot):
+            s = starts[i:i+self.itemsPerSlot]
+            e = ends[i:i+self.itemsPerSlot]
+            v = values[i:i+self.itemsPerSlot]
+            span = e[0] - s[0]
+            step = s[1] - s[0] if len(s) > 1 else span
+            if np.all(e - s == span) and np.all(s == s[0] + step * np.arange(len(s))):
+                # Equally spaced items of the same size: fixedStep section
+                data = SECTIONHEADER.pack(chromId, s[0], e[-1], step, span, 3, 0, len(s)) + v.astype('<f4').tobytes()
+            else:
+                items = np.zeros(len(s), dtype=BEDGRAPH_ITEM)
+                items['start'] = s
+                items['end'] = e
+                items['value'] = v
+                data = SECTIONHEADER.pack(chromId, s[0], e[-1], 0, 0, 1, 0, len(s)) + items.tobytes()
+            (offset, size) = self.writeBlock(data)
+            self.blocks.append((chromId, int(s[0]), chromId, int(e[-1]), offset, size))
+
+        w = (ends - starts).astype(np.float64)
+        v64 = values.astype(np.float64)
+        self.total[0] += int(w.sum())
+        self.total[1] = min(self.total[1], float(v64.min()))
+        self.total[2] = max(self.total[2], float(v64.max()))
+        self.total[3] += float((v64 * w).sum())
+        self.total[4] += float((v64 * v64 * w).sum())
+
+        if self.reductions is None:
+            r = max(int(np.median(w)), 1) * 4
+            self.reductions = [ r * 4**i for i in range(self.nzooms) ]
+            self.zooms = [ [] for r in self.reductions ]
+        for z, r in enumerate(self.reductions):
+            self.zooms[z].append(zoomRecords(chromId, starts, ends, values, r))
+
+    def close(self):
+        self.flushChrom()
+        for chrom in sorted(self.chromSizes):
+            if chrom not in self.chroms:
+                self.chroms.append(chrom)
+                self.sizes.append(self.chromSizes[chrom])
+        reductions = []
+        zooms = []
+        if self.reductions:
+            # Drop zoom levels coarser than the longest chromosome, keeping at least one
+            longest = max(self.sizes)
+            for r, recs in zip(self.reductions, self.zooms):
+                if not reductions or r <= longest:
+                    reductions.append(r)
+                    zooms.append(np.concatenate(recs))
+        summaryOffset = HEADER.size + ZOOMHEADER.size * len(reductions)
+
+        with open(self.filename, "wb") as out:
+            out.write(b"\0" * summaryOffset)
+            if self.blocks:
+                out.write(SUMMARY.pack(*self.total))
+            else:
+                out.write(b"\0" * SUMMARY.size)
+
+            chromTreeOffset = out.tell()
+            self.writeChromTree(out)
+
+            dataOffset = out.tell()
+            out.write(struct.pack("<Q", len(self.blocks)))
+            base = out.tell()
+            self.tmp.seek(0)
+            while True:
+                buf = self.tmp.read(1 << 20)
+                if not buf:
+                    break
+                out.write(buf)
+            self.tmp.close()
+            indexOffset = out.tell()
+            writeRTree(out, [ (sc, sb, ec, eb, base + o, l) for (sc, sb, ec, eb, o, l) in self.blocks ],
+                       self.blockSize, self.itemsPerSlot)
+
+            zoomOffsets = []
+            for recs in zooms:
+                zoomDataOffset = out.tell()
+                out.write(struct.pack("<I", len(recs)))
+                zblocks = []
+                for i in range(0, len(recs), self.itemsPerSlot):
+                    r = recs[i:i+self.itemsPerSlot]
+                    data = r.tobytes()
+                    self.maxBlock = max(self.maxBlock, len(data))
+                    if self.compress:
+                        data = zlib.compress(data)
+                    # Blocks of zoom records may span more than one chromosome
+                    zblocks.append((int(r['chrom'][0]), int(r['start'][0]), int(r['chrom'][-1]), int(r['end'][-1]), out.tell(), len(data)))
+                    out.write(data)
+                zoomIndexOffset = out.tell()
+                writeRTree(out, zblocks, self.blockSize, self.itemsPerSlot)
+                zoomOffsets.append((zoomDataOffset, zoomIndexOffset))
+
+            out.seek(0)
+            out.write(HEADER.pack(BIGWIG_MAGIC, 4, len(reductions), chromTreeOffset, dataOffset, indexOffset,
+                                  0, 0, 0, summaryOffset, self.maxBlock if self.compress else 0, 0))
+            for r, (zdata, zindex) in zip(reductions, zoomOffsets):
+                out.write(ZOOMHEADER.pack(r, 0, zdata, zindex))
+
+    def writeChromTree(self, out):
+        """Write the chromosome B+ tree as a single leaf node, with keys sorted by name."""
+        keySize = max([ len(c) for c in self.chroms ] + [1])
+        out.write(BPTHEADER.pack(BPT_MAGIC, max(len(self.chroms), 1), keySize, 8, len(self.chroms), 0))
+        out.write(NODEHEADER.pack(1, 0, len(self.chroms)))
+        for name, cid in sorted([ (c, i) for i, c in enumerate(self.chroms) ]):
+            out.write(name.encode("ascii").ljust(keySize, b"\0"))
+            out.write(struct.pack("<II", cid, self.sizes[cid]))
+
+### Reader
+
+class BigWigReader():
+    """Read a bigWig file, accessing only the blocks overlapping the regions requested.
+
+  with BigWigReader("track.bw") as bw:
+      (starts, ends, values) = bw.intervals("chr1", 10000, 20000)
+      means = bw.stats("chr1", 0, 1000000, nbins=100)
+"""
+    filename = None
+    stream = None
+    chroms = {}                 # Chromosome name -> (id, size)
+    zoomLevels = []             # List of (reduction, data offset, index offset)
+    compressed = True
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.stream = open(filename, "rb")
+        hdr = HEADER.unpack(self.stream.read(HEADER.size))
+        if hdr[0] != BIGWIG_MAGIC:
+            raise ValueError("File {} is not a bigWig file.".format(filename))
+        (magic, self.version, nzooms, self.chromTreeOffset, self.dataOffset, self.indexOffset,
+         fc, dfc, aso, self.summaryOffset, self.uncompressBufSize, ext) = hdr
+        self.compressed = (self.uncompressBufSize > 0)
+        self.zoomLevels = []
+        for i in range(nzooms):
+            (r, res, zdata, zindex) = ZOOMHEADER.unpack(self.stream.read(ZOOMHEADER.size))
+            self.zoomLevels.append((r, zdata, zindex))
+        self.chroms = {}
+        self.readChromTree()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+    def close(self):
+        self.stream.close()
+
+    def read(self, offset, size):
+        self.stream.seek(offset)
+        return self.stream.read(size)
+
+    def readChromTree(self):
+        (magic, blockSize, keySize, valSize, count, res) = BPTHEADER.unpack(self.read(self.chromTreeOffset, BPTHEADER.size))
+        if magic != BPT_MAGIC:
+            raise ValueError("Bad chromosome tree in file {}.".format(self.filename))
+        self.readBPTNode(self.chromTreeOffset + BPTHEADER.size, keySize)
+
+    def readBPTNode(self, offset, keySize):
+        (isLeaf, res, count) = NODEHEADER.unpack(self.read(offset, NODEHEADER.size))
+        data = self.stream.read(count * (keySize + 8))
+        for i in range(count):
+            item = data[i*(keySize+8):(i+1)*(keySize+8)]
+            if isLeaf:
+                (cid, size) = struct.unpack("<II", item[keySize:])
+                self.chroms[item[:keySize].rstrip(b"\0").decode("ascii")] = (cid, size)
+            else:
+                self.readBPTNode(struct.unpack("<Q", item[keySize:])[0], keySize)
+
+    def chromSizes(self):
+        """Returns a list of (name, size) for the chromosomes in this file, in order of id."""
+        return [ (name, self.chroms[name][1]) for name in sorted(self.chroms, key=lambda c: self.chroms[c][0]) ]
+
+    def summary(self):
+        """Returns a dictionary with the statistics for the whole file."""
+        (n, mn, mx, s, ss) = SUMMARY.unpack(self.read(self.summaryOffset, SUMMARY.size))
+        return {'basesCovered': n, 'min': mn, 'max': mx, 'sum': s, 'sumSquares': ss}
+
+    def findBlocks(self, indexOffset, cid, start, end):
+        """Returns the (offset, size) of the blocks indexed by the R-tree at `indexOffset' that
+overlap `start'-`end' on chromosome `cid'."""
+        blocks = []
+        self.searchRTree(indexOffset + CIRHEADER.size, cid, start, end, blocks)
+        return blocks
+
+    def searchRTree(self, offset, cid, start, end, blocks):
+        (isLeaf, res, count) = NODEHEADER.unpack(self.read(offset, NODEHEADER.size))
+        item = LEAFITEM if isLeaf else NODEITEM
+        data = self.stream.read(count * item.size)
+        for i in range(count):
+            it = item.unpack_from(data, i * item.size)
+            if (it[0], it[1]) < (cid, end) and (it[2], it[3]) > (cid, start):
+                if isLeaf:
+                    blocks.append((it[4], it[5]))
+                else:
+                    self.searchRTree(it[4], cid, start, end, blocks)
+
+    def readBlock(self, offset, size):
+        data = self.read(offset, size)
+        if self.compressed:
+            data = zlib.decompress(data)
+        return data
+
+    def region(self, chrom, start, end):
+        if chrom not in self.chroms:
+            raise KeyError("Chromosome {} not found in file {}.".format(chrom, self.filename))
+        (cid, size) = self.chroms[chrom]
+        if end is None:
+            end = size
+        return (cid, start, end)
+
+    def intervals(self, chrom, start=0, end=None):
+        """Returns the items overlapping `start'-`end' on chromosome `chrom' (the whole chromosome
+by default) as a tuple of three arrays (starts, ends, values)."""
+        (cid, start, end) = self.region(chrom, start, end)
+        starts = []
+        ends = []
+        values = []
+        for (offset, size) in self.findBlocks(self.indexOffset, cid, start, end):
+            data = self.readBlock(offset, size)
+            (bchrom, bstart, bend, step, span, btype, res, count) = SECTIONHEADER.unpack_from(data)
+            if btype == 1:
+                items = np.frombuffer(data, dtype=BEDGRAPH_ITEM, count=count, offset=SECTIONHEADER.size)
+                s = items['start'].astype(np.int64)
+                e = items['end'].astype(np.int64)
+                v = items['value']
+            elif btype == 2:
+                items = np.frombuffer(data, dtype=VARSTEP_ITEM, count=count, offset=SECTIONHEADER.size)
+                s = items['start'].astype(np.int64)
+                e = s + span
+                v = items['value']
+            else:
+                s = bstart + step * np.arange(count, dtype=np.int64)
+                e = s + span
+                v = np.frombuffer(data, dtype='<f4', count=count, offset=SECTIONHEADER.size)
+            good = (e > start) & (s < end)
+            starts.append(s[good])
+            ends.append(e[good])
+            values.append(v[good])
+        if not starts:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        return (np.concatenate(starts), np.concatenate(ends), np.concatenate(values))
+
+    def values(self, chrom, start=0, end=None):
+        """Returns an array with the value at each base from `start' to `end' (NaN where there is no data)."""
+        (cid, start, end) = self.region(chrom, start, end)
+        result = np.full(end - start, np.nan, dtype=np.float32)
+        (s, e, v) = self.intervals(chrom, start, end)
+        for i in range(len(s)):
+            result[max(s[i], start) - start:min(e[i], end) - start] = v[i]
+        return result
+
+    def zoomRecords(self, zoom, cid, start, end):
+        (r, zdata, zindex) = self.zoomLevels[zoom]
+        recs = []
+        for (offset, size) in self.findBlocks(zindex, cid, start, end):
+            data = self.readBlock(offset, size)
+            z = np.frombuffer(data, dtype=ZOOM_RECORD)
+            recs.append(z[(z['chrom'] == cid) & (z['end'] > start) & (z['start'] < end)])
+        if not recs:
+            return np.zeros(0, dtype=ZOOM_RECORD)
+        return np.concatenate(recs)
+
+    def stats(self, chrom, start=0, end=None, nbins=1, stat="mean", exact=False):
+        """Returns an array with statistic `stat' (mean, min, max, sum, std, coverage) for `nbins'
+equal bins covering `start'-`end' on chromosome `chrom'. Unless `exact' is True, the values
+are computed from the coarsest zoom level whose bins are at most half the requested bin size,
+if there is one, otherwise from the data."""
+        (cid, start, end) = self.region(chrom, start, end)
+        best = None
+        if not exact:
+            for z, (r, zdata, zindex) in enumerate(self.zoomLevels):
+                if r * 2 <= (end - start) // nbins and (best is None or r > self.zoomLevels[best][0]):
+                    best = z
+        if best is None:
+            (s, e, v) = self.intervals(chrom, start, end)
+            recs = np.zeros(len(s), dtype=[('start', np.int64), ('end', np.int64), ('valid', np.float64), ('min', np.float64),
+                                           ('max', np.float64), ('sum', np.float64), ('sumsq', np.float64)])
+            recs['start'] = s
+            recs['end'] = e
+            recs['valid'] = e - s
+            recs['min'] = v
+            recs['max'] = v
+            recs['sum'] = v * recs['valid']
+            recs['sumsq'] = v * recs['sum']
+        else:
+            recs = self.zoomRecords(best, cid, start, end)
+        return binStats(recs, start, end, nbins, stat)
+
+### Conversion of text tracks
+
+def flattenIntervals(items):
+    """Resolve overlaps between `items', a list of (start, end, value) tuples for one chromosome
+in any order: the covered bases are split at each start and end, and each piece gets the mean
+value of the items covering it. Returns a sorted list of non-overlapping (start, end, value)
+tuples, suitable for BigWigWriter.add(). Items that do not overlap are returned unchanged."""
+    events = []
+    for (start, end, value) in items:
+        if end > start:
+            events.append((start, 1, value))
+            events.append((end, 0, value))
+    events.sort()               # At the same position, ends come before starts
+    result = []
+    active = []                 # Values of the items covering the current position
+    prev = 0
+    for (pos, isStart, value) in events:
+        if active and pos > prev:
+            result.append((prev, pos, 1.0 * sum(active) / len(active)))
+        if isStart:
+            active.append(value)
+        else:
+            active.remove(value)
+        prev = pos
+    return result
+
+def textToBigWig(infile, outfile, chromSizes=None):
+    """Convert a bedGraph or WIG (fixedStep or variableStep) file to bigWig format. Lines with
+four or more fields are read as bedGraph records. Returns the number of items written."""
+    n = 0
+    mode = None
+    chrom = None
+    pos = 0
+    step = span = 1
+    with open(infile, "r") as f, BigWigWriter(outfile, chromSizes) as bw:
+        for line in f:
+            if line.startswith("track") or line.startswith("#") or line.startswith("browser"):
+                continue
+            if line.startswith("fixedStep") or line.startswith("variableStep"):
+                mode = line.split()[0]
+                params = dict([ p.split("=") for p in line.split()[1:] ])
+                chrom = params['chrom']
+                step = int(params.get('step', 1))
+                span = int(params.get('span', 1))
+                pos = int(params.get('start', 1)) - 1 # WIG coordinates are 1-based
+                continue
+            parsed = line.split()
+            if not parsed:
+                continue
+            if len(parsed) >= 4:
+                bw.add(parsed[0], int(parsed[1]), int(parsed[2]), float(parsed[3]))
+            elif mode == "fixedStep":
+                bw.add(chrom, pos, pos + span, float(parsed[0]))
+                pos += step
+            elif mode == "variableStep":
+                p = int(parsed[0]) - 1
+                bw.add(chrom, p, p + span, float(parsed[1]))
+            n += 1
+    return n
+
+def readChromSizes(filename):
+    """Read a chromosome sizes file (name and size, tab-delimited) or the header of a BAM file."""
+    if filename.endswith(".bam"):
+        import pysam
+        with pysam.AlignmentFile(filename, "rb") as b:
+            return zip(b.references, b.lengths)
+    sizes = []
+    with open(filename, "r") as f:
+        for line in f:
+            parsed = line.split()
+            if len(parsed) >= 2:
+                sizes.append((parsed[0], int(parsed[1])))
+    return sizes
+
+def usage():
+    sys.stderr.write("""BigWig.py - Write and query bigWig files.
+
+Usage: BigWig.py convert [-g G] infile outfile
+       BigWig.py info file.bw
+       BigWig.py query [-n N] [-s S] [-x] file.bw chrom[:start-end]
+
+Commands:
+
+  convert | Convert a bedGraph or WIG (fixedStep/variableStep) file to bigWig.
+            -g G: read chromosome sizes from G (a tab-delimited file with name and
+            size, or a BAM file). Otherwise, chromosome sizes are set to the end of
+            the last item on each chromosome.
+  info    | Print chromosomes, zoom levels and summary statistics.
+  query   | Print statistic S (mean, min, max, sum, std, coverage; default: mean)
+            for N equal bins (default: 1) covering the specified region. With -x,
+            statistics are computed from the data instead of the zoom levels.
+
+""")
+
+P = Script.Script("BigWig.py", version="1.0", usage=usage)
+
+def main(args):
+    P.standardOpts(args)
+    if not args:
+        return usage()
+    cmd = args[0]
+    files = []
+    nbins = 1
+    stat = "mean"
+    exact = False
+    sizesfile = None
+    prev = ""
+    for a in args[1:]:
+        if prev == "-g":
+            sizesfile = P.isFile(a)
+            prev = ""
+        elif prev == "-n":
+            nbins = P.toInt(a)
+            prev = ""
+        elif prev == "-s":
+            stat = a
+            prev = ""
+        elif a in ["-g", "-n", "-s"]:
+            prev = a
+        elif a == "-x":
+            exact = True
+        else:
+            files.append(a)
+
+    if cmd == "convert" and len(files) == 2:
+        n = textToBigWig(P.isFile(files[0]), files[1], readChromSizes(sizesfile) if sizesfile else None)
+        sys.stderr.write("{} items written to {}.\n".format(n, files[1]))
+    elif cmd == "info" and len(files) == 1:
+        with BigWigReader(P.isFile(files[0])) as bw:
+            sys.stdout.write("Version: {}\n".format(bw.version))
+            for (name, size) in bw.chromSizes():
+                sys.stdout.write("{}\t{}\n".format(name, size))
+            sys.stdout.write("Zoom levels: {}\n".format(" ".join([ str(z[0]) for z in bw.zoomLevels ])))
+            for (k, v) in sorted(bw.summary().items()):
+                sys.stdout.write("{}: {}\n".format(k, v))
+    elif cmd == "query" and len(files) == 2:
+        region = files[1]
+        with BigWigReader(P.isFile(files[0])) as bw:
+            if ":" in region:
+                (chrom, coords) = region.split(":")
+                (start, end) = [ int(c.replace(",", "")) for c in coords.split("-") ]
+            else:
+                (chrom, start, end) = (region, 0, None)
+            values = bw.stats(chrom, start, end, nbins=nbins, stat=stat, exact=exact)
+            (cid, start, end) = bw.region(chrom, start, end)
+            edges = start + (np.arange(nbins + 1, dtype=np.int64) * (end - start)) // nbins
+            for i in range(nbins):
+                sys.stdout.write("{}\t{}\t{}\t{}\n".format(chrom, edges[i], edges[i+1], values[i]))
+    else:
+        usage()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,12 +1,22 @@
 #!/usr/bin/env python
 
 import os
+import gc
 import sys
 import os.path
 import sqlite3 as sql
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 import Utils
 
+# If True, GeneLoader.load() keeps a cache of the parsed genes next to the source file.
+USECACHE = True
+CACHEVERSION = 1
+
 def parseStartEnd(s):
     """Parse a range specification in Genbank format. It can contain complement and join operations."""
     cl = len('complement')
@@ -859,6 +869,7 @@ class GeneLoader():
     filename = ""
     currGene = None
     currTranscript = None
+    cacheable = True            # Can the Genelist produced by this loader be cached?
 
     def __init__(self, filename):
         self.filename = filename
@@ -874,15 +885,72 @@ class GeneLoader():
         chrom = "chr" + chrom
         return chrom
 
-    def load(self, sort=True, index=True, preload=True):
+    def load(self, sort=True, index=True, preload=True, cache=None):
+        """Load genes from `filename' and return a Genelist. If `cache' is True (default: the value
+of USECACHE), the Genelist is saved in binary form to `filename'.glcache, and read from there
+on later calls, as long as the source file's size and modification time do not change."""
+        if cache is None:
+            cache = USECACHE
+        cache = cache and self.cacheable
+        if cache:
+            gl = self.readCache(sort, index)
+            if gl:
+                self.gl = gl
+                return gl
         self._load(preload=preload)
         if sort:
             self.gl.sortGenes()
         if index:
             self.gl.buildIndexes()
         self.gl.source = self.filename
+        if cache:
+            self.writeCache(sort, index)
         return self.gl
 
+    def cacheFile(self):
+        return self.filename + ".glcache"
+
+    def cacheStamp(self, sort, index):
+        """Returns the data used to check that a cache file is valid for the current source file and options."""
+        st = os.stat(self.filename)
+        return (CACHEVERSION, self.__class__.__name__, st.st_size, st.st_mtime, sort, index)
+
+    def readCache(self, sort, index):
+        """Returns the Genelist stored in the cache file, or None if the cache is missing or out of date."""
+        cachefile = self.cacheFile()
+        if not os.path.isfile(cachefile):
+            return None
+        gcstate = gc.isenabled()
+        gc.disable()            # The collector slows down (un)pickling of many small objects considerably
+        try:
+            with open(cachefile, "rb") as f:
+                if pickle.load(f) != self.cacheStamp(sort, index):
+                    return None
+                return pickle.load(f)
+        except Exception:
+            return None
+        finally:
+            if gcstate:
+                gc.enable()
+
+    def writeCache(self, sort, index):
+        """Save the Genelist to the cache file. Failures (e.g. a read-only directory) are ignored."""
+        cachefile = self.cacheFile()
+        tmpfile = "{}.{}.tmp".format(cachefile, os.getpid())
+        gcstate = gc.isenabled()
+        gc.disable()
+        try:
+            with open(tmpfile, "wb") as f:
+                pickle.dump(self.cacheStamp(sort, index), f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(self.gl, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpfile, cachefile)
+        except (IOError, OSError, pickle.PicklingError):
+            if os.path.isfile(tmpfile):
+                os.remove(tmpfile)
+        finally:
+            if gcstate:
+                gc.enable()
+
 class refGeneLoader(GeneLoader):
     genes = {}                  # Dictionary of genes by name
 
@@ -1126,6 +1194,7 @@ class GFFloader(GeneLoader):
 
 class DBloader(GeneLoader):
     conn = None
+    cacheable = False           # The database is already in binary form, and may not be preloaded
 
     def _load(self, preload=True, wanted=[], notwanted=[]):
         self.gl = GenelistDB()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python
+
+### Columnar binary format for methylation data
+
+## This module converts methylation BED files (as produced by mcall: chrom, start, end,
+## % methylation, coverage, methylated Cs) and -mat files (chrom, pos, two summary columns,
+## one methylation rate per sample) to a binary format that can be read back without parsing
+## any text. Layout of a file:
+##
+##   magic (8 bytes)
+##   chunks                     for each chunk of up to CHUNKSIZE consecutive sites on the same
+##                              chromosome, one array per column, one after the other
+##   index                      zlib-compressed JSON: kind of data, column names and types, header
+##                              of the original file, and (chrom, offset, nsites) for each chunk
+##   trailer (24 bytes)         offset and size of the index, magic
+##
+## All numbers are little-endian. Missing values (NA) in -mat files are stored as NaN.
+## The reader classes (BinBEDreader, BinMETHreader, BinMATreader) have the same interface as
+## the corresponding classes in Utils, and can also return the data for a whole chromosome as
+## a set of arrays (chromArrays()). Use openBEDreader(), openMETHreader() and openMATreader() to
+## get the right reader for a file in either format.
+
+import sys
+import zlib
+import json
+import struct
+
+import numpy as np
+
+import Script
+import Utils
+
+MAGIC = "METHBIN1"
+TRAILER = struct.Struct("<QQ8s")
+CHUNKSIZE = 1000000             # Maximum number of sites in a chunk
+
+# Columns of the two kinds of files. -mat files also have one float64 column per sample.
+BEDCOLUMNS = [("pos", "<i8"), ("end", "<i8"), ("pct", "<f8"), ("cov", "<i4"), ("meth", "<i4")]
+MATCOLUMNS = [("pos", "<i8"), ("col3", "<f8"), ("col4", "<f8")]
+
+def isMethBin(filename):
+    """Returns True if `filename' is in binary methylation format."""
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+class MethBinWriter():
+    """Write a binary methylation file. Call addChunk() for each chunk of sites, in order,
+then close()."""
+    filename = None
+    kind = "bed"
+    columns = []                # List of (name, dtype)
+    header = []                 # Header of the original file
+    chunks = []                 # List of (chrom, offset, nsites)
+    out = None
+
+    def __init__(self, filename, kind, columns, header=None):
+        self.filename = filename
+        self.kind = kind
+        self.columns = columns
+        self.header = header or []
+        self.chunks = []
+        self.out = open(filename, "wb")
+        self.out.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+    def addChunk(self, chrom, arrays):
+        """Write a chunk of sites on `chrom'. `arrays' contains one array for each column."""
+        n = len(arrays[0])
+        if n == 0:
+            return
+        offset = self.out.tell()
+        for (a, (name, dtype)) in zip(arrays, self.columns):
+            if len(a) != n:
+                raise ValueError("Column {} has {} values instead of {}.".format(name, len(a), n))
+            self.out.write(np.asarray(a, dtype=dtype).tobytes())
+        self.chunks.append((chrom, offset, n))
+
+    def close(self):
+        if self.out is None:
+            return
+        index = json.dumps({'version': 1,
+                            'kind': self.kind,
+                            'columns': self.columns,
+                            'header': self.header,
+                            'chunks': self.chunks})
+        data = zlib.compress(index)
+        offset = self.out.tell()
+        self.out.write(data)
+        self.out.write(TRAILER.pack(offset, len(data), MAGIC))
+        self.out.close()
+        self.out = None
+
+class MethBinFile():
+    """Read a binary methylation file."""
+    filename = None
+    kind = "bed"
+    columns = []                # List of (name, dtype)
+    header = []
+    chunks = []                 # List of (chrom, offset, nsites), in file order
+    chroms = []                 # Chromosomes, in file order
+    stream = None
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.stream = open(filename, "rb")
+        if self.stream.read(len(MAGIC)) != MAGIC:
+            raise IOError("File {} is not in binary methylation format.".format(filename))
+        self.stream.seek(-TRAILER.size, 2)
+        (offset, size, magic) = TRAILER.unpack(self.stream.read(TRAILER.size))
+        if magic != MAGIC:
+            raise IOError("File {} is truncated.".format(filename))
+        self.stream.seek(offset)
+        index = json.loads(zlib.decompress(self.stream.read(size)))
+        self.kind = str(index['kind'])
+        self.columns = [ (str(name), str(dtype)) for (name, dtype) in index['columns'] ]
+        self.header = [ str(h) for h in index['header'] ]
+        self.chunks = [ (str(chrom), offset, n) for (chrom, offset, n) in index['chunks'] ]
+        self.chroms = []
+        for c in self.chunks:
+            if c[0] not in self.chroms:
+                self.chroms.append(c[0])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+    def close(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+    def columnNames(self):
+        return [ c[0] for c in self.columns ]
+
+    def readChunk(self, i):
+        """Returns the arrays (one for each column) of chunk `i'."""
+        (chrom, offset, n) = self.chunks[i]
+        self.stream.seek(offset)
+        return [ np.fromfile(self.stream, dtype=dtype, count=n) for (name, dtype) in self.columns ]
+
+    def nsites(self, chrom=None):
+        """Returns the number of sites on `chrom', or in the whole file."""
+        return sum([ c[2] for c in self.chunks if chrom is None or c[0] == chrom ])
+
+    def chromArrays(self, chrom):
+        """Returns a dictionary containing the whole data for chromosome `chrom', as one array
+for each column (empty if `chrom' is not in the file)."""
+        parts = [ self.readChunk(i) for i in range(len(self.chunks)) if self.chunks[i][0] == chrom ]
+        result = {}
+        for (j, (name, dtype)) in enumerate(self.columns):
+            result[name] = np.concatenate([ p[j] for p in parts ]) if parts else np.zeros(0, dtype=dtype)
+        return result
+
+### Readers with the same interface as Utils.BEDreader and its subclasses
+
+class BinBEDreader(Utils.BEDreader):
+    """Like Utils.BEDreader, reading a binary methylation file. Records are read one chunk
+at a time; `stream' is set to None when the file is finished."""
+    mbf = None
+    _chunk = -1                 # Index of current chunk
+    _rows = []                  # Rows of current chunk
+    _row = 0                    # Index of next row in _rows
+
+    def __init__(self, filename, skipHdr=True, jump=False):
+        self.filename = filename
+        self.mbf = MethBinFile(filename)
+        self.stream = self.mbf.stream
+        self._chunk = -1
+        self._rows = []
+        self._row = 0
+        if jump:
+            if jump in self.mbf.chroms:
+                sys.stderr.write("Jumping to {}\n".format(jump))
+                self.skipToChrom(jump)
+            else:
+                sys.stderr.write("Warning: `{}' not found in file.\n".format(jump))
+        elif skipHdr:
+            self.readNext()
+
+    def close(self):
+        self.mbf.close()
+        self.stream = None
+
+    def storeCurrent(self, row):
+        self.current = [float(row[3]), float(row[4]), str(row[0])]
+
+    def loadChunk(self, i):
+        self._chunk = i
+        self.chrom = self.mbf.chunks[i][0]
+        self._rows = zip(*[ a.tolist() for a in self.mbf.readChunk(i) ])
+        self._row = 0
+
+    def readNext(self):
+        """Read the next site and store it in the `current' attribute. Also sets `chrom'
+and `pos'."""
+        if self.stream is None:
+            return None
+        while self._row == len(self._rows):
+            if self._chunk + 1 == len(self.mbf.chunks):
+                self.close()
+                return None
+            self.loadChunk(self._chunk + 1)
+        row = self._rows[self._row]
+        self._row += 1
+        self.pos = row[0]
+        self.storeCurrent(row)
+        return True
+
+    def skipToChrom(self, chrom):
+        """Move to the first site on `chrom' following the current one, using the index."""
+        if self.stream is None or self.chrom == chrom:
+            return
+        for i in range(self._chunk + 1, len(self.mbf.chunks)):
+            if self.mbf.chunks[i][0] == chrom:
+                self.loadChunk(i)
+                self.readNext()
+                return
+        self.close()
+
+    def chromArrays(self, chrom):
+        """Returns the whole data for chromosome `chrom' (see MethBinFile.chromArrays())."""
+        return self.mbf.chromArrays(chrom)
+
+class BinMETHreader(BinBEDreader):
+
+    def storeCurrent(self, row):
+        self.current = [self.chrom, row[0], row[2]]
+
+class BinMATreader(BinBEDreader):
+    """Like Utils.MATreader. Values in `current' are floats, or 'NA' for missing values
+(Utils.MATreader returns strings)."""
+    hdr = None
+    nreps = 0
+
+    def __init__(self, filename):
+        BinBEDreader.__init__(self, filename, skipHdr=False)
+        self.hdr = self.mbf.header
+        self.nreps = len(self.mbf.columns) - 3
+        self.readNext()
+
+    def loadChunk(self, i):
+        self._chunk = i
+        self.chrom = self.mbf.chunks[i][0]
+        cols = []
+        for a in self.mbf.readChunk(i):
+            values = a.tolist()
+            if a.dtype.kind == 'f':
+                for j in np.flatnonzero(np.isnan(a)).tolist():
+                    values[j] = 'NA'
+            cols.append(values)
+        self._rows = zip(*cols)
+        self._row = 0
+
+    def storeCurrent(self, row):
+        self.current = list(row[3:])
+
+def openBEDreader(filename, skipHdr=True, jump=False):
+    """Returns a BinBEDreader if `filename' is in binary format, a Utils.BEDreader otherwise."""
+    if isMethBin(filename):
+        return BinBEDreader(filename, skipHdr=skipHdr, jump=jump)
+    return Utils.BEDreader(filename, skipHdr=skipHdr, jump=jump)
+
+def openMETHreader(filename, skipHdr=True, jump=False):
+    """Returns a BinMETHreader if `filename' is in binary format, a Utils.METHreader otherwise."""
+    if isMethBin(filename):
+        return BinMETHreader(filename, skipHdr=skipHdr, jump=jump)
+    return Utils.METHreader(filename, skipHdr=skipHdr, jump=jump)
+
+def openMATreader(filename):
+    """Returns a BinMATreader if `filename' is in binary format, a Utils.MATreader otherwise."""
+    if isMethBin(filename):
+        return BinMATreader(filename)
+    return Utils.MATreader(filename)
+
+### Conversion from text
+
+def detectKind(filename):
+    """Returns "mat" if the first non-comment line of `filename' is a header (second field
+not an integer), "bed" otherwise."""
+    with open(filename, "r") as f:
+        for line in f:
+            if line.strip() and line[0] != '#':
+                fields = line.rstrip("\r\n").split("\t")
+                return "bed" if len(fields) > 1 and Utils.safeInt(fields[1], None) is not None else "mat"
+    return "bed"
+
+def textToMethBin(infile, outfile, kind=None, chunksize=CHUNKSIZE):
+    """Convert methylation BED or -mat file `infile' to binary file `outfile'. `kind' is
+"bed" or "mat" (detected from the contents of the file if not specified). Returns the
+number of sites written."""
+    kind = kind or detectKind(infile)
+    nsites = 0
+    with open(infile, "r") as f:
+        if kind == "mat":
+            header = Utils.readDelim(f)
+            nreps = len(header) - 4
+            columns = MATCOLUMNS + [ ("s{}".format(i+1), "<f8") for i in range(nreps) ]
+            types = {1: np.int64}
+        else:
+            header = []
+            columns = BEDCOLUMNS
+            types = {1: np.int64, 2: np.int64, 3: np.float64, 4: np.int32, 5: np.int32}
+        ncols = len(columns)
+        with MethBinWriter(outfile, kind, columns, header) as W:
+            chrom = None
+            parts = []          # Arrays for the current chunk, as lists of arrays for each column
+            nparts = 0
+            for block in Utils.FastCSVreader(f, types=types).blocks():
+                chroms = np.array(block.column(0))
+                cols = []
+                for j in range(ncols):
+                    if j + 1 in types:
+                        cols.append(block.column(j + 1))
+                    else:
+                        cols.append(Utils._floatColumn(block.column(j + 1))[0])
+                # Split the block where the chromosome changes
+                breaks = [0] + (np.flatnonzero(chroms[1:] != chroms[:-1]) + 1).tolist() + [len(chroms)]
+                for (a, b) in zip(breaks[:-1], breaks[1:]):
+                    while a < b:
+                        if chroms[a] != chrom or nparts == chunksize:
+                            if nparts:
+                                W.addChunk(chrom, [ np.concatenate(p) for p in parts ])
+                            chrom = str(chroms[a])
+                            parts = [ [] for j in range(ncols) ]
+                            nparts = 0
+                        e = min(b, a + chunksize - nparts)
+                        for j in range(ncols):
+                            parts[j].append(cols[j][a:e])
+                        nparts += e - a
+                        nsites += e - a
+                        a = e
+            if nparts:
+                W.addChunk(chrom, [ np.concatenate(p) for p in parts ])
+    return nsites
+
+### Command line
+
+def usage():
+    sys.stderr.write("""MethBin.py - Convert methylation data to a columnar binary format.
+
+Usage: MethBin.py convert [-b | -m] infile outfile
+       MethBin.py info file
+       MethBin.py dump file [chrom]
+
+Commands:
+
+  convert | Convert a methylation BED file (chrom, start, end, % methylation, coverage,
+            methylated Cs) or a -mat file (header line, then chrom, pos, two summary
+            columns, one methylation rate for each sample) to binary format. The type
+            of file is detected automatically, or set with -b (BED) or -m (-mat).
+  info    | Print the type of data, the columns, and the number of sites on each chromosome.
+  dump    | Write the contents of the file (or of chromosome `chrom') in text form.
+
+Binary files can be used in place of the original text files by dmaptools.py.
+
+""")
+
+P = Script.Script("MethBin.py", version="1.0", usage=usage)
+
+def dump(mbf, chrom, out):
+    for i in range(len(mbf.chunks)):
+        c = mbf.chunks[i][0]
+        if chrom and c != chrom:
+            continue
+        arrays = [ a.tolist() for a in mbf.readChunk(i) ]
+        if mbf.kind == "mat":
+            for row in zip(*arrays):
+                out.write("{}\t{}\t{}\n".format(c, row[0], "\t".join([ "NA" if v != v else str(v) for v in row[1:] ])))
+        else:
+            for row in zip(*arrays):
+                out.write("{}\t{}\t{}\t{}\t{}\t{}\n".format(c, *row))
+
+def main(args):
+    P.standardOpts(args)
+    if not args:
+        return usage()
+    cmd = args[0]
+    files = []
+    kind = None
+    for a in args[1:]:
+        if a == "-b":
+            kind = "bed"
+        elif a == "-m":
+            kind = "mat"
+        else:
+            files.append(a)
+
+    if cmd == "convert" and len(files) == 2:
+        n = textToMethBin(P.isFile(files[0]), files[1], kind=kind)
+        sys.stderr.write("{} sites written to {}.\n".format(n, files[1]))
+    elif cmd == "info" and len(files) == 1:
+        with MethBinFile(P.isFile(files[0])) as mbf:
+            sys.stdout.write("Type: {}\n".format(mbf.kind))
+            sys.stdout.write("Columns: {}\n".format(" ".join(mbf.columnNames())))
+            if mbf.header:
+                sys.stdout.write("Header: {}\n".format(" ".join(mbf.header)))
+            for chrom in mbf.chroms:
+                sys.stdout.write("{}\t{}\n".format(chrom, mbf.nsites(chrom)))
+    elif cmd == "dump" and len(files) in [1, 2]:
+        with MethBinFile(P.isFile(files[0])) as mbf:
+            dump(mbf, files[1] if len(files) == 2 else None, sys.stdout)
+    else:
+        usage()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,9 +1,94 @@
 ### Utilities used by all bioscript programs
 
 import sys
+import time
+import json
+import atexit
+import cProfile
 import os.path
+import contextlib
 import Utils
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
+### Profiling and timing support (--profile)
+
+class Profiler():
+    """Collects cProfile statistics, per-phase timings and record counters for a run. Statistics
+are written to `prefix'.prof (readable with pstats) and timings to `prefix'.json."""
+    prefix = ""
+    name = ""
+    profile = None
+    start = 0
+    startcpu = 0
+    phases = []                 # List of dicts, one for each completed phase
+    running = []                # Stack of phases currently running (phases can be nested)
+    counters = {}
+
+    def __init__(self, prefix, name):
+        self.prefix = prefix
+        self.name = name
+        self.phases = []
+        self.running = []
+        self.counters = {}
+
+    def begin(self, args):
+        """Start profiling. The whole run is recorded as phase `run', and the total size of the
+existing files in `args' is recorded in counter `input_bytes'."""
+        self.start = time.time()
+        self.startcpu = time.clock()
+        self.startPhase('run')
+        self.count('input_bytes', sum([ os.path.getsize(a) for a in args if os.path.isfile(a) ]))
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def startPhase(self, name):
+        self.running.append({'name': name, 'start': time.time(), 'cpu': time.clock(), 'counters': {}})
+
+    def endPhase(self):
+        if self.running:
+            ph = self.running.pop()
+            ph['wall'] = time.time() - ph['start']
+            ph['cpu'] = time.clock() - ph['cpu']
+            ph['start'] = ph['start'] - self.start
+            ph['throughput'] = rates(ph['counters'], ph['wall'])
+            self.phases.append(ph)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+        for ph in self.running:
+            ph['counters'][name] = ph['counters'].get(name, 0) + n
+
+    def finish(self):
+        self.profile.disable()
+        while self.running:
+            self.endPhase()
+        wall = time.time() - self.start
+        self.profile.dump_stats(self.prefix + ".prof")
+        report = {'program': self.name,
+                  'args': sys.argv[1:],
+                  'wall': wall,
+                  'cpu': time.clock() - self.startcpu,
+                  'phases': self.phases,
+                  'counters': self.counters,
+                  'throughput': rates(self.counters, wall)}
+        if resource:
+            report['maxrss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        with open(self.prefix + ".json", "w") as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+            out.write("\n")
+        sys.stderr.write("Profile written to {0}.prof, timings to {0}.json\n".format(self.prefix))
+
+def rates(counters, seconds):
+    """Returns a dictionary with the number of items per second for each counter in `counters'."""
+    if seconds > 0:
+        return { k: v / seconds for (k, v) in Utils.get_iterator(counters) }
+    else:
+        return {}
+
 ### Class to define subcommands in program
 
 class Command():
@@ -23,6 +108,7 @@ class Script():
     errorCode = 1
     _commands = {}
     _commandNames = []
+    profiler = None             # Profiler object, if --profile was specified
 
     def __init__(self, name, version="1.0", usage=None, errors=[]):
         """Errors should be a list of tuples: (code, name, message)."""
@@ -80,7 +166,8 @@ and the following one (if any). Otherwise, returns None."""
         return None
 
     def standardOpts(self, args):
-        """Process the standard arguments. If any of them are found, this function does not return."""
+        """Process the standard arguments. If any of them are found, this function does not return,
+except for --profile or --profile=P, which is removed from `args' and enables profiling (see startProfiling())."""
         harg = self.getOptionValue(args, ['-h', '--help', '-E', '-v', '--version'])
         if harg:
             opt = harg[0]
@@ -103,6 +190,44 @@ and the following one (if any). Otherwise, returns None."""
                     else:
                         sys.stderr.write("Unknown error code {}\n".format(errcode))
                 sys.exit(0)
+        for i in range(len(args)):
+            a = args[i]
+            if a == '--profile' or a.startswith('--profile='):
+                prefix = a[10:] or self.name
+                del args[i]
+                self.startProfiling(prefix)
+                break
+
+    def startProfiling(self, prefix):
+        """Run the rest of the program under cProfile. When the program exits, statistics are written
+to `prefix'.prof, and wall and CPU times, per-phase timings and counters (see phase() and count())
+are written in JSON format to `prefix'.json. Every run has a phase `run' and an `input_bytes' counter
+(size of the input files given on the command line), so throughput is reported even for scripts that
+do not define their own phases."""
+        if not self.profiler:
+            self.profiler = Profiler(prefix, self.name)
+            atexit.register(self.profiler.finish)
+            self.profiler.begin(sys.argv[1:])
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager to time a phase of the program when profiling is enabled:
+
+  with P.phase("reading"):
+      ...
+"""
+        if self.profiler:
+            self.profiler.startPhase(name)
+        try:
+            yield
+        finally:
+            if self.profiler:
+                self.profiler.endPhase()
+
+    def count(self, name, n=1):
+        """Add `n' to counter `name' (e.g. number of records processed) when profiling is enabled."""
+        if self.profiler:
+            self.profiler.count(name, n)
 
     def errmsg(self, code, *args):
         if code in self.errorMsg:
@@ -7,10 +7,29 @@ import sys
 import csv
 import math
 import gzip
+import zlib
 import time
+import heapq
+import atexit
+import weakref
+import threading
+import multiprocessing.pool
 import pysam
 import string
 import random
+import tempfile
+import numpy as np
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from collections import deque
 
 #from BEDutils import loadindex
 
@@ -22,14 +41,269 @@ def get_iterator(dict):
     else:
         return dict.items()
 
-def genOpen(filename, mode):
-    """Generalized open() function - works on both regular files and .gz files."""
+GZIP_LEVEL = 9                  # Compression level for .gz files written by genOpen() (as gzip.open())
+GZIP_THREADS = min(4, multiprocessing.cpu_count()) # Compression threads for .gz files (0: use the gzip module)
+GZIP_BLOCKSIZE = 1048576        # Size of the blocks compressed independently by GzipWriter
+
+def genOpen(filename, mode, level=None, threads=None):
+    """Generalized open() function - works on both regular files and .gz files. Unless `threads'
+(default: GZIP_THREADS) is 0, .gz files are read with GzipReader (decompression in a background
+thread) and written with GzipWriter (blocks compressed in parallel by `threads' threads), using
+compression level `level' (default: GZIP_LEVEL)."""
     (name, ext) = os.path.splitext(filename)
     if ext == ".gz":
-        return gzip.open(filename, mode)
+        if threads is None:
+            threads = GZIP_THREADS
+        if level is None:
+            level = GZIP_LEVEL
+        if threads > 0 and mode[0] == "r" and "+" not in mode:
+            return GzipReader(filename)
+        elif threads > 0 and mode[0] == "w" and "+" not in mode:
+            return GzipWriter(filename, level, threads)
+        return gzip.open(filename, mode, level)
     else:
         return open(filename, mode)
 
+### Threaded gzip streams
+
+_GZIP_POOLS = {}                # Compression thread pools shared by all GzipWriters, by size
+_GZIP_STREAMS = weakref.WeakSet() # GzipWriters and GzipReaders not closed yet
+
+def _gzipPool(threads):
+    if threads not in _GZIP_POOLS:
+        _GZIP_POOLS[threads] = multiprocessing.pool.ThreadPool(threads)
+    return _GZIP_POOLS[threads]
+
+def _closeGzipStreams():
+    """Close the streams that are still open when the program exits (so that buffered data is
+written, as gzip.GzipFile does), then stop the compression threads."""
+    for stream in list(_GZIP_STREAMS):
+        stream.close()
+    for pool in _GZIP_POOLS.values():
+        pool.close()
+        pool.join()
+    _GZIP_POOLS.clear()
+
+atexit.register(_closeGzipStreams)
+
+def _gzipBlock(data, level):
+    """Compress `data' into a complete gzip member."""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return z.compress(data) + z.flush()
+
+class GzipWriter():
+    """Write a .gz file, compressing blocks of GZIP_BLOCKSIZE bytes in parallel (zlib releases the
+GIL while compressing). Each block is written as a separate gzip member; gzip, zcat and the gzip
+module read the result as a single stream. Like gzip.GzipFile, the stream is closed when it is
+garbage collected or when the program exits."""
+    name = None
+    level = 9
+    closed = False
+    _out = None
+    _pool = None
+    _pending = None             # Blocks being compressed, in file order (AsyncResult objects)
+    _maxpending = 8
+    _buf = []
+    _buflen = 0
+    _nblocks = 0
+
+    def __init__(self, filename, level=9, threads=2):
+        self.name = filename
+        self.level = level
+        self._out = open(filename, "wb")
+        self._pool = _gzipPool(threads)
+        self._pending = deque()
+        self._maxpending = 2 * threads
+        self._buf = []
+        self._buflen = 0
+        self._nblocks = 0
+        _GZIP_STREAMS.add(self)
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def write(self, data):
+        self._buf.append(data)
+        self._buflen += len(data)
+        if self._buflen >= GZIP_BLOCKSIZE:
+            self._submit()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def _submit(self):
+        if self._buf:
+            data = "".join(self._buf)
+            self._buf = []
+            self._buflen = 0
+            self._pending.append(self._pool.apply_async(_gzipBlock, (data, self.level)))
+            self._nblocks += 1
+        self._drain(self._maxpending)
+
+    def _drain(self, n):
+        """Write out finished blocks, waiting until no more than `n' are pending."""
+        while self._pending and (len(self._pending) > n or self._pending[0].ready()):
+            self._out.write(self._pending.popleft().get())
+
+    def flush(self):
+        self._submit()
+        self._drain(0)
+        self._out.flush()
+
+    def close(self):
+        if self.closed or self._out is None:
+            return
+        self.closed = True
+        try:
+            if self._nblocks == 0 and not self._buf:
+                self._buf = [""]        # An empty file still needs one gzip member
+            self._submit()
+            self._drain(0)
+        finally:
+            self._out.close()
+
+class GzipReader():
+    """Read a .gz file (possibly made of several gzip members) while a background thread reads and
+decompresses it, `chunksize' bytes at a time, keeping up to `maxchunks' chunks ahead of the
+reader. Supports read(), readline(), readlines() and iteration over lines. The background thread
+is stopped when the reader is closed, garbage collected, or when the program exits."""
+    name = None
+    closed = False
+    _queue = None
+    _stop = None
+    _thread = None
+    _buf = ""                   # Decompressed data not returned yet, starting at _pos
+    _pos = 0
+    _eof = False
+
+    def __init__(self, filename, chunksize=1048576, maxchunks=8):
+        self.name = filename
+        self._queue = queue.Queue(maxchunks)
+        self._stop = threading.Event()
+        self._buf = ""
+        self._pos = 0
+        # The thread must not hold a reference to the reader, or it would never be garbage collected
+        self._thread = threading.Thread(target=_gzipDecompress, args=(filename, chunksize, self._queue, self._stop))
+        self._thread.daemon = True
+        self._thread.start()
+        _GZIP_STREAMS.add(self)
+
+    def __del__(self):
+        self.close()
+
+    def _fill(self):
+        """Append the next decompressed chunk to the buffer. Returns False at the end of the file."""
+        if self._eof:
+            return False
+        chunk = self._queue.get()
+        if chunk is None or isinstance(chunk, Exception):
+            self._eof = True
+            if chunk is None:
+                return False
+            raise chunk
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if line:
+            return line
+        raise StopIteration
+
+    __next__ = next
+
+    def readline(self):
+        while True:
+            p = self._buf.find("\n", self._pos)
+            if p >= 0:
+                line = self._buf[self._pos:p+1]
+                self._pos = p + 1
+                return line
+            if not self._fill():
+                line = self._buf[self._pos:]
+                self._pos = len(self._buf)
+                return line
+
+    def readlines(self):
+        return list(self)
+
+    def read(self, size=-1):
+        if size < 0:
+            parts = [self._buf[self._pos:]]
+            self._buf = ""
+            self._pos = 0
+            while self._fill():
+                parts.append(self._buf)
+                self._buf = ""
+            return "".join(parts)
+        else:
+            while len(self._buf) - self._pos < size and self._fill():
+                pass
+        data = self._buf[self._pos:self._pos+size]
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        if not self.closed and self._thread:
+            self.closed = True
+            self._stop.set()
+            self._thread.join()
+
+def _gzipPut(q, stop, item):
+    """Add `item' to queue `q', unless `stop' is set first. Returns False in that case."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _gzipDecompress(filename, chunksize, q, stop):
+    """Body of the background thread of a GzipReader: decompress `filename' into queue `q', ending
+with None, or with the exception raised while reading."""
+    try:
+        with open(filename, "rb") as f:
+            z = zlib.decompressobj(31)
+            started = False
+            while True:
+                data = f.read(chunksize)
+                if not data:
+                    break
+                started = True
+                while data:
+                    chunk = z.decompress(data)
+                    if chunk and not _gzipPut(q, stop, chunk):
+                        return
+                    data = z.unused_data
+                    if data:
+                        if not data.strip("\0"): # Zero padding after the last member
+                            break
+                        z = zlib.decompressobj(31)
+            # If the last member is complete, any further data ends up in unused_data
+            if started and (z.decompress("\0") or not z.unused_data):
+                raise IOError("Compressed file ended before the end of the gzip stream.")
+        _gzipPut(q, stop, None)
+    except Exception as e:
+        _gzipPut(q, stop, e)
+
 def dget(key, dictionary, default=None):
     """Return the value associated with `key' in `dictionary', if present, or `default'."""
     if key in dictionary:
@@ -84,6 +358,8 @@ def decodeUnits(x):
         return (x[:-1], 1000000000)
     if x.endswith("M") or x.endswith("m"):
         return (x[:-1], 1000000)
+    if x.endswith("K") or x.endswith("k"):
+        return (x[:-1], 1000)
     else:
         return (x, 1)
     
@@ -234,8 +510,16 @@ def filterFile(infile, outfile, column, low=None, high=None, invert=False, absol
     """Copy tab-delimited rows from `infile' to `outfile', testing the value in column `column' against `low' and `high'.
 A row is copied if the value is above `low' (if specified) and below `high' (if specified). If `invert' is true, the test 
 is inverted."""
+    return filterFileMulti(infile, outfile, [(column, low, high, absolute)], invert=invert, preserveHeader=preserveHeader, delim=delim)
+
+def filterFileMulti(infile, outfile, tests, invert=False, preserveHeader=True, delim='\t', chunksize=4000000):
+    """Like filterFile(), but applies several tests in a single pass. `tests' is a list of tuples
+(column, low, high, absolute), and a row is copied if it passes all of them (or none of them, if
+`invert' is true). The input is read in blocks of about `chunksize' bytes; the values in each
+tested column are converted to an array and the tests are applied to the whole block at once.
+Returns the number of rows written, or False if a column name is not found in the header."""
     nout = 0
-    colstr = (type(column).__name__ != 'int')
+    colstr = any([ type(t[0]).__name__ != 'int' for t in tests ])
     with open(outfile, "w") as out:
         with open(infile, "r") as f:
             if preserveHeader or colstr:
@@ -244,28 +528,211 @@ is inverted."""
                     out.write(hdr)
                 if colstr:
                     parsed = hdr.rstrip("\r\n").split(delim)
-                    if column in parsed:
-                        column = parsed.index(column)
-                    else:
-                        sys.stderr.write("Column `{}' not found in header of file {}.\n".format(column, infile))
-                        return False
-            for line in f:
-                parsed = line.rstrip("\r\n").split(delim)
-                x = safeFloat(parsed[column])
-                if absolute:
-                    x = abs(x)
-                good = True
-                if low and x < low:
-                    good = False
-                if high and x > high:
-                    good = False
+                    resolved = []
+                    for (column, low, high, absolute) in tests:
+                        if type(column).__name__ != 'int':
+                            if column in parsed:
+                                column = parsed.index(column)
+                            else:
+                                sys.stderr.write("Column `{}' not found in header of file {}.\n".format(column, infile))
+                                return False
+                        resolved.append((column, low, high, absolute))
+                    tests = resolved
+            while True:
+                lines = f.readlines(chunksize)
+                if not lines:
+                    break
+                good = _filterMask(lines, tests, delim)
+                if good is None:
+                    good = [ _filterLine(line, tests, delim) for line in lines ]
+                    good = np.array(good, dtype=np.bool_)
                 if invert:
-                    good = not good
-                if good:
-                    out.write(line)
-                    nout += 1
+                    good = ~good
+                keep = np.flatnonzero(good).tolist()
+                out.write("".join([ lines[i] for i in keep ]))
+                nout += len(keep)
     return nout
 
+def _filterLine(line, tests, delim):
+    """Apply `tests' to a single line, exactly as filterFile() does (without inversion)."""
+    parsed = line.rstrip("\r\n").split(delim)
+    for (column, low, high, absolute) in tests:
+        x = safeFloat(parsed[column])
+        if absolute:
+            x = abs(x)
+        if low and x < low:
+            return False
+        if high and x > high:
+            return False
+    return True
+
+def _filterMask(lines, tests, delim):
+    """Apply `tests' to a block of lines, returning a boolean array (without inversion). Values
+that are not numbers (NA) fail the `low' test, like None does in _filterLine(). If all lines
+have the same number of fields the block is split with a single call, otherwise the tested
+columns are extracted one line at a time. Returns None for NA values with `absolute' (which
+_filterLine() does not handle either): the caller should then use _filterLine() on each line."""
+    fields = None
+    if len(delim) == 1:
+        text = "".join(lines)
+        if "\r" in text:
+            text = text.replace("\r\n", "\n")
+        if "\r" not in text:
+            if not text.endswith("\n"):
+                text += "\n"
+            # Number of delimiters on each line, from the positions of delimiters and newlines
+            codes = np.frombuffer(text, dtype=np.uint8)
+            ends = np.flatnonzero(codes == 10)
+            counts = np.diff(np.searchsorted(np.flatnonzero(codes == ord(delim)), ends), prepend=0)
+            if not (counts != counts[0]).any():
+                ncols = int(counts[0]) + 1
+                nfields = len(lines) * ncols
+                fields = text.replace("\n", delim).split(delim)
+    good = np.ones(len(lines), dtype=np.bool_)
+    for (column, low, high, absolute) in tests:
+        idx = column + ncols if fields is not None and column < 0 else column
+        if fields is not None and 0 <= idx < ncols:
+            values = fields[idx:nfields:ncols]
+        else:
+            values = [ line.rstrip("\r\n").split(delim)[column] for line in lines ]
+        (x, na) = _floatColumn(values)
+        if absolute:
+            if na is not None:
+                return None
+            x = np.abs(x)
+        with np.errstate(invalid='ignore'):
+            if low:
+                good &= ~(x < low)
+                if na is not None:
+                    good &= ~na
+            if high:
+                good &= ~(x > high)
+    return good
+
+def _floatColumn(values):
+    """Convert the list of strings `values' to an array of floats. Returns a tuple (array, na) where
+`na' is None if all values are numbers, or a boolean array marking the values that are not (set to
+NaN in the array)."""
+    try:
+        return (np.array(values, dtype=np.float64), None)
+    except ValueError:
+        x = [ safeFloat(v) for v in values ]
+        na = np.array([ v is None for v in x ], dtype=np.bool_)
+        return (np.array([ np.nan if v is None else v for v in x ], dtype=np.float64), na)
+
+### External sort
+
+class _Reversed():
+    """Wrapper that inverts the ordering of the object it contains, for descending merges."""
+    __slots__ = ['obj']
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __lt__(self, other):
+        return other.obj < self.obj
+
+    def __eq__(self, other):
+        return self.obj == other.obj
+
+    def __ne__(self, other):
+        return self.obj != other.obj
+
+def _writeRun(buf, key, tmpdir, reverse=False):
+    """Sort `buf' and write it to a new temporary file. Returns the (rewound) file."""
+    buf.sort(key=key, reverse=reverse)
+    f = tempfile.TemporaryFile(dir=tmpdir)
+    for r in buf:
+        pickle.dump(r, f, pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+def _readRun(f, key, runidx, reverse=False):
+    seq = 0
+    while True:
+        try:
+            r = pickle.load(f)
+        except EOFError:
+            return
+        k = key(r) if key else r
+        yield (_Reversed(k) if reverse else k, runidx, seq, r)
+        seq += 1
+
+class ExternalSorter():
+    """Sort records that may not fit in memory. Records are added one at a time with add(); at
+most `bufsize' of them (or, if `maxbytes' is specified, records with a total size of `maxbytes'
+as measured by `sizefun') are kept in memory. When the buffer fills up it is sorted and written
+to a temporary file (a `run'). Iterating over the sorter returns all records in sorted order,
+merging the runs with heapq.merge(). The sort is stable, also when `reverse' is True, exactly as
+list.sort(). Records must be picklable."""
+    key = None
+    reverse = False
+    bufsize = 1000000
+    maxbytes = None
+    sizefun = None
+    tmpdir = None
+    buf = []
+    bufbytes = 0
+    runs = []
+
+    def __init__(self, key=None, bufsize=1000000, tmpdir=None, reverse=False, maxbytes=None, sizefun=sys.getsizeof):
+        self.key = key
+        self.bufsize = bufsize
+        self.tmpdir = tmpdir
+        self.reverse = reverse
+        self.maxbytes = maxbytes
+        self.sizefun = sizefun
+        self.buf = []
+        self.bufbytes = 0
+        self.runs = []
+
+    def add(self, r):
+        self.buf.append(r)
+        if self.maxbytes:
+            self.bufbytes += self.sizefun(r)
+            full = self.bufbytes >= self.maxbytes
+        else:
+            full = len(self.buf) >= self.bufsize
+        if full:
+            self.spill()
+
+    def spill(self):
+        """Write the records in the buffer to a new run."""
+        self.runs.append(_writeRun(self.buf, self.key, self.tmpdir, self.reverse))
+        self.buf = []
+        self.bufbytes = 0
+
+    def close(self):
+        """Delete all temporary files."""
+        for f in self.runs:
+            f.close()
+        self.runs = []
+
+    def __iter__(self):
+        try:
+            if not self.runs:
+                self.buf.sort(key=self.key, reverse=self.reverse)
+                for r in self.buf:
+                    yield r
+                return
+            if self.buf:
+                self.spill()
+            streams = [ _readRun(self.runs[i], self.key, i, self.reverse) for i in range(len(self.runs)) ]
+            for entry in heapq.merge(*streams):
+                yield entry[3]
+        finally:
+            self.buf = []
+            self.close()
+
+def externalSort(records, key=None, bufsize=1000000, tmpdir=None, reverse=False):
+    """Generator that returns the elements of iterable `records' sorted according to `key',
+keeping at most `bufsize' of them in memory (see ExternalSorter)."""
+    sorter = ExternalSorter(key=key, bufsize=bufsize, tmpdir=tmpdir, reverse=reverse)
+    for r in records:
+        sorter.add(r)
+    for r in sorter:
+        yield r
+
 def filenameNoExt(s):
     return os.path.splitext(os.path.basename(s))[0]
 
@@ -440,6 +907,154 @@ class CSVreader():
         else:
             return row
 
+### Fast alternative to CSVreader for large files
+
+class FastCSVreader():
+    """Like CSVreader, but reads its input in blocks of `blocksize' bytes. Empty lines and
+comment lines are removed from each block at once, and each block is split by a single
+csv.reader. If `columns' is a list of column indexes, rows only contain those columns.
+Iterate over the reader with a for loop to get rows, or call blocks() to get whole blocks
+(CSVblock objects) instead. `types' maps input column indexes to numpy types (e.g. np.int64);
+these columns are only converted, all at once, when they are requested from a block."""
+    _stream = None
+    _close = False
+    _rows = None                # Generator returning rows
+    ignorechar = '#'
+    delimiter = '\t'
+    columns = None              # If set, list of column indexes to return
+    types = {}                  # Input column index -> numpy type, for CSVblock.column()
+    blocksize = 4000000
+
+    def __init__(self, source, delimiter='\t', columns=None, types=None, blocksize=4000000):
+        if type(source).__name__ == 'str':
+            self._stream = open(source, "r")
+            self._close = True
+        else:
+            self._stream = source
+        self.delimiter = delimiter
+        self.columns = columns
+        self.types = types or {}
+        self.blocksize = blocksize
+        self._rows = self._readRows()
+
+    def __iter__(self):
+        return self._rows
+
+    def next(self):
+        return self._rows.next()
+
+    def readLines(self):
+        """Generator returning the input as lists of lines (without line terminators, empty
+lines and comment lines), one for each block."""
+        rest = ""
+        try:
+            while True:
+                data = self._stream.read(self.blocksize)
+                if data:
+                    p = data.rfind("\n")
+                    if p < 0:
+                        rest += data
+                        continue
+                    text = rest + data[:p]
+                    rest = data[p+1:]
+                else:
+                    text = rest
+                    rest = ""
+                if "\r" in text:
+                    text = text.replace("\r", "")
+                lines = text.split("\n")
+                if self.ignorechar in text or "\n\n" in text or not lines[0] or not lines[-1]:
+                    lines = [ line for line in lines if line and line[0] != self.ignorechar ]
+                if lines:
+                    yield lines
+                if not data:
+                    break
+        finally:
+            if self._close:
+                self._stream.close()
+
+    def _readRows(self):
+        cols = self.columns
+        for lines in self.readLines():
+            rows = csv.reader(lines, delimiter=self.delimiter)
+            if cols is None:
+                for row in rows:
+                    yield row
+            else:
+                for row in rows:
+                    yield [ row[c] for c in cols ]
+
+    def blocks(self):
+        """Generator returning the input one block at a time, as CSVblock objects. Do not
+mix with iteration over rows."""
+        for lines in self.readLines():
+            yield CSVblock(lines, self.delimiter, self.columns, self.types)
+
+class CSVblock():
+    """A block of lines read by FastCSVreader.blocks(). Lines are only split into fields when
+rows or columns are requested. If all lines have the same number of fields the block is split
+with a single call, otherwise one line at a time. Unlike the rows returned by FastCSVreader,
+columns are split on the delimiter without csv quoting rules."""
+    lines = []
+    delimiter = '\t'
+    columns = None              # If set, list of column indexes (in the input) to return
+    types = {}                  # Input column index -> numpy type
+    _fields = None              # Flat list of all fields, if the block is regular
+    _ncols = None               # Number of fields per line, if the block is regular
+    _cache = {}                 # Columns already returned by column()
+
+    def __init__(self, lines, delimiter='\t', columns=None, types=None):
+        self.lines = lines
+        self.delimiter = delimiter
+        self.columns = columns
+        self.types = types or {}
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.lines)
+
+    def rows(self):
+        """Returns the rows in this block, as lists of strings."""
+        rows = csv.reader(self.lines, delimiter=self.delimiter)
+        if self.columns is None:
+            return list(rows)
+        else:
+            return [ [ row[c] for c in self.columns ] for row in rows ]
+
+    def _split(self):
+        delim = self.delimiter
+        self._ncols = 0
+        if len(delim) == 1:
+            text = "\n".join(self.lines) + "\n"
+            codes = np.frombuffer(text, dtype=np.uint8)
+            ends = np.flatnonzero(codes == 10)
+            counts = np.diff(np.searchsorted(np.flatnonzero(codes == ord(delim)), ends), prepend=0)
+            if not (counts != counts[0]).any():
+                self._ncols = int(counts[0]) + 1
+                self._fields = text[:-1].replace("\n", delim).split(delim)
+
+    def column(self, idx):
+        """Returns column `idx' of this block (an index into `columns', if set). If the column
+appears in `types' it is returned as a numpy array of that type, otherwise as a list of strings."""
+        if idx in self._cache:
+            return self._cache[idx]
+        c = idx if self.columns is None else self.columns[idx]
+        if self._ncols is None:
+            self._split()
+        if self._ncols and 0 <= c < self._ncols:
+            values = self._fields[c::self._ncols]
+        else:
+            values = [ line.split(self.delimiter)[c] for line in self.lines ]
+        if c in self.types:
+            values = _typedColumn(values, self.types[c])
+        self._cache[idx] = values
+        return values
+
+def _typedColumn(values, dtype):
+    """Convert the list of strings `values' to an array of type `dtype'. Raises ValueError if
+a value cannot be converted."""
+    return np.array(values).astype(dtype)
+
 ### Read a single column from a delimited file specified with the @filename:col notation.
 
 class AtFileReader():
@@ -788,11 +1403,13 @@ class GenomicWindower():
     end2 = 0                    # End of window after the current one
     data = []                   # Data contained in current window
     total = 0                   # Total weight of entries in current window
+    track = None                # If set, windows are added to this (e.g. a BigWigWriter) instead of `out'
 
-    def __init__(self, window, out=None):
+    def __init__(self, window, out=None, track=None):
         self.window = window
         self.data = []
         self.out = out
+        self.track = track
 
     def open(self, echrom, epos, entry):
         self.chrom = echrom
@@ -807,11 +1424,13 @@ class GenomicWindower():
             self.outputWindow()
 
     def outputWindow(self):
-        if self.out:
+        if self.track:
+            self.track.add(self.chrom, self.start, self.end, self.total)
+        elif self.out:
             self.out.write("{}\t{}\t{}\t{}\n".format(self.chrom, self.start, self.end, self.total))
 
     def nextBlock(self, echrom, epos):
-        if self.out:
+        if self.out and not self.track:
             self.out.write("fixedStep chrom={} start={} step={} span={}\n".format(echrom, epos, self.window, self.window))
 
     def _add(self, entry):
@@ -957,9 +1576,9 @@ class DualBEDreader():
     current1 = None
     current2 = None
 
-    def __init__(self, filename1, filename2):
-        self.bed1 = BEDreader(filename1)
-        self.bed2 = BEDreader(filename2)
+    def __init__(self, filename1, filename2, reader=BEDreader):
+        self.bed1 = reader(filename1)
+        self.bed2 = reader(filename2)
         if self.bed1.chrom != self.bed2.chrom:
             sys.stderr.write("Error: BED files start on different chromosomes ({}, {}).\n".format(self.bed1.chrom, self.bed2.chrom))
         else:
@@ -3,6 +3,7 @@
 import os.path
 import sys
 import csv
+import sqlite3 as sql
 import Utils
 
 DATA="/ufrc/data/reference/icbr/Affymetrix/HG-U133A.na22.annot.csv"
@@ -39,10 +40,68 @@ def parseAnnots():
             annots[row[0]] = row[gpos]
     return annots
 
-def main(infile, outfile):
+def sourceStamp(filename):
+    """Return the (filename, mtime, size) tuple used to check that a cache is up to date."""
+    st = os.stat(filename)
+    return (os.path.abspath(filename), st.st_mtime, st.st_size)
+
+def readCache(cachefile):
+    """Load the probeset -> gene symbol dictionary from sqlite3 database `cachefile'.
+Returns None if the cache does not exist or was built from a different version of the
+annotation file."""
+    if not os.path.isfile(cachefile):
+        return None
+    try:
+        conn = sql.connect(cachefile)
+        try:
+            row = conn.execute("SELECT filename, mtime, size FROM Source;").fetchone()
+            if row is None or tuple(row) != sourceStamp(DATA):
+                return None
+            conn.text_factory = str
+            return dict(conn.execute("SELECT probeset, symbol FROM Annots;"))
+        finally:
+            conn.close()
+    except sql.Error:
+        return None
+
+def writeCache(cachefile, annots):
+    """Save the `annots' dictionary to sqlite3 database `cachefile', replacing its previous contents."""
+    conn = sql.connect(cachefile)
+    try:
+        conn.text_factory = str
+        conn.execute("DROP TABLE IF EXISTS Source;")
+        conn.execute("DROP TABLE IF EXISTS Annots;")
+        conn.execute("CREATE TABLE Source (filename varchar, mtime real, size int);")
+        conn.execute("CREATE TABLE Annots (probeset varchar PRIMARY KEY, symbol varchar);")
+        conn.execute("INSERT INTO Source (filename, mtime, size) VALUES (?, ?, ?);", sourceStamp(DATA))
+        conn.executemany("INSERT INTO Annots (probeset, symbol) VALUES (?, ?);", Utils.get_iterator(annots))
+        conn.commit()
+    finally:
+        conn.close()
+
+def loadAnnots(cachefile=None):
+    """Return the probeset -> gene symbol dictionary, reading it from `cachefile' (an sqlite3
+database, default: DATA + '.db') if it is up to date, and parsing DATA (and rebuilding the
+cache) otherwise. If `cachefile' is False, the cache is not used."""
+    if cachefile is False:
+        return parseAnnots()
+    cachefile = cachefile or DATA + ".db"
+    annots = readCache(cachefile)
+    if annots is not None:
+        sys.stderr.write("Array annotations loaded from cache: {}\n".format(cachefile))
+        return annots
     annots = parseAnnots()
-    k = annots.keys()[0]
-    print(k, annots[k])
+    if annots:
+        try:
+            writeCache(cachefile, annots)
+            sys.stderr.write("Array annotations cached to {}\n".format(cachefile))
+        except (sql.Error, IOError, OSError) as e:
+            sys.stderr.write("Warning: cannot write annotation cache {}: {}\n".format(cachefile, e))
+    return annots
+
+def annotateFile(annots, infile, outfile):
+    """Write a copy of `infile' (a filespec, see parseFilespec()) to `outfile', adding the gene
+symbol for each probeset in the column after the probeset one."""
     (filename, col) = parseFilespec(infile)
     dcol = col+1
     sys.stderr.write("{} -> {}\n".format(filename, outfile))
@@ -61,7 +120,83 @@ def main(infile, outfile):
                 out.write("\t".join(line) + "\n")
     sys.stderr.write("{} probesets, {} translated, {} untranslated.\n".format(nin, nout, nin-nout))
 
+def batchOutfile(infile, outdir=None):
+    """Return the name of the output file for `infile' in batch mode: the input filename with
+`.annot' inserted before its extension, in directory `outdir' if specified."""
+    filename = infile.split(":")[0]
+    (base, ext) = os.path.splitext(filename)
+    outfile = base + ".annot" + ext
+    if outdir:
+        outfile = os.path.join(outdir, os.path.basename(outfile))
+    return outfile
+
+def main(infile, outfile, cachefile=None):
+    annots = loadAnnots(cachefile)
+    annotateFile(annots, infile, outfile)
+
+def batch(infiles, outdir=None, cachefile=None):
+    """Annotate all files in `infiles', loading the annotations only once."""
+    annots = loadAnnots(cachefile)
+    for infile in infiles:
+        if not parseFilespec(infile):
+            sys.stderr.write("File {} does not exist, skipping.\n".format(infile))
+            continue
+        annotateFile(annots, infile, batchOutfile(infile, outdir))
+
+def usage():
+    sys.stderr.write("""annotAffy.py - Add gene symbols to files containing Affymetrix probeset IDs.
+
+Usage: annotAffy.py [options] infile outfile [annotations]
+       annotAffy.py [options] -b infiles...
+
+`infile' can be specified as filename:c, where c is the column containing probeset
+IDs (default: 1). Gene symbols are inserted in the following column. In batch mode
+(-b), each input file is written to a file with the same name and extension .annot
+added before the original extension.
+
+Options:
+
+  -a A | Use annotation file A (default: {}).
+  -c C | Use sqlite3 database C as a cache of the parsed annotations
+         (default: annotation file name + .db). The cache is rebuilt
+         automatically when the annotation file changes.
+  -n   | Do not use the cache, always parse the annotation file.
+  -d D | In batch mode, write output files to directory D.
+  -b   | Batch mode (see above).
+
+""".format(DATA))
+
 if __name__ == "__main__":
-    if len(sys.argv) == 4:
-        DATA=sys.argv[3]
-    main(sys.argv[1], sys.argv[2])
+    args = sys.argv[1:]
+    if not args or "-h" in args or "--help" in args:
+        usage()
+        sys.exit(1)
+    files = []
+    cachefile = None
+    outdir = None
+    batchmode = False
+    prev = ""
+    for a in args:
+        if prev == "-a":
+            DATA = a
+            prev = ""
+        elif prev == "-c":
+            cachefile = a
+            prev = ""
+        elif prev == "-d":
+            outdir = a
+            prev = ""
+        elif a in ["-a", "-c", "-d"]:
+            prev = a
+        elif a == "-n":
+            cachefile = False
+        elif a == "-b":
+            batchmode = True
+        else:
+            files.append(a)
+    if batchmode:
+        batch(files, outdir, cachefile)
+    else:
+        if len(files) == 3:
+            DATA = files[2]
+        main(files[0], files[1], cachefile)
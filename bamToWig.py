@@ -1,12 +1,17 @@
 #!/usr/bin/env python
 
 import sys
+import math
 import os.path
+import itertools
 import subprocess
+import multiprocessing
 import pysam
+import numpy as np
 
 import Script
-from Utils import LinkedList, LinkedListPool, GenomicWindower, DualBAMReader, Output
+import BigWig
+from Utils import LinkedList, LinkedListPool, GenomicWindower, BAMReader, DualBAMReader, Output
 
 def usage():
     sys.stderr.write("""bamToWig.py - Convert BAM file to WIG track for the UCSC genome browser.
@@ -22,18 +27,35 @@ Options:
  -d D     | Set track description to D
  -b BAM2  | Use bamfile BAM2 as baseline: report difference 
             between bamfile and BAM2 (clipped at 0).
+ -P       | With -b, compute depth by walking the pileups of the two
+            BAM files (slower; depth is capped at 8000 reads by pysam).
  -e       | Do not remove ERCC controls
  -f       | Converts diff file to bedGraph (value column: 8)
  -m       | Convert diff meth file to bedGraph (value column: 5)
  -p       | Convert a Homer peaks.txt file to bedGraph
- -a       | ATAC mode (build pileup on read starts only).
+ -a       | ATAC mode (build pileup on read starts only). If a BAM file is
+            given, count Tn5 insertion sites (5' end of each read shifted
+            by +4 on the forward strand and -5 on the reverse strand) in
+            windows of W bp; otherwise read positions from standard input.
  -l       | In ATAC mode, add read length at each start position
-            instead of 1.
-""".format(trackdata.window, trackdata.normalize, trackdata.scale))
+            instead of 1. With a BAM file, add the fragment length
+            (aligned length for unpaired reads).
+ -j N     | In ATAC mode with a BAM file, process chromosomes using N
+            processes (default: {}).
+ -B       | Write output in bigWig format (requires -o). This is the default
+            if the output file has a .bw or .bigWig extension. Chromosome sizes
+            are taken from the BAM header when available. Track title and
+            description are not stored in bigWig files. With -f, -m or -p,
+            intervals are sorted, values that are not numbers (e.g. NA) are
+            skipped, and overlapping intervals are split at their boundaries,
+            each piece getting the mean value of the intervals covering it.
+            No output file is left behind if an error occurs.
+""".format(trackdata.window, trackdata.normalize, trackdata.scale, trackdata.nprocs))
 
 ### Program object
 
-P = Script.Script("bamToWig", version="1.0", usage=usage)
+P = Script.Script("bamToWig", version="1.0", usage=usage,
+                  errors=[('NOOUT', 'Missing output file', 'bigWig output (-B) requires an output file (-o).')])
 
 class trackdata():
     outfile = None
@@ -48,7 +70,10 @@ class trackdata():
     ercc = False                # If True, preserve ERCC reads
     atac = False
     addlen = False
+    nprocs = 1                  # Number of processes for ATAC mode on BAM files
     bambase = None
+    pileup = False              # If True, use bamToWigDiff_old() for -b
+    bigwig = False              # If True, write output in bigWig format
     
     def trackHeader(self):
         if self.diff or self.homer:
@@ -64,6 +89,140 @@ class trackdata():
     def trackFirstLine(self, chrom, pos):
         return "fixedStep chrom={} start={} step={} span={}\n".format(chrom, pos, self.window, self.window)
 
+    def openTrack(self, chromSizes=None):
+        """Returns the object that writes the output track (WigTrack or BigWigTrack)."""
+        if self.bigwig:
+            return BigWigTrack(self, chromSizes)
+        else:
+            return WigTrack(self)
+
+### Track outputs. Both classes write fixedStep blocks (block() followed by
+### one value() for each window) and bedGraph intervals (interval()). The
+### `base' argument of block() tells whether `pos' is 1-based (samtools depth)
+### or 0-based (pileup positions, used by the -b engines). Tracks are context
+### managers: close() is called at the end of the `with' block, or abort() if an
+### exception was raised.
+
+class WigTrack():
+    """Write a track in text form (WIG or bedGraph)."""
+    td = None
+    out = None
+
+    def __init__(self, td):
+        self.td = td
+        if td.outfile:
+            self.out = open(td.outfile, "w")
+        else:
+            self.out = sys.stdout
+        self.out.write(td.trackHeader())
+
+    def block(self, chrom, pos, base=1):
+        self.out.write(self.td.trackFirstLine(chrom, pos))
+
+    def value(self, v):
+        self.out.write("{}\n".format(v))
+
+    def interval(self, chrom, start, end, v):
+        self.out.write("{}\t{}\t{}\t{}\n".format(chrom, start, end, v))
+
+    def bins(self, chrom, bins, values, length):
+        """Write the values of windows `bins' (sorted array of window indexes) of `chrom', as
+one fixedStep block for each run of consecutive windows."""
+        window = self.td.window
+        breaks = set((np.flatnonzero(np.diff(bins) != 1) + 1).tolist())
+        lines = []
+        for i, (b, v) in enumerate(zip(bins.tolist(), values.tolist())):
+            if i == 0 or i in breaks:
+                lines.append(self.td.trackFirstLine(chrom, b * window + 1))
+            lines.append("{}\n".format(v))
+        self.out.write("".join(lines))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def close(self):
+        if self.td.outfile:
+            self.out.close()
+
+    def abort(self):
+        self.close()
+
+class BigWigTrack():
+    """Write a track in bigWig format. Positions of fixedStep blocks are converted to
+0-based according to their `base'. Intervals may come in any order and may overlap (like
+the gene ranges of a diff file): they are collected, and sorted and flattened with
+BigWig.flattenIntervals() when the track is closed. Values that are not numbers (e.g. NA)
+are skipped. An aborted track leaves no output file."""
+    bw = None
+    filename = None
+    window = 100
+    chrom = None
+    pos = 0
+    intervals = []              # (chrom, start, end, value) tuples added with interval()
+
+    def __init__(self, td, chromSizes=None):
+        self.bw = BigWig.BigWigWriter(td.outfile, chromSizes)
+        self.filename = td.outfile
+        self.window = td.window
+        self.intervals = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def block(self, chrom, pos, base=1):
+        self.chrom = chrom
+        self.pos = pos - base
+
+    def value(self, v):
+        self.bw.add(self.chrom, self.pos, self.pos + self.window, v)
+        self.pos += self.window
+
+    def interval(self, chrom, start, end, v):
+        try:
+            v = float(v)
+        except ValueError:
+            return
+        if not math.isnan(v):
+            self.intervals.append((chrom, int(start), int(end), v))
+
+    def bins(self, chrom, bins, values, length):
+        starts = bins * self.window
+        self.bw.addArrays(chrom, starts, np.minimum(starts + self.window, length), values)
+
+    def close(self):
+        try:
+            self.intervals.sort()
+            for (chrom, items) in itertools.groupby(self.intervals, key=lambda i: i[0]):
+                for (start, end, v) in BigWig.flattenIntervals([ i[1:] for i in items ]):
+                    self.bw.add(chrom, start, end, v)
+            self.intervals = []
+            self.bw.close()
+        except Exception:
+            self.abort()
+            raise
+
+    def abort(self):
+        """Discard the track, removing the output file if close() had started writing it."""
+        self.bw.__exit__(Exception, None, None)
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+
+def bamChromSizes(bamfile):
+    with pysam.AlignmentFile(bamfile, "rb") as b:
+        return zip(b.references, b.lengths)
+
 def bamToWig(bamfile, trackdata):
     wanted = True
     currChrom = ""
@@ -76,17 +235,10 @@ def bamToWig(bamfile, trackdata):
     sys.stderr.write("Normalizing on {} reads, scale={}\n".format(normalize, scale))
     f = 1.0 * scale / normalize
 
-    if trackdata.outfile:
-        out = open(trackdata.outfile, "w")
-    else:
-        out = sys.stdout
-
-    try:
+    with trackdata.openTrack(bamChromSizes(bamfile)) as out:
         p = subprocess.Popen(['samtools', 'depth', bamfile], stdout=subprocess.PIPE)
         pin = p.stdout
 
-        out.write(trackdata.trackHeader())
-
         while True:
             row = pin.readline().split("\t")
             if len(row) < 3:
@@ -96,20 +248,20 @@ def bamToWig(bamfile, trackdata):
             dp = int(row[2])
             if chrom != currChrom:
                 if currChrom != "":
-                    out.write("{}\n".format((1.0 * windowsum / window) * f))
+                    out.value((1.0 * windowsum / window) * f)
                 currChrom = chrom
                 wanted = (not chrom.startswith("ERCC") or trackdata.ercc)
                 windowstart = pos
                 windowend = windowstart + window
                 windowsum = dp
                 if wanted:
-                    out.write(trackdata.trackFirstLine(chrom, pos))
+                    out.block(chrom, pos)
             if pos > windowend:
                 if wanted: 
-                    out.write("{}\n".format((1.0 * windowsum / window) * f))
+                    out.value((1.0 * windowsum / window) * f)
                 if pos > windowend + window: # gap - need to start a new track
                     if wanted:
-                        out.write(trackdata.trackFirstLine(chrom, pos))
+                        out.block(chrom, pos)
                     windowstart = pos
                     windowend = windowstart + window
                     windowsum = dp
@@ -119,11 +271,8 @@ def bamToWig(bamfile, trackdata):
                     windowsum = dp
             else:
                 windowsum += dp
-    finally:
-        if trackdata.outfile:
-            out.close()
 
-def bamToWigDiff(bamfile, bamfile2, trackdata):
+def bamToWigDiff_old(bamfile, bamfile2, trackdata):
     wanted = True
     currChrom = ""
     windowstart = 0
@@ -132,16 +281,9 @@ def bamToWigDiff(bamfile, bamfile2, trackdata):
     window = trackdata.window
     scale = trackdata.scale
 
-    if trackdata.outfile:
-        out = open(trackdata.outfile, "w")
-    else:
-        out = sys.stdout
-
-    try:
+    with trackdata.openTrack(bamChromSizes(bamfile)) as out:
         br = DualBAMReader(bamfile, bamfile2)
 
-        out.write(trackdata.trackHeader())
-
         while True:
             row = br.next()
             if row is None:
@@ -153,20 +295,20 @@ def bamToWigDiff(bamfile, bamfile2, trackdata):
                 dp = 0
             if chrom != currChrom:
                 if currChrom != "":
-                    out.write("{}\n".format((1.0 * windowsum / window)))
+                    out.value(1.0 * windowsum / window)
                 currChrom = chrom
                 wanted = (not chrom.startswith("ERCC") or trackdata.ercc)
                 windowstart = pos
                 windowend = windowstart + window
                 windowsum = dp
                 if wanted:
-                    out.write(trackdata.trackFirstLine(chrom, pos))
+                    out.block(chrom, pos, base=0)
             if pos > windowend:
                 if wanted: 
-                    out.write("{}\n".format((1.0 * windowsum / window)))
+                    out.value(1.0 * windowsum / window)
                 if pos > windowend + window: # gap - need to start a new track
                     if wanted:
-                        out.write(trackdata.trackFirstLine(chrom, pos))
+                        out.block(chrom, pos, base=0)
                     windowstart = pos
                     windowend = windowstart + window
                     windowsum = dp
@@ -176,9 +318,145 @@ def bamToWigDiff(bamfile, bamfile2, trackdata):
                     windowsum = dp
             else:
                 windowsum += dp
-    finally:
-        if trackdata.outfile:
-            out.close()
+
+### Vectorized engine for bamToWigDiff. Coverage is computed from the start and end of each read
+### instead of walking two pileups, and windows are summed over arrays.
+
+FILTERFLAGS = 0x704             # Unmapped, secondary, QC-failed and duplicate reads (not counted by pileup())
+SLICESIZE = 10000000            # Chromosomes are processed in slices of this many bases
+
+def readCoverage(bam, chrom, start, end):
+    """Returns an array containing the number of reads covering each base from `start' to `end'
+(0-based, end excluded) on chromosome `chrom' of `bam'. Reads are filtered as in pysam's
+pileup(), but depth is not capped."""
+    size = end - start
+    starts = []
+    ends = []
+    for r in bam.fetch(chrom, start, end):
+        if not r.flag & FILTERFLAGS:
+            e = r.reference_end
+            if e is not None:
+                starts.append(r.reference_start)
+                ends.append(e)
+    if not starts:
+        return np.zeros(size, dtype=np.int32)
+    starts = np.clip(np.array(starts) - start, 0, size)
+    ends = np.clip(np.array(ends) - start, 0, size)
+    events = np.bincount(starts, minlength=size+1) - np.bincount(ends, minlength=size+1)
+    return np.cumsum(events[:size]).astype(np.int32)
+
+class DiffWindower():
+    """Assign positions to windows the way bamToWigDiff_old() does, working on arrays of
+positions and values from consecutive slices of a chromosome. Windows are `window' bp wide and
+aligned on the first position of their block; the first window of a block includes both its
+ends, and a position beyond the window following the current one starts a new block. The first
+value of a chromosome is counted twice, as in the original loop."""
+    window = 100
+    base = None                 # First position of current block (None until the first value)
+    k = 0                       # Index of current window in block
+    last = 0                    # Last position seen
+    carry = 0.0                 # Partial sum of current window
+
+    def __init__(self, window):
+        self.window = window
+
+    def add(self, pos, dp):
+        """Add values `dp' at positions `pos' (sorted arrays). Returns three lists describing
+the windows completed by these values: their sums, whether the following window starts a new
+block, and the start of the following window."""
+        W = self.window
+        n = len(pos)
+        if self.base is None:
+            self.base = int(pos[0])
+            self.last = self.base
+            self.carry = float(dp[0])
+        prev = np.empty(n, dtype=np.int64)
+        prev[0] = self.last
+        prev[1:] = pos[:-1]
+
+        # New blocks start where a position skips at least one window
+        restart = np.zeros(n, dtype=np.bool_)
+        b = self.base
+        plist = pos.tolist()
+        prevlist = prev.tolist()
+        for i in np.flatnonzero(pos - prev > W).tolist():
+            kp = max(0, (prevlist[i] - b - 1) // W)
+            if (plist[i] - b - 1) // W >= kp + 2:
+                restart[i] = True
+                b = plist[i]
+        blk = np.cumsum(restart)
+        bases = np.concatenate(([self.base], pos[restart]))
+        bb = bases[blk]
+        k = np.maximum(0, (pos - bb - 1) // W)
+
+        # Lay out the values of each window (preceded by the carried partial sum) as rows
+        # of a zero-padded matrix, and sum the columns in order so that results are identical
+        # to adding values one at a time.
+        newwin = np.empty(n, dtype=np.bool_)
+        newwin[0] = restart[0] or k[0] != self.k
+        newwin[1:] = (blk[1:] != blk[:-1]) | (k[1:] != k[:-1])
+        wid = np.concatenate(([0], np.cumsum(newwin)))
+        heads = np.concatenate(([0], np.flatnonzero(newwin) + 1))
+        offsets = np.arange(n + 1) - heads[wid]
+        M = np.zeros((len(heads), offsets.max() + 1))
+        M[wid, offsets] = np.concatenate(([self.carry], dp))
+        sums = M[:, 0].copy()
+        for j in range(1, M.shape[1]):
+            sums += M[:, j]
+
+        # Window following each completed one
+        first = heads[1:] - 1
+        nextstarts = np.where(restart[first], pos[first], bb[first] + k[first] * W)
+
+        self.base = int(bases[-1])
+        self.k = int(k[-1])
+        self.last = plist[-1]
+        self.carry = float(sums[-1])
+        return (sums[:-1].tolist(), restart[first].tolist(), nextstarts.tolist())
+
+def bamToWigDiff(bamfile, bamfile2, trackdata):
+    """Like bamToWigDiff_old(), using coverage arrays computed by readCoverage() for the
+positions covered in both BAM files."""
+    window = trackdata.window
+    pending = None              # Value of the last window of the previous chromosome
+
+    with trackdata.openTrack(bamChromSizes(bamfile)) as out:
+        br1 = BAMReader(bamfile)
+        br2 = BAMReader(bamfile2)
+        for (chrom, length) in zip(br1.references, br1.bam.lengths):
+            if chrom not in br1.idxstats or chrom not in br2.idxstats:
+                continue
+            n1 = br1.idxstats[chrom].mapped
+            n2 = br2.idxstats[chrom].mapped
+            if not n1 or not n2:
+                continue
+            f1 = 1.0 * br1.scale / n1
+            f2 = 1.0 * br2.scale / n2
+            wanted = (not chrom.startswith("ERCC") or trackdata.ercc)
+            W = DiffWindower(window)
+            for start in range(0, length, SLICESIZE):
+                end = min(start + SLICESIZE, length)
+                cov1 = readCoverage(br1.bam, chrom, start, end)
+                cov2 = readCoverage(br2.bam, chrom, start, end)
+                idx = np.flatnonzero((cov1 > 0) & (cov2 > 0))
+                if len(idx) == 0:
+                    continue
+                dp = cov1[idx] / f1 - cov2[idx] / f2
+                dp[dp < 0] = 0
+                pos = idx + start
+                if W.base is None:
+                    if pending is not None:
+                        out.value(pending)
+                    if wanted:
+                        out.block(chrom, int(pos[0]), base=0)
+                (sums, newblock, nextstarts) = W.add(pos, dp)
+                if wanted:
+                    for (s, nb, ns) in zip(sums, newblock, nextstarts):
+                        out.value(1.0 * s / window)
+                        if nb:
+                            out.block(chrom, ns, base=0)
+            if W.base is not None:
+                pending = 1.0 * W.carry / window
 
 def splitCoords(c):
     p1 = c.find(":")
@@ -186,12 +464,7 @@ def splitCoords(c):
     return (c[0:p1], c[p1+1:p2], c[p2+1:])
 
 def diffToBedGraph(infile, trackdata):
-    if trackdata.outfile:
-        out = open(trackdata.outfile, "w")
-    else:
-        out = sys.stdout
-    out.write(trackdata.trackHeader())
-    try:
+    with trackdata.openTrack() as out:
         with open(infile, "r") as f:
             f.readline()
             while True:
@@ -201,18 +474,10 @@ def diffToBedGraph(infile, trackdata):
                 parsed = line.rstrip("\r\n").split("\t")
                 (chrom, start, end) = splitCoords(parsed[1])
                 fc = parsed[7]
-                out.write("{}\t{}\t{}\t{}\n".format(chrom, start, end, fc))
-    finally:
-        if trackdata.outfile:
-            out.close()
+                out.interval(chrom, start, end, fc)
 
 def methToBedGraph(infile, trackdata):
-    if trackdata.outfile:
-        out = open(trackdata.outfile, "w")
-    else:
-        out = sys.stdout
-    out.write(trackdata.trackHeader())
-    try:
+    with trackdata.openTrack() as out:
         with open(infile, "r") as f:
             f.readline()
             while True:
@@ -222,21 +487,16 @@ def methToBedGraph(infile, trackdata):
                 parsed = line.rstrip("\r\n").split("\t")
                 chrom = parsed[0]
                 pos = int(parsed[1])
-                fc = float(parsed[4])
-                out.write("{}\t{}\t{}\t{}\n".format(chrom, pos, pos+1, fc))
-    finally:
-        if trackdata.outfile:
-            out.close()
+                try:
+                    fc = float(parsed[4])
+                except ValueError:
+                    continue
+                out.interval(chrom, pos, pos+1, fc)
 
 def homerToBedGraph(infile, trackdata):
     data = {}
 
-    if trackdata.outfile:
-        out = open(trackdata.outfile, "w")
-    else:
-        out = sys.stdout
-    out.write(trackdata.trackHeader())
-    try:
+    with trackdata.openTrack() as out:
         with open(infile, "r") as f:
             for line in f:
                 if line != '' and line[0] != '#':
@@ -258,12 +518,9 @@ def homerToBedGraph(infile, trackdata):
                     prev[1] = max(prev[1], row[1])
                     prev[2] += row[2]
                 else:
-                    out.write("{}\t{}\t{}\t{}\n".format(chrom, prev[0], prev[1], prev[2]))
+                    out.interval(chrom, prev[0], prev[1], prev[2])
                     prev = row
-            out.write("{}\t{}\t{}\t{}\n".format(chrom, prev[0], prev[1], prev[2]))
-    finally:
-        if trackdata.outfile:
-            out.close()
+            out.interval(chrom, prev[0], prev[1], prev[2])
 
 # ATAC mode
     
@@ -364,18 +621,92 @@ def bamToWigA(trackdata):
     sys.stderr.write("Normalizing on {} reads, scale={}\n".format(normalize, scale))
     f = 1.0 * scale / normalize
 
-    with Output(trackdata.outfile) as out:
-        G = GenomicWindower(window, out)
-        try:
-            for line in sys.stdin:
-                line = line.rstrip("\n").split("\t")
-                if addlen:
-                    G.add((line[0], int(line[1]), int(line[3])))
-                else:
-                    G.add((line[0], int(line[1]), 1))
-        finally:
+    if trackdata.bigwig:
+        bw = BigWig.BigWigWriter(trackdata.outfile)
+        G = GenomicWindower(window, track=bw)
+    else:
+        bw = None
+        out = Output(trackdata.outfile)
+        G = GenomicWindower(window, out.__enter__())
+    done = False
+    try:
+        for line in sys.stdin:
+            line = line.rstrip("\n").split("\t")
+            if addlen:
+                G.add((line[0], int(line[1]), int(line[3])))
+            else:
+                G.add((line[0], int(line[1]), 1))
+        done = True
+    finally:
+        if bw and not done:
+            bw.__exit__(Exception, None, None) # Discard the track instead of writing a partial file
+        else:
             G.close()
+            if bw:
+                bw.close()
+            else:
+                out.__exit__(None, None, None)
             
+# ATAC mode on BAM files
+
+ATACFLAGS = 0xF04               # Unmapped, secondary, QC-failed, duplicate and supplementary reads
+
+def atacChromBins(args):
+    """Count the Tn5 insertion sites of the reads on one chromosome in windows. `args' is a
+tuple (bamfile, chrom, length, window, addlen), to allow calling this through
+multiprocessing.Pool. Returns a tuple (chrom, bins, values), where `bins' contains the
+indexes of the non-empty windows and `values' their totals."""
+    (bamfile, chrom, length, window, addlen) = args
+    sites = []
+    weights = []
+    with pysam.AlignmentFile(bamfile, "rb") as bam:
+        for r in bam.fetch(chrom):
+            if r.flag & ATACFLAGS:
+                continue
+            if r.is_reverse:
+                sites.append(r.reference_end - 6)
+            else:
+                sites.append(r.reference_start + 4)
+            if addlen:
+                weights.append(abs(r.template_length) or r.reference_length)
+    if not sites:
+        return (chrom, np.zeros(0, dtype=np.int64), np.zeros(0))
+    sites = np.clip(np.array(sites, dtype=np.int64), 0, length - 1)
+    counts = np.bincount(sites // window, weights=weights if addlen else None, minlength=(length - 1) // window + 1)
+    bins = np.flatnonzero(counts)
+    return (chrom, bins, counts[bins])
+
+def bamToWigAtac(bamfile, trackdata):
+    """ATAC mode reading `bamfile' directly. Each chromosome is binned by atacChromBins(),
+in `nprocs' parallel processes, and values are scaled by SCALE / N."""
+    window = trackdata.window
+    normalize = trackdata.normalize
+    scale = trackdata.scale
+    sys.stderr.write("Normalizing on {} reads, scale={}\n".format(normalize, scale))
+    f = 1.0 * scale / normalize
+
+    with pysam.AlignmentFile(bamfile, "rb") as bam:
+        mapped = dict([ (idx.contig, idx.mapped) for idx in bam.get_index_statistics() ])
+        sizes = dict(zip(bam.references, bam.lengths))
+        args = [ (bamfile, chrom, sizes[chrom], window, trackdata.addlen) for chrom in bam.references
+                 if mapped.get(chrom) and (not chrom.startswith("ERCC") or trackdata.ercc) ]
+
+    with trackdata.openTrack(bamChromSizes(bamfile)) as out:
+        pool = None
+        try:
+            if trackdata.nprocs > 1 and len(args) > 1:
+                pool = multiprocessing.Pool(trackdata.nprocs)
+                results = pool.imap(atacChromBins, args)
+            else:
+                results = (atacChromBins(a) for a in args)
+            for (chrom, bins, values) in results:
+                if len(bins):
+                    out.bins(chrom, bins, values * f, sizes[chrom])
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
 def parseArgs(args, td):
     infile = None
     next = ""
@@ -394,6 +725,10 @@ def parseArgs(args, td):
             td.atac = True
         elif a == "-l":
             td.addlen = True
+        elif a == "-B":
+            td.bigwig = True
+        elif a == "-P":
+            td.pileup = True
         elif next == "-n":
             td.normalize = P.toInt(a)
             next = ""
@@ -415,10 +750,15 @@ def parseArgs(args, td):
         elif next == "-b":
             td.bambase = P.isFile(a)
             next = ""
-        elif a in ["-n", "-o", "-w", "-t", "-d", "-p", "-s", "-b"]:
+        elif next == "-j":
+            td.nprocs = P.toInt(a)
+            next = ""
+        elif a in ["-n", "-o", "-w", "-t", "-d", "-p", "-s", "-b", "-j"]:
             next = a
         else:
             infile = P.isFile(a)
+    if td.outfile and td.outfile.lower().endswith((".bw", ".bigwig")):
+        td.bigwig = True
     return infile
 
 def main(args):
@@ -426,14 +766,20 @@ def main(args):
     infile = parseArgs(args, td)
     if not infile and not td.atac:
         P.errmsg(P.NOFILE)
+    if td.bigwig and not td.outfile:
+        P.errmsg(P.NOOUT)
     if td.diff:
         diffToBedGraph(infile, td)
     elif td.meth:
         methToBedGraph(infile, td)
     elif td.homer:
         homerToBedGraph(infile, td)
+    elif td.atac and infile:
+        bamToWigAtac(infile, td)
     elif td.atac:
         bamToWigA(td)
+    elif td.bambase and td.pileup:
+        bamToWigDiff_old(infile, td.bambase, td)
     elif td.bambase:
         bamToWigDiff(infile, td.bambase, td)
     else:
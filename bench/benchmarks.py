@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+## Benchmark suite for bioscripts. Generates seeded synthetic data (see generators.py) in a
+## temporary directory, times a set of scenarios covering the main hot paths, and writes the
+## results in JSON format. Two results files can be compared with -c.
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+TOPDIR = os.path.join(BENCHDIR, "..")
+sys.path.insert(0, TOPDIR)
+
+import numpy as np
+
+import Utils
+import GeneList
+import generators
+import peakscmp_bench
+
+def usage():
+    sys.stderr.write("""benchmarks.py - Run the bioscripts benchmark suite.
+
+Usage: benchmarks.py [options]
+       benchmarks.py -c old.json new.json
+
+Options:
+
+  -o O | Write results in JSON format to file O (default: stdout).
+  -s S | Scale the size of all synthetic inputs by S (default: {}).
+  -r R | Run each scenario R times and report the best and median times (default: {}).
+  -k K | Only run the scenarios whose names are in the comma-separated list K.
+  -S S | Seed for the data generators (default: {}).
+  -l   | List available scenarios and exit.
+  -c   | Compare two results files, printing the ratio of the best times (new / old).
+         Ratios above {} are flagged as regressions.
+
+""".format(Bench.scale, Bench.repeat, Bench.seed, Bench.threshold))
+
+### Helpers
+
+def runScript(script, args, cwd):
+    """Run bioscripts program `script' with arguments `args' in directory `cwd', using the
+current Python interpreter. Raises an exception if the program fails."""
+    with open(os.devnull, "w") as devnull:
+        subprocess.check_call([sys.executable, os.path.join(TOPDIR, script)] + args, cwd=cwd, stdout=devnull, stderr=devnull)
+
+class quiet():
+    """Context manager to silence messages written to standard error by in-process scenarios."""
+    def __enter__(self):
+        self.stderr = sys.stderr
+        sys.stderr = open(os.devnull, "w")
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        sys.stderr.close()
+        sys.stderr = self.stderr
+
+### Scenarios. Each one is a function taking the work directory, the scale factor and the
+### seed. It generates its input data and returns a tuple (nrecords, fun), where `fun' is the
+### function to be timed, and `nrecords' the number of records it processes.
+
+def bedreader(tmpdir, scale, seed):
+    """Read a methylation BED file with Utils.BEDreader"""
+    n = int(500000 * scale)
+    bedfile = os.path.join(tmpdir, "meth.bed")
+    generators.writeMethBED(bedfile, n, seed)
+    def run():
+        BR = Utils.BEDreader(bedfile)
+        while BR.stream is not None:
+            BR.readNext()
+    return (n, run)
+
+def winavg(tmpdir, scale, seed):
+    """Window averages of methylation with dmaptools winavg"""
+    n = int(500000 * scale)
+    bedfile = os.path.join(tmpdir, "meth.bed")
+    generators.writeMethBED(bedfile, n, seed)
+    return (n, lambda: runScript("dmaptools.py", ["winavg", "-t", "1", "-o", "winavg.bed", bedfile], tmpdir))
+
+def gtfload(tmpdir, scale, seed):
+    """Load a GTF file with GeneList.GTFloader (including sorting and indexing), without cache"""
+    n = int(5000 * scale)
+    gtffile = os.path.join(tmpdir, "genes.gtf")
+    generators.writeGTF(gtffile, n, seed)
+    def run():
+        GeneList.GTFloader(gtffile).load(cache=False)
+    return (n, run)
+
+def gtfloadCached(tmpdir, scale, seed):
+    """Load a GTF file with GeneList.GTFloader from its cache"""
+    n = int(5000 * scale)
+    gtffile = os.path.join(tmpdir, "genes.gtf")
+    generators.writeGTF(gtffile, n, seed)
+    GeneList.GTFloader(gtffile).load(cache=True) # Create the cache before timing
+    def run():
+        GeneList.GTFloader(gtffile).load(cache=True)
+    return (n, run)
+
+def demuxsplit(tmpdir, scale, seed):
+    """Split a FASTQ file by barcode with demux split"""
+    n = int(100000 * scale)
+    bcfile = os.path.join(tmpdir, "barcodes.txt")
+    fqfile = os.path.join(tmpdir, "reads.fastq.gz")
+    barcodes = generators.writeBarcodes(bcfile, 24, seed)
+    generators.writeFastq(fqfile, n, barcodes, seed)
+    return (n, lambda: runScript("demux.py", ["split", "-b", bcfile, fqfile], tmpdir))
+
+def chromcov(tmpdir, scale, seed):
+    """Per-chromosome coverage of a BAM file with chromCoverage"""
+    n = int(50000 * scale)
+    bamfile = os.path.join(tmpdir, "reads.bam")
+    generators.writeBAM(bamfile, n, seed)
+    return (n, lambda: runScript("chromCoverage.py", ["-o", "coverage.txt", bamfile], tmpdir))
+
+def peaks(indexed):
+    def scenario(tmpdir, scale, seed):
+        n = int(16000 * scale)
+        file1 = os.path.join(tmpdir, "p1.xls")
+        file2 = os.path.join(tmpdir, "p2.xls")
+        peakscmp_bench.writePeaks(file1, n, seed)
+        peakscmp_bench.writePeaks(file2, n, seed + 1)
+        def run():
+            with quiet():
+                peakscmp_bench.run(file1, file2, indexed)
+        return (n, run)
+    scenario.__doc__ = "Compare two MACS2 peak files with peakscmp ({})".format("indexed" if indexed else "linear scan")
+    return scenario
+
+SCENARIOS = [("bedreader", bedreader),
+             ("winavg", winavg),
+             ("gtfload", gtfload),
+             ("gtfload-cached", gtfloadCached),
+             ("demux", demuxsplit),
+             ("chromcov", chromcov),
+             ("peakscmp-scan", peaks(False)),
+             ("peakscmp-indexed", peaks(True))]
+
+### Main class
+
+class Bench():
+    outfile = None
+    scale = 1.0
+    repeat = 3
+    seed = 1
+    wanted = None
+    threshold = 1.1             # Ratio above which a scenario is considered slower
+
+    def parseArgs(self, args):
+        if "-h" in args or "--help" in args:
+            usage()
+            sys.exit(0)
+        if "-l" in args:
+            for (name, fun) in SCENARIOS:
+                sys.stdout.write("{:18} {}\n".format(name, fun.__doc__))
+            sys.exit(0)
+        if "-c" in args:
+            files = [ a for a in args if a != "-c" ]
+            if len(files) != 2:
+                usage()
+                sys.exit(1)
+            compare(files[0], files[1], self.threshold)
+            sys.exit(0)
+        prev = ""
+        for a in args:
+            if prev == "-o":
+                self.outfile = a
+                prev = ""
+            elif prev == "-s":
+                self.scale = float(a)
+                prev = ""
+            elif prev == "-r":
+                self.repeat = int(a)
+                prev = ""
+            elif prev == "-k":
+                self.wanted = a.split(",")
+                prev = ""
+            elif prev == "-S":
+                self.seed = int(a)
+                prev = ""
+            elif a in ["-o", "-s", "-r", "-k", "-S"]:
+                prev = a
+
+    def runScenario(self, name, fun):
+        tmpdir = tempfile.mkdtemp(prefix="bench-")
+        try:
+            (nrecords, run) = fun(tmpdir, self.scale, self.seed)
+            times = []
+            for i in range(self.repeat):
+                t0 = time.time()
+                run()
+                times.append(time.time() - t0)
+        finally:
+            shutil.rmtree(tmpdir)
+        best = min(times)
+        return {'description': fun.__doc__,
+                'records': nrecords,
+                'times': times,
+                'best': best,
+                'median': float(np.median(times)),
+                'throughput': nrecords / best if best > 0 else None}
+
+    def run(self):
+        results = {}
+        for (name, fun) in SCENARIOS:
+            if self.wanted and name not in self.wanted:
+                continue
+            sys.stderr.write("{}... ".format(name))
+            r = self.runScenario(name, fun)
+            sys.stderr.write("{:.3f}s ({:.0f} records/s)\n".format(r['best'], r['throughput'] or 0))
+            results[name] = r
+        report = {'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+                  'python': platform.python_version(),
+                  'numpy': np.__version__,
+                  'platform': platform.platform(),
+                  'scale': self.scale,
+                  'repeat': self.repeat,
+                  'seed': self.seed,
+                  'results': results}
+        if self.outfile:
+            with open(self.outfile, "w") as out:
+                json.dump(report, out, indent=2, sort_keys=True)
+        else:
+            json.dump(report, sys.stdout, indent=2, sort_keys=True)
+            sys.stdout.write("\n")
+
+def compare(oldfile, newfile, threshold):
+    """Print a table comparing the best times for the scenarios in results files `oldfile' and `newfile'."""
+    with open(oldfile, "r") as f:
+        old = json.load(f)
+    with open(newfile, "r") as f:
+        new = json.load(f)
+    if old['scale'] != new['scale'] or old['seed'] != new['seed']:
+        sys.stderr.write("Warning: results were obtained with different scale or seed.\n")
+    sys.stdout.write("Scenario\tOld (s)\tNew (s)\tRatio\n")
+    for name in sorted(new['results']):
+        if name in old['results']:
+            t0 = old['results'][name]['best']
+            t1 = new['results'][name]['best']
+            ratio = t1 / t0 if t0 > 0 else float('inf')
+            flag = "\tSLOWER" if ratio > threshold else ""
+            sys.stdout.write("{}\t{:.3f}\t{:.3f}\t{:.2f}{}\n".format(name, t0, t1, ratio, flag))
+
+if __name__ == "__main__":
+    B = Bench()
+    B.parseArgs(sys.argv[1:])
+    B.run()
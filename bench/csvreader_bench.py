@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+## Micro-benchmark for Utils.FastCSVreader: compares it with Utils.CSVreader on a synthetic
+## methylation BED file (10M lines by default) when reading whole rows, when projecting three
+## columns, and when summing an integer column.
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import numpy as np
+
+import Utils
+import generators
+
+COLUMNS = [0, 1, 4]             # chrom, start, coverage
+
+def rowsSlow(bedfile):
+    n = 0
+    for row in Utils.CSVreader(bedfile):
+        n += 1
+    return n
+
+def rowsFast(bedfile):
+    n = 0
+    for row in Utils.FastCSVreader(bedfile):
+        n += 1
+    return n
+
+def projectSlow(bedfile):
+    n = 0
+    for row in Utils.CSVreader(bedfile):
+        row = [ row[c] for c in COLUMNS ]
+        n += 1
+    return n
+
+def projectFast(bedfile):
+    n = 0
+    for row in Utils.FastCSVreader(bedfile, columns=COLUMNS):
+        n += 1
+    return n
+
+def sumSlow(bedfile):
+    total = 0
+    for row in Utils.CSVreader(bedfile):
+        total += int(row[4])
+    return total
+
+def sumFast(bedfile):
+    total = 0
+    for block in Utils.FastCSVreader(bedfile, columns=COLUMNS, types={4: np.int64}).blocks():
+        total += int(block.column(2).sum())
+    return total
+
+TESTS = [("rows", rowsSlow, rowsFast),
+         ("project", projectSlow, projectFast),
+         ("typed-sum", sumSlow, sumFast)]
+
+def timed(fun, bedfile):
+    t0 = time.time()
+    result = fun(bedfile)
+    return (result, time.time() - t0)
+
+def main(nlines):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        bedfile = os.path.join(tmpdir, "meth.bed")
+        sys.stderr.write("Writing {} lines...\n".format(nlines))
+        generators.writeMethBED(bedfile, nlines, 1)
+        sys.stdout.write("Test\tCSVreader (s)\tFastCSVreader (s)\tSpeedup\n")
+        for (name, slow, fast) in TESTS:
+            (r1, t1) = timed(slow, bedfile)
+            (r2, t2) = timed(fast, bedfile)
+            if r1 != r2:
+                sys.stderr.write("Warning: different results for {}: {} {}\n".format(name, r1, r2))
+            sys.stdout.write("{}\t{:.3f}\t{:.3f}\t{:.1f}x\n".format(name, t1, t2, t1 / max(t2, 1e-6)))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    nlines = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    main(nlines)
@@ -0,0 +1,134 @@
+## Seeded generators of synthetic input files for the benchmarks. All functions take a
+## `seed' argument, and produce exactly the same file when called with the same arguments.
+
+import gzip
+import random
+
+import pysam
+
+BASES = "ACGT"
+
+def chromSizes(nchroms, size):
+    """Returns a list of (name, length) for `nchroms' chromosomes of `size' bp."""
+    return [ ("chr{}".format(i+1), size) for i in range(nchroms) ]
+
+def randomSeq(rnd, length):
+    return "".join([ rnd.choice(BASES) for i in range(length) ])
+
+def mutate(rnd, seq, nmut):
+    """Returns `seq' with `nmut' random substitutions."""
+    seq = list(seq)
+    for i in rnd.sample(range(len(seq)), nmut):
+        seq[i] = rnd.choice([ b for b in BASES if b != seq[i] ])
+    return "".join(seq)
+
+### Methylation
+
+def writeMethBED(filename, nsites, seed, nchroms=4, chromsize=10000000):
+    """Write a methylation BED file (as produced by mcall) with `nsites' CpG sites sorted by
+position: chrom, start, end, % methylation, coverage, number of methylated Cs."""
+    rnd = random.Random(seed)
+    with open(filename, "w") as out:
+        for (chrom, size) in chromSizes(nchroms, chromsize):
+            pos = 0
+            step = 2 * size // (nsites // nchroms + 1)
+            for i in range(nsites // nchroms):
+                pos += rnd.randint(1, step)
+                cov = rnd.randint(1, 40)
+                nc = rnd.randint(0, cov)
+                out.write("{}\t{}\t{}\t{:.4f}\t{}\t{}\n".format(chrom, pos, pos+1, 1.0 * nc / cov, cov, nc))
+
+### Gene annotations
+
+def writeGTF(filename, ngenes, seed, nchroms=4, chromsize=10000000):
+    """Write an Ensembl-style GTF file with `ngenes' genes, each with 1-3 transcripts of 1-10 exons."""
+    rnd = random.Random(seed)
+    biotypes = ["protein_coding", "lincRNA", "antisense"]
+    with open(filename, "w") as out:
+        g = 0
+        for (chrom, size) in chromSizes(nchroms, chromsize):
+            chromname = chrom[3:]       # Ensembl style, without `chr'
+            starts = sorted([ rnd.randint(1, size - 200000) for i in range(ngenes // nchroms) ])
+            for gstart in starts:
+                g += 1
+                gid = "ENSG{:011d}".format(g)
+                strand = rnd.choice("+-")
+                biotype = rnd.choice(biotypes)
+                transcripts = []
+                for t in range(rnd.randint(1, 3)):
+                    exons = []
+                    pos = gstart + rnd.randint(0, 2000)
+                    for e in range(rnd.randint(1, 10)):
+                        elen = rnd.randint(50, 400)
+                        exons.append((pos, pos + elen))
+                        pos += elen + rnd.randint(100, 5000)
+                    transcripts.append(exons)
+                gend = max([ tx[-1][1] for tx in transcripts ])
+                gattrs = 'gene_id "{}"; gene_name "G{}"; gene_biotype "{}";'.format(gid, g, biotype)
+                out.write("{}\tbench\tgene\t{}\t{}\t.\t{}\t.\t{}\n".format(chromname, gstart, gend, strand, gattrs))
+                for t, exons in enumerate(transcripts):
+                    tid = "ENST{:011d}".format(g * 10 + t)
+                    tattrs = gattrs + ' transcript_id "{}"; transcript_name "G{}-{}"; transcript_biotype "{}";'.format(tid, g, t+1, biotype)
+                    out.write("{}\tbench\ttranscript\t{}\t{}\t.\t{}\t.\t{}\n".format(chromname, exons[0][0], exons[-1][1], strand, tattrs))
+                    for (s, e) in exons:
+                        out.write("{}\tbench\texon\t{}\t{}\t.\t{}\t.\t{}\n".format(chromname, s, e, strand, tattrs))
+                        if biotype == "protein_coding":
+                            out.write("{}\tbench\tCDS\t{}\t{}\t.\t{}\t0\t{}\n".format(chromname, s, e, strand, tattrs))
+
+### Reads
+
+def writeBarcodes(filename, nbarcodes, seed, length=8):
+    """Write a barcodes file for demux.py (name, sequence) and return the list of sequences."""
+    rnd = random.Random(seed)
+    seqs = []
+    while len(seqs) < nbarcodes:
+        bc = randomSeq(rnd, length)
+        if bc not in seqs:
+            seqs.append(bc)
+    with open(filename, "w") as out:
+        for i, bc in enumerate(seqs):
+            out.write("S{}\t{}\n".format(i+1, bc))
+    return seqs
+
+def writeFastq(filename, nreads, barcodes, seed, readlen=100, pmismatch=0.1, pother=0.05):
+    """Write a gzipped FASTQ file with `nreads' reads whose names end with a barcode from `barcodes'
+(Illumina style). A fraction `pmismatch' of barcodes has one mismatch, and a fraction `pother'
+is a random sequence."""
+    rnd = random.Random(seed)
+    qual = "I" * readlen
+    with gzip.open(filename, "wb") as out:
+        for i in range(nreads):
+            r = rnd.random()
+            if r < pother:
+                bc = randomSeq(rnd, len(barcodes[0]))
+            else:
+                bc = rnd.choice(barcodes)
+                if r < pother + pmismatch:
+                    bc = mutate(rnd, bc, 1)
+            out.write("@BENCH:1:FC:1:{}:{}:{} 1:N:0:{}\n{}\n+\n{}\n".format(i // 10000 + 1, i % 10000, i, bc, randomSeq(rnd, readlen), qual))
+
+def writeBAM(filename, nreads, seed, nchroms=2, chromsize=1000000, readlen=100):
+    """Write a coordinate-sorted, indexed BAM file with `nreads' single-end reads placed at
+random positions on `nchroms' chromosomes."""
+    rnd = random.Random(seed)
+    chroms = chromSizes(nchroms, chromsize)
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+              'SQ': [ {'SN': name, 'LN': size} for (name, size) in chroms ]}
+    qual = pysam.qualitystring_to_array("I" * readlen)
+    with pysam.AlignmentFile(filename, "wb", header=header) as out:
+        n = 0
+        for tid, (name, size) in enumerate(chroms):
+            positions = sorted([ rnd.randint(0, size - readlen) for i in range(nreads // nchroms) ])
+            for pos in positions:
+                n += 1
+                a = pysam.AlignedSegment()
+                a.query_name = "read{}".format(n)
+                a.query_sequence = randomSeq(rnd, readlen)
+                a.flag = 16 if rnd.random() < 0.5 else 0
+                a.reference_id = tid
+                a.reference_start = pos
+                a.mapping_quality = 60
+                a.cigartuples = [(0, readlen)]
+                a.query_qualities = qual
+                out.write(a)
+    pysam.index(filename)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+## Benchmark for the threaded gzip streams returned by Utils.genOpen (GzipWriter and
+## GzipReader): compares their throughput with the gzip module when writing and reading a
+## synthetic FASTQ file (2 GB uncompressed by default), one line at a time.
+
+import os
+import sys
+import time
+import gzip
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import Utils
+import generators
+
+def usage():
+    sys.stderr.write("""gzip_bench.py - Compare threaded gzip streams with the gzip module.
+
+Usage: gzip_bench.py [options]
+
+Options:
+
+  -m M | Size of the uncompressed FASTQ file in MB (default: {}).
+  -l L | Compression level (default: {}).
+  -t T | Number of compression threads (default: {}).
+
+""".format(2000, Utils.GZIP_LEVEL, Utils.GZIP_THREADS))
+
+def fastqRecords(n, seed, readlen=100):
+    """Returns a list of `n' random FASTQ records (as strings)."""
+    rnd = random.Random(seed)
+    quals = "#-7<AFJ"
+    return [ "@BENCH:1:FC:1:{}:{}:{} 1:N:0:ACGTACGT\n{}\n+\n{}\n".format(i // 1000, i % 1000, i, generators.randomSeq(rnd, readlen),
+                                                                      "".join([ rnd.choice(quals) for j in range(readlen) ]))
+             for i in range(n) ]
+
+def writeFastq(out, records, size):
+    """Write `records' to `out' one line at a time, cycling over them until `size' bytes have been written."""
+    written = 0
+    while written < size:
+        for rec in records:
+            for line in rec.splitlines(True):
+                out.write(line)
+            written += len(rec)
+    return written
+
+def readFastq(f):
+    n = 0
+    for line in f:
+        n += len(line)
+    return n
+
+def timed(fun, *args):
+    t0 = time.time()
+    result = fun(*args)
+    return (result, time.time() - t0)
+
+def main(size, level, threads):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        records = fastqRecords(20000, 1)
+        oldfile = os.path.join(tmpdir, "old.fastq.gz")
+        newfile = os.path.join(tmpdir, "new.fastq.gz")
+
+        with gzip.open(oldfile, "wb", level) as out:
+            (n, twold) = timed(writeFastq, out, records, size)
+        with Utils.genOpen(newfile, "w", level=level, threads=threads) as out:
+            (n, twnew) = timed(writeFastq, out, records, size)
+        with gzip.open(oldfile, "rb") as f:
+            (n1, trold) = timed(readFastq, f)
+        with Utils.genOpen(newfile, "r", threads=threads) as f:
+            (n2, trnew) = timed(readFastq, f)
+        if n1 != n2:
+            sys.stderr.write("Warning: read {} and {} bytes.\n".format(n1, n2))
+        mb = n / 1e6
+
+        sys.stdout.write("Uncompressed size: {:.0f} MB, level {}, {} threads\n".format(mb, level, threads))
+        sys.stdout.write("Compressed size: {:.1f} MB (gzip), {:.1f} MB (threaded)\n".format(os.path.getsize(oldfile) / 1e6, os.path.getsize(newfile) / 1e6))
+        sys.stdout.write("Test\tgzip (MB/s)\tThreaded (MB/s)\tSpeedup\n")
+        sys.stdout.write("write\t{:.1f}\t{:.1f}\t{:.1f}x\n".format(mb / twold, mb / twnew, twold / twnew))
+        sys.stdout.write("read\t{:.1f}\t{:.1f}\t{:.1f}x\n".format(mb / trold, mb / trnew, trold / trnew))
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "-h" in args or "--help" in args:
+        usage()
+        sys.exit(0)
+    size = 2000
+    level = Utils.GZIP_LEVEL
+    threads = max(Utils.GZIP_THREADS, 1)
+    prev = ""
+    for a in args:
+        if prev == "-m":
+            size = int(a)
+            prev = ""
+        elif prev == "-l":
+            level = int(a)
+            prev = ""
+        elif prev == "-t":
+            threads = int(a)
+            prev = ""
+        elif a in ["-m", "-l", "-t"]:
+            prev = a
+    main(size * 1000000, level, threads)
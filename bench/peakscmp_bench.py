@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+## Benchmark for peakscmp.py: compares the linear scan (findRegion) with the
+## indexed search (findRegionIndexed) on synthetic MACS2 peak sets of increasing size.
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import peakscmp
+
+CHROMS = ["chr1", "chr2", "chr3", "chr4"]
+
+def writePeaks(filename, npeaks, seed, chromsize=50000000):
+    """Write a synthetic MACS2 .xls file with `npeaks' peaks spread over CHROMS."""
+    rnd = random.Random(seed)
+    with open(filename, "w") as out:
+        out.write("# This file is generated by MACS\n# tags after filtering in treatment: {}\n\n".format(npeaks * 100))
+        out.write("chr\tstart\tend\tlength\tabs_summit\tpileup\t-log10(pvalue)\tfold_enrichment\t-log10(qvalue)\tname\n")
+        for chrom in CHROMS:
+            starts = sorted([ rnd.randint(1, chromsize) for i in range(npeaks // len(CHROMS)) ])
+            for s in starts:
+                e = s + rnd.randint(150, 2000)
+                out.write("{}\t{}\t{}\t{}\t{}\t{:.2f}\t10\t5\t10\tpeak\n".format(chrom, s, e, e-s+1, s+50, rnd.uniform(5, 100)))
+
+def run(file1, file2, indexed):
+    P = peakscmp.macsDiff("peakscmp", version="1.0", usage=peakscmp.usage,
+                          errors=[("BADOVERLAP", "Bad overlap value", "")])
+    P.filename1 = file1
+    P.filename2 = file2
+    P.readFirst()
+    if not indexed:
+        P.indexes = {}
+    with open(os.devnull, "w") as out:
+        t0 = time.time()
+        P.readSecond(out)
+        return time.time() - t0
+
+def main(sizes):
+    tmpdir = tempfile.mkdtemp()
+    stderr = sys.stderr
+    try:
+        sys.stdout.write("Peaks\tScan (s)\tIndexed (s)\tSpeedup\n")
+        for n in sizes:
+            file1 = os.path.join(tmpdir, "p1.xls")
+            file2 = os.path.join(tmpdir, "p2.xls")
+            writePeaks(file1, n, 1)
+            writePeaks(file2, n, 2)
+            sys.stderr = open(os.devnull, "w")
+            try:
+                tscan = run(file1, file2, False)
+                tidx = run(file1, file2, True)
+            finally:
+                sys.stderr.close()
+                sys.stderr = stderr
+            sys.stdout.write("{}\t{:.3f}\t{:.3f}\t{:.1f}x\n".format(n, tscan, tidx, tscan / max(tidx, 1e-6)))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    sizes = [ int(a) for a in sys.argv[1:] ] or [1000, 4000, 16000, 64000]
+    main(sizes)
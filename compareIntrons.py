@@ -3,6 +3,7 @@
 import sys
 import math
 import os.path
+import numpy as np
 
 import Script
 
@@ -22,6 +23,14 @@ Options:
  -o  FILE | Set output file to FILE (default: stdout)
  -fc F    | Set fold change threshold to F (default: {})
  -t  T    | Set coverage threshold to T (default: {})
+ -s  I[,J] | Add a sample with introns in BED file I and (optionally) junctions
+            in BED file J. Can be repeated. If two or more samples are specified,
+            all pairs of samples are compared (-i1, -i2, -j1, -j2 are ignored).
+
+In multi-sample mode, the output has two additional columns after the intron ID,
+containing the names of the two samples being compared (the names of their intron
+files without extension). A summary line for each pair of samples is written to
+standard error.
 
 """.format(progname, progname, Params.fc, Params.thr))
 
@@ -37,6 +46,24 @@ def readBEDfile(bedfile):
     sys.stderr.write("done, {} entries.\n".format(len(dict)))
     return dict
 
+def readBEDcolumn(bedfile, index, values):
+    """Like readBEDfile(), but stores the value for each entry whose name is in `index' (a
+dictionary mapping names to integer IDs) in the `values' array, at the position given by its ID."""
+    n = 0
+    sys.stderr.write("Reading `{}'... ".format(bedfile))
+    with open(bedfile, "r") as f:
+        for line in f:
+            parsed = line.rstrip("\r\n").split("\t")
+            i = index.get(parsed[3])
+            if i is not None:
+                values[i] = float(parsed[7])
+            n += 1
+    sys.stderr.write("done, {} entries.\n".format(n))
+    return values
+
+def sampleName(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
 def dget(key, dict):
     if key in dict:
         return dict[key]
@@ -56,12 +83,14 @@ class Params():
     junc1 = {}
     intr2 = {}
     junc2 = {}
+    samples = []                # List of (intronsfile, juncsfile) for multi-sample mode
 
     def __init__(self):
         self.intr1 = {}
         self.junc1 = {}
         self.intr2 = {}
         self.junc2 = {}
+        self.samples = []
 
     def parseArgs(self, args):
         P.standardOpts(args)
@@ -88,11 +117,17 @@ class Params():
             elif next == "-t":
                 self.thr = P.toFloat(a)
                 next = ""
-            elif a in ["-i1", "-j1", "-i2", "-j2", "-fc", "-o", "-t"]:
+            elif next == "-s":
+                files = a.split(",")
+                self.samples.append((P.isFile(files[0]), P.isFile(files[1]) if len(files) > 1 else None))
+                next = ""
+            elif a in ["-i1", "-j1", "-i2", "-j2", "-fc", "-o", "-t", "-s"]:
                 next = a
             else:
                 self.bedfile = a
-        if self.bedfile == None or self.introns1file == None or self.introns2file == None:
+        if self.bedfile == None:
+            P.errmsg(P.NOFILE)
+        if len(self.samples) < 2 and (self.introns1file == None or self.introns2file == None):
             P.errmsg(P.NOFILE)
     
     def readFiles(self):
@@ -147,9 +182,93 @@ class Params():
                                 maxdn = l2fc
         return (nin, nup, ndown, maxup, maxdn)
 
+    def readMatrix(self):
+        """Read the introns database and the files for all samples. Each distinct intron name
+is assigned an integer ID, and the values for all samples are stored in a matrix with
+one row per ID and one column per sample. Returns the tuple (rows, ids, matrix), where
+`rows' contains (gene, tx, intid) for each line of the introns database and `ids' is an
+array with the ID of each line."""
+        index = {}
+        rows = []
+        ids = []
+        with open(self.bedfile, "r") as f:
+            for line in f:
+                parsed = line.rstrip("\r\n").split("\t")
+                intron = parsed[3]
+                sp = intron.split("_")
+                rows.append((parsed[4], sp[0], sp[1]))
+                ids.append(index.setdefault(intron, len(index)))
+        juncsa = {}
+        juncsb = {}
+        for intron, i in index.iteritems():
+            juncsa[intron + "_a"] = i
+            juncsb[intron + "_b"] = i
+        nintrons = len(index)
+        matrix = np.zeros((nintrons, len(self.samples)))
+        for s, (intronsfile, juncsfile) in enumerate(self.samples):
+            iv = readBEDcolumn(intronsfile, index, np.zeros(nintrons))
+            if juncsfile:
+                ja = readBEDcolumn(juncsfile, juncsa, np.zeros(nintrons))
+                jb = readBEDcolumn(juncsfile, juncsb, np.zeros(nintrons))
+                iv = (iv + ja + jb) / 3.0
+            matrix[:, s] = iv
+        return (rows, np.array(ids, dtype=np.int64), matrix)
+
+    def comparePair(self, out, rows, names, iv1, iv2):
+        """Vectorized version of compare() for one pair of samples, with values `iv1' and `iv2'
+(one for each line of the introns database)."""
+        z1 = (iv1 == 0)
+        z2 = (iv2 == 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            l2fc = np.log(iv2 / iv1) / math.log(2)
+            sig = ~z1 & ~z2 & (np.abs(l2fc) > self.fc)
+            up = sig & (l2fc > 0)
+            down = sig & (l2fc <= 0)
+            inf1 = z1 & ~z2 & (iv2 >= self.thr)
+            inf2 = z2 & ~z1 & (iv1 >= self.thr)
+        iv1l = iv1.tolist()
+        iv2l = iv2.tolist()
+        l2fcl = l2fc.tolist()
+        for i in np.flatnonzero(sig | inf1 | inf2).tolist():
+            if inf1[i]:
+                fc = "+inf"
+            elif inf2[i]:
+                fc = "-inf"
+            else:
+                fc = l2fcl[i]
+            out.write("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(rows[i][0], rows[i][1], rows[i][2], names[0], names[1], iv1l[i], iv2l[i], fc))
+        maxup = max(0, float(l2fc[up].max())) if up.any() else 0
+        maxdn = min(0, float(l2fc[down].min())) if down.any() else 0
+        return (int(up.sum()), int(down.sum()), maxup, maxdn)
+
+    def compareMulti(self, out):
+        """Compare all pairs of samples. Returns the number of introns and a list of
+(name1, name2, nup, ndown, maxup, maxdn) tuples, one for each pair."""
+        (rows, ids, matrix) = self.readMatrix()
+        names = [ sampleName(s[0]) for s in self.samples ]
+        values = matrix[ids]
+        results = []
+        for a in range(len(names)):
+            for b in range(a+1, len(names)):
+                (nup, ndown, maxup, maxdn) = self.comparePair(out, rows, (names[a], names[b]), values[:, a], values[:, b])
+                results.append((names[a], names[b], nup, ndown, maxup, maxdn))
+        return (len(rows), results)
+
+def multiMain(PA):
+    if PA.outfile:
+        with open(PA.outfile, "w") as out:
+            (nin, results) = PA.compareMulti(out)
+    else:
+        (nin, results) = PA.compareMulti(sys.stdout)
+    for r in results:
+        sys.stderr.write("{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(r[0], r[1], nin, *r[2:]))
+
 if __name__ == "__main__":
     PA = Params()
     PA.parseArgs(sys.argv[1:])
+    if len(PA.samples) > 1:
+        multiMain(PA)
+        sys.exit(0)
     PA.readFiles()
     if PA.outfile:
         with open(PA.outfile, "w") as out:
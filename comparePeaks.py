@@ -1,9 +1,21 @@
 #!/usr/bin/env python
 
 import sys
+import heapq
+import bisect
 
 import Utils
 
+def usage():
+    sys.stderr.write("""Usage: comparePeaks.py peaks1 peaks2
+       comparePeaks.py -m peaks1 peaks2 ... peaksN
+
+In the first form, find the peaks in `peaks2' that match a peak in `peaks1'.
+In the second form (-m), merge the peaks from all files into consensus regions
+(sets of overlapping peaks) and write a presence/absence matrix with one row for
+each region and one column for each file.
+""")
+
 def readPeaks(filename):
     d = {}
     nread = 0
@@ -43,6 +55,30 @@ def findMatchingPeak(peaks, start, end, size, over=0.5):
                 return ("O", p, ov)
     return None
 
+def indexPeaks(peaks):
+    """Returns a tuple (starts, maxends) for a list of peaks sorted by start position, where
+maxends contains the running maximum of the peak ends. Returns None if `peaks' is not sorted."""
+    starts = [ p[0] for p in peaks ]
+    for i in range(len(starts)-1):
+        if starts[i] > starts[i+1]:
+            return None
+    maxends = []
+    m = None
+    for p in peaks:
+        if m is None or p[1] > m:
+            m = p[1]
+        maxends.append(m)
+    return (starts, maxends)
+
+def findMatchingPeakIndexed(peaks, index, start, end, size, over=0.5):
+    """Same as findMatchingPeak(), but only examines the peaks that can match: those starting
+at or before `end' (found by binary search on the starts) and following the last peak whose
+end is at or before `start' (found by binary search on the running maximum of the ends)."""
+    (starts, maxends) = index
+    hi = bisect.bisect_right(starts, end)
+    lo = bisect.bisect_right(maxends, start, 0, hi)
+    return findMatchingPeak(peaks[lo:hi], start, end, size, over)
+
 def comparePeaks(filename1, filename2, out):
     dict1 = readPeaks(filename1)
     dict2 = readPeaks(filename2)
@@ -55,9 +91,13 @@ def comparePeaks(filename1, filename2, out):
 
     for chrom in chroms:
         l1 = dict1[chrom]
-        l2 = dict2[chrom]
+        l2 = dict2.get(chrom, [])
+        idx1 = indexPeaks(l1)
         for p2 in l2:
-            res = findMatchingPeak(l1, p2[0], p2[1], p2[2])
+            if idx1:
+                res = findMatchingPeakIndexed(l1, idx1, p2[0], p2[1], p2[2])
+            else:
+                res = findMatchingPeak(l1, p2[0], p2[1], p2[2])
             if res:
                 key = res[0]
                 p1 = res[1]
@@ -72,8 +112,51 @@ def comparePeaks(filename1, filename2, out):
                     out.write("O\t{}\t{}\t{}\t{}\t{}\t{}\n".format(chrom, p1[0], p1[1], p2[0], p2[1], p2[2]-p1[2]))
 
     sys.stderr.write("Increased: {}\nDecreased: {}\nShifted: {}\n".format(nI, nD, nO))
-            
+
+def samplePeaks(peaks, sample):
+    """Generator returning (start, end, sample) for each peak in `peaks', in order of position."""
+    for p in sorted(peaks):
+        yield (p[0], p[1], sample)
+
+def multiPeaks(filenames, out):
+    """Merge the peaks from all files in `filenames' into consensus regions (maximal sets of
+overlapping peaks) with a single sweep over the peaks of all files sorted by position, and
+write one row for each region with the number of files having a peak in it and a 1/0 
+presence flag for each file."""
+    dicts = [ readPeaks(f) for f in filenames ]
+    nfiles = len(filenames)
+    chroms = set()
+    for d in dicts:
+        chroms.update(d.keys())
+    nregions = 0
+
+    out.write("#Chrom\tStart\tEnd\tNfiles\t" + "\t".join([ Utils.filenameNoExt(f) for f in filenames ]) + "\n")
+    for chrom in sorted(chroms):
+        streams = [ samplePeaks(dicts[i].get(chrom, []), i) for i in range(nfiles) ]
+        rstart = rend = None
+        present = [0]*nfiles
+        for (start, end, sample) in heapq.merge(*streams):
+            if rend is not None and start < rend:
+                rend = max(rend, end)
+            else:
+                if rend is not None:
+                    out.write("{}\t{}\t{}\t{}\t{}\n".format(chrom, rstart, rend, sum(present), "\t".join([ str(x) for x in present ])))
+                    nregions += 1
+                rstart = start
+                rend = end
+                present = [0]*nfiles
+            present[sample] = 1
+        if rend is not None:
+            out.write("{}\t{}\t{}\t{}\t{}\n".format(chrom, rstart, rend, sum(present), "\t".join([ str(x) for x in present ])))
+            nregions += 1
+
+    sys.stderr.write("{} consensus regions from {} files.\n".format(nregions, nfiles))
 
 if __name__ == "__main__":
     args = sys.argv
-    comparePeaks(args[1], args[2], sys.stdout)
+    if len(args) > 2 and args[1] == "-m":
+        multiPeaks(args[2:], sys.stdout)
+    elif len(args) > 2:
+        comparePeaks(args[1], args[2], sys.stdout)
+    else:
+        usage()
@@ -1,8 +1,6 @@
 #!/usr/bin/env python
 
 import sys
-import gzip
-import os.path
 
 import Script
 import Utils
@@ -54,18 +52,10 @@ def getReadName(h):
     else:
         return h[:p]
 
-def genOpen(filename, mode):
-    """Generalized open() function - works on both regular files and .gz files."""
-    (name, ext) = os.path.splitext(filename)
-    if ext == ".gz":
-        return gzip.open(filename, mode)
-    else:
-        return open(filename, mode)
-
 def countSeqs(filename):
     nseqs = 0
     nbases = 0
-    with genOpen(filename, "r") as f:
+    with Utils.genOpen(filename, "r") as f:
         line = f.readline()
         if len(line) > 0:
             if line[0] == '>':
@@ -112,8 +102,8 @@ def verifyPaired(filename1, filename2):
     lendiff = 0
     qualdiff = 0
     namemismatch = 0
-    with genOpen(filename1, "r") as f1:
-        with genOpen(filename2, "r") as f2:
+    with Utils.genOpen(filename1, "r") as f1:
+        with Utils.genOpen(filename2, "r") as f2:
             while True:
                 h1 = f1.readline()
                 r1 = f1.readline()
@@ -157,10 +147,10 @@ Name mismatch: {}
 def cutReads(filename1, filename2, outfile1, outfile2):
     nin = 0
     nout = 0
-    f1 = genOpen(filename1, "r")
-    f2 = genOpen(filename2, "r")
-    o1 = genOpen(outfile1, "w")
-    o2 = genOpen(outfile2, "w")
+    f1 = Utils.genOpen(filename1, "r")
+    f2 = Utils.genOpen(filename2, "r")
+    o1 = Utils.genOpen(outfile1, "w")
+    o2 = Utils.genOpen(outfile2, "w")
     try:
         while True:
             h1 = f1.readline().rstrip("\r\n")
@@ -189,7 +179,7 @@ def cutReads(filename1, filename2, outfile1, outfile2):
 def checkQuality(filename):
     minq = 1000
     maxq = 0
-    with genOpen(filename, "r") as f:
+    with Utils.genOpen(filename, "r") as f:
         while True:
             h = f.readline().rstrip("\r\n")
             r = f.readline().rstrip("\r\n")
@@ -5,7 +5,8 @@ import csv
 import numpy as np
 import scipy.stats
 
-from Utils import BEDreader, DualBEDreader, MATreader, METHreader, REGreader, readDelim
+from Utils import DualBEDreader, REGreader, readDelim
+from MethBin import openBEDreader, openMATreader, openMETHreader
 
 import Script
 
@@ -694,8 +695,8 @@ class DMR():
         
     def findDMRs(self, out, avgout=None):
         DW = DMRwriter(out, self.gap*self.winsize, samedir=self.samedir)
-        BR1 = BEDreader(self.bedfile1, jump=self.jump)
-        BR2 = BEDreader(self.bedfile2, jump=self.jump)
+        BR1 = openBEDreader(self.bedfile1, jump=self.jump)
+        BR2 = openBEDreader(self.bedfile2, jump=self.jump)
         chrom = BR1.chrom       # assume that both BED files start with the same chrom - should check this!
         
         start = 0
@@ -878,7 +879,7 @@ class DMR2():
     def findDMRs(self, out):
         self.DW.out = out
         out.write("#Chrom\tStart\tEnd\tLen\tDiffmeth\tNsites\n")
-        BR = DualBEDreader(self.bedfile1, self.bedfile2)
+        BR = DualBEDreader(self.bedfile1, self.bedfile2, reader=openBEDreader)
         while True:
             if BR.readNext():
                 c1 = BR.current1
@@ -958,7 +959,7 @@ class WINAVG():
             return False
 
     def winAvg(self, out):
-        BR = BEDreader(self.bedfile)
+        BR = openBEDreader(self.bedfile)
         chrom = BR.chrom
         start = 0
         end = self.winsize
@@ -1022,7 +1023,7 @@ class WINMAT():
             P.errmsg(P.NOFILE)
 
     def winMat(self, out):
-        BR = MATreader(self.matfile)
+        BR = openMATreader(self.matfile)
         chrom = BR.chrom
         start = 0
         end = self.winsize
@@ -1174,7 +1175,7 @@ class REGAVG():
         self.vector = np.zeros((2, self.totsize))
 
     def run(self):
-        self.bedreader = METHreader(self.bedfile, skipHdr=False)
+        self.bedreader = openMETHreader(self.bedfile, skipHdr=False)
         self.bedreader.readNext()
         self.regreader = REGreader(self.regfile, skipHdr=False)
         self.regreader.readNext()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import sys
+import numpy as np
 import Script
 import GeneList
 
@@ -60,6 +61,7 @@ class Params(Script.Script):
     minsites = 1                # minimum number of sites
     classify = False            # If true, run in classify mode (all other options are ignored)
     ignore = False              # If set to a float, values read from file equal to this will be ignored (used for -mat files).
+    sweep = False               # If true, use the sorted sweep engine (writeChromGenesSweep)
 
     # Runtime
     genelist = []               # All genes
@@ -105,6 +107,8 @@ class Params(Script.Script):
                 self.diffsorted = True
             elif a == '-c':
                 self.classify = True
+            elif a == '-f':
+                self.sweep = True
             elif self.methfile == None:
                 self.methfile = a
             elif self.genesfile == None:
@@ -120,7 +124,9 @@ Regions: {}
 Upstream/downstream: {} / {} bp
 Mode: {}
 Min sites: {}
-""".format(self.methfile, self.genesfile, self.outfile or "standard output", decodeRegions(self.regions), self.updistance, self.dndistance, self.mode, self.minsites))
+Engine: {}
+""".format(self.methfile, self.genesfile, self.outfile or "standard output", decodeRegions(self.regions), self.updistance, self.dndistance, self.mode, self.minsites,
+           "sweep" if self.sweep else "scan"))
 
     def genesOnChrom(self, chrom):
         return self.genelist.genesOnChrom(chrom)
@@ -153,6 +159,7 @@ Min sites: {}
         valcol = self.datacol
         thischrom = ""
         chromdata = []
+        writeChromGenes = self.writeChromGenesSweep if self.sweep else self.writeChromGenes
         if self.outfile:
             out = open(self.outfile, "w")
         else:
@@ -166,7 +173,7 @@ Min sites: {}
                     chrom = parsed[chrcol]
                     if chrom != thischrom:
                         if thischrom != "":
-                            nwritten += self.writeChromGenes(out, reg, chromdata, genelist.genesOnChrom(thischrom), thischrom)
+                            nwritten += writeChromGenes(out, reg, chromdata, genelist.genesOnChrom(thischrom), thischrom)
                         thischrom = chrom
                         # sys.stderr.write("Found chrom {}\n".format(chrom))
                         v = float(parsed[valcol])
@@ -178,7 +185,7 @@ Min sites: {}
                         if self.ignore and v == self.ignore:
                             continue
                         chromdata.append((int(parsed[poscol]), v))
-            nwritten += self.writeChromGenes(out, reg, chromdata, genelist.genesOnChrom(thischrom), thischrom)
+            nwritten += writeChromGenes(out, reg, chromdata, genelist.genesOnChrom(thischrom), thischrom)
             
             # If we wanted sorted output, nothing has been written so far
             if self.diffsorted:
@@ -260,6 +267,90 @@ Min sites: {}
                 nwritten += 1
         return nwritten
 
+    def writeChromGenesSweep(self, out, reg, data, genes, chrom):
+        """Same as writeChromGenes(), but the sites in each gene region are located with a single
+searchsorted() call on the (sorted) site positions instead of scanning `data' once per gene."""
+        sys.stderr.write("Writing values for {} genes on {}.\n".format(len(genes), chrom))
+        mode = self.mode
+        nwritten = 0
+
+        granges = []
+        for g in genes:
+            grange = g.getRegion(reg)
+            if grange:
+                granges.append((g, grange))
+        if not granges:
+            return 0
+
+        positions = np.array([ x[0] for x in data ], dtype=np.int64)
+        values = np.array([ x[1] for x in data ], dtype=np.float64)
+        lo = np.searchsorted(positions, np.array([ gr[1][0] for gr in granges ]), side='left')
+        hi = np.searchsorted(positions, np.array([ gr[1][1] for gr in granges ]), side='right')
+        hi = np.maximum(lo, hi)
+        nsites = hi - lo
+        poslist = positions.tolist()
+        vallist = values.tolist()
+
+        if mode == 'none':
+            for i in range(len(granges)):
+                (g, grange) = granges[i]
+                datarow = [g.name, g.chrom, grange[0], grange[1], g.strand, 1, 0]
+                for j in range(lo[i], hi[i]):
+                    datarow[2] = poslist[j]
+                    datarow[3] = poslist[j]+1
+                    datarow[6] = vallist[j]
+                    out.write("\t".join([str(x) for x in datarow]) + "\n")
+            return 0
+
+        if mode in ['avg', 'abs']:
+            scores = self._sweepSums(np.abs(values) if mode == 'abs' else values, lo, nsites)
+        elif mode in ['max', 'min']:
+            # reduceat() over interleaved (lo, hi) pairs: even entries are the
+            # per-gene reductions. The sentinel keeps hi a valid index.
+            ext = np.append(values, 0.0)
+            idx = np.empty(2*len(lo), dtype=np.int64)
+            idx[0::2] = lo
+            idx[1::2] = hi
+            if mode == 'max':
+                scores = np.maximum(np.maximum.reduceat(ext, idx)[0::2], 0.0)
+            else:
+                scores = np.minimum(np.minimum.reduceat(ext, idx)[0::2], 0.0)
+            scores += 0.0       # -0.0 becomes 0.0, as in the scan engine
+        elif mode == 'bal':
+            npos = np.concatenate(([0], np.cumsum(values > 0)))
+            scores = 2 * (npos[hi] - npos[lo]) - nsites
+
+        for i in range(len(granges)):
+            n = int(nsites[i])
+            if n >= self.minsites:
+                (g, grange) = granges[i]
+                if mode in ['avg', 'abs']:
+                    score = float(scores[i]) / n
+                elif mode == 'bal':
+                    score = int(scores[i])
+                else:
+                    score = float(scores[i])
+                datarow = [g.name, g.chrom, grange[0], grange[1], g.strand, n, score]
+                genesites = poslist[lo[i]:hi[i]]
+                if self.diffsorted:
+                    self.results.append(datarow + genesites)
+                else:
+                    out.write("\t".join([str(x) for x in datarow + genesites]) + "\n")
+                nwritten += 1
+        return nwritten
+
+    def _sweepSums(self, values, lo, nsites):
+        """Sum values[lo[i]:lo[i]+nsites[i]] for all i. Sites are added one column at a time across
+all genes, in the same order as writeChromGenes(), so results are bit-identical."""
+        sums = np.zeros(len(lo), dtype=np.float64)
+        order = np.argsort(-nsites, kind='mergesort')
+        ascending = nsites[order][::-1]
+        ngenes = len(lo)
+        for k in range(int(nsites.max()) if ngenes else 0):
+            active = order[:ngenes - np.searchsorted(ascending, k, side='right')]
+            sums[active] += values[lo[active] + k]
+        return sums
+
     def writeSortedGenes(self, out):
         self.results.sort(key=lambda x: x[6], reverse=True)
         for datarow in self.results:
@@ -384,6 +475,10 @@ Options:
   -s        | If specified, output will be sorted by differential methylation (high to
               low) instead of the default order (chromosome, gene position).
 
+  -f        | Use the sorted sweep engine: sites in each gene region are located by binary
+              search and scores are computed with numpy. Output is identical to the default
+              engine. Requires sites sorted by position within each chromosome.
+
   -c        | If specified, switch to 'classify' mode. All other options are ignored except
               for -o and -d. 
 
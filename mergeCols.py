@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import sys
+import heapq
 import os.path
 import gzip
 
@@ -10,8 +11,8 @@ import Script
 def usage():
     sys.stderr.write("""mergeCols.py - Merge columns from multiple files.
 
-Usage: mergeCols.py [-o outfile] [-id 1] [-dc 2] [-cuff] [-rsem] [-na NA] [-names a,b,c...] file1 file2 ...
-       mergeCols.py -a [-o outfile] [-id 1] [-i idsfile] colspecs file
+Usage: mergeCols.py [-o outfile] [-id 1] [-dc 2] [-cuff] [-rsem] [-na NA] [-names a,b,c...] [-s | -S] file1 file2 ...
+       mergeCols.py -a [-o outfile] [-id 1] [-i idsfile] [-s | -S] colspecs file
 
 Combine gene data from multiple input files into a matrix. The program assumes that 
 each input files has one column containing identifiers (e.g. gene identifiers) and 
@@ -35,10 +36,18 @@ Options:
              of input files without extension)
 -a         | enable averager mode.
 -i I       | only output rows whose IDs appear in file I.
+-s         | input files (and the -i file) are sorted by ID: merge them in a 
+             single streaming pass, using constant memory. IDs must be sorted
+             in byte order (e.g. with LC_ALL=C sort).
+-S         | like -s, but sort the input files first, using temporary files
+             on disk instead of memory.
+
+In -s and -S modes, output rows are sorted by ID.
 
 """)
 
-P = Script.Script("mergecols.py", version="1.0", usage=usage)
+P = Script.Script("mergecols.py", version="1.0", usage=usage,
+                  errors=[('UNSORTED', 'Input not sorted', "File `{}' is not sorted by ID (`{}' found after `{}'). Use -S to sort it.")])
 
 # Utils
 
@@ -69,6 +78,8 @@ class Opts():
     colspecs = None
     idsfile = None
     wanted = {}
+    streaming = False           # Inputs sorted by ID, use k-way merge (-s)
+    extsort = False             # Sort inputs on disk before merging (-S)
 
     def setNames(self):
         """Assign each missing element of the names field using the corresponding filename."""
@@ -115,6 +126,11 @@ class Opts():
             elif a == "-rsem":
                 self.id = 0
                 self.dc = 6
+            elif a == "-s":
+                self.streaming = True
+            elif a == "-S":
+                self.streaming = True
+                self.extsort = True
             else:
                 self.infiles.append(P.isFile(a))
         self.nfiles = len(self.infiles)
@@ -126,11 +142,14 @@ class Opts():
 
     def run(self):
         if self.avgmode:
+            mainAvg = self.mainAvgSorted if self.streaming else self.mainAvg
             if self.outfile:
                 with open(self.outfile, "w") as out:
-                    self.mainAvg(out)
+                    mainAvg(out)
             else:
-                self.mainAvg(sys.stdout)
+                mainAvg(sys.stdout)
+        elif self.streaming:
+            self.mainMerge()
         else:
             self.main()
 
@@ -161,6 +180,96 @@ class Opts():
                     out.write("\n")
         
 
+    def checkSorted(self, records, filename):
+        """Pass through the (id, ...) tuples in `records', exiting with an error if they are
+not sorted by id. If -S was specified, sort them on disk first."""
+        if self.extsort:
+            for r in Utils.externalSort(records, key=lambda r: r[0]):
+                yield r
+            return
+        prev = None
+        for r in records:
+            if prev is not None and r[0] < prev:
+                P.errmsg(P.UNSORTED, filename, r[0], prev)
+            prev = r[0]
+            yield r
+
+    def readRecords(self, infile, idx):
+        """Generator returning (id, idx, seq, value) tuples for the rows of `infile'."""
+        idcol = self.id
+        datacol = self.dc
+        seq = 0
+        with Utils.genOpen(infile, "r") as f:
+            f.readline()        # skip header
+            for line in f:
+                data = line.rstrip("\r\n").split("\t")
+                yield (data[idcol], idx, seq, data[datacol])
+                seq += 1
+
+    def readWantedSorted(self):
+        """Generator returning the IDs in idsfile (sorted, or sorted on disk with -S)."""
+        ids = ( (line.strip(),) for line in open(self.idsfile, "r") )
+        for r in self.checkSorted(ids, self.idsfile):
+            yield r[0]
+
+    def mainAvgSorted(self, out):
+        """Like mainAvg(), but the -i file is merge-joined with the input file instead
+of being loaded into memory. Both have to be sorted by ID (or sorted on disk with -S)."""
+        infile = self.infiles[0]
+        def rows():
+            with Utils.genOpen(infile, "r") as f:
+                f.readline()    # skip header
+                for line in f:
+                    data = line.split("\t")
+                    yield (data[self.id].strip('"'), data)
+        wanted = None
+        if self.idsfile:
+            wanted = self.readWantedSorted()
+            w = next(wanted, None)
+        for (gid, data) in self.checkSorted(rows(), infile):
+            if wanted is not None:
+                while w is not None and w < gid:
+                    w = next(wanted, None)
+                if w != gid:
+                    continue
+            outdata = [ getData(data, cs) for cs in self.colspecs ]
+            out.write(gid)
+            for d in outdata:
+                out.write("\t{}".format(d))
+            out.write("\n")
+
+    def mainMerge(self):
+        """Merge the input files with a k-way merge on the ID column. Each row is written
+as soon as all files have moved past its ID, so memory use does not depend on the 
+number of IDs."""
+        streams = [ self.checkSorted(self.readRecords(self.infiles[i], i), self.infiles[i]) for i in range(self.nfiles) ]
+        nwritten = 0
+        if self.outfile:
+            sys.stderr.write("Writing table to {}.\n".format(self.outfile))
+            out = open(self.outfile, "w")
+        else:
+            out = sys.stdout
+
+        try:
+            out.write("\t".join(["ID"] + self.names) + "\n")
+            current = None
+            vec = None
+            for (gid, idx, seq, gval) in heapq.merge(*streams):
+                if gid != current:
+                    if current is not None:
+                        out.write(current + "\t" + "\t".join(vec) + "\n")
+                        nwritten += 1
+                    current = gid
+                    vec = [self.na]*self.nfiles
+                vec[idx] = gval
+            if current is not None:
+                out.write(current + "\t" + "\t".join(vec) + "\n")
+                nwritten += 1
+        finally:
+            if self.outfile:
+                out.close()
+        sys.stderr.write("{} rows written.\n".format(nwritten))
+
     def main(self):
         table = {}
         idx = 0
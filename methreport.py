@@ -4,15 +4,17 @@
 ## DiBiG, ICBR Bioinformatics, University of Florida
 
 import sys
+import numpy as np
 from Bio import SeqIO
 import Script
+import Utils
 
 # Script object
 
 def usage():
     sys.stderr.write("""methreport.py - Report methylation rate at CG and GC positions.
 
-Usage: methreport.py [-gcg] infile [outfile]
+Usage: methreport.py [-gcg] [-f] [-m matrix] infile [outfile]
 
 `Infile' should be a multi-FASTA file in which the first sequence is assumed to
 be the reference. All other sequences should have the same length as the reference
@@ -26,7 +28,17 @@ in tab-delimited format with three columns: position, number of unconverted Cs,
 fraction of unconverted Cs (over total number of sequences examined).
 
 Options:
- -gcg | Do not exclude GCG positions from analysis.
+ -gcg               | Do not exclude GCG positions from analysis.
+ -f, --fast         | Use the fast engine (plain FASTA reader and numpy matrix).
+ -m, --matrix fname | Write the per-read x per-site methylation matrix to `fname'
+                      (implies -f). If `fname' ends in .npz the matrix is saved 
+                      in compressed numpy format, otherwise as a tab-delimited
+                      file with one row per read and one column per site.
+
+The matrix contains 1 if the read has an unconverted C at the site, 0 otherwise.
+Columns are in the same order as the report (CG sites followed by GC sites).
+The .npz file contains the arrays `matrix' (reads x sites), `positions', 
+`context' (CG or GC for each site), and `reads' (read names).
 
 """)
 
@@ -98,21 +110,102 @@ If `excludeGCG' is True, ignores GCG positions."""
                 result.append(i)
     return result
 
+def readFasta(filename):
+    """Lightweight FASTA parser. Yields (name, sequence) tuples, where name is the
+first word of the header line (like SeqIO's record id)."""
+    name = None
+    chunks = []
+    with Utils.genOpen(filename, "r") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line.startswith(">"):
+                if name is not None:
+                    yield (name, "".join(chunks))
+                name = line[1:].split(None, 1)[0] if len(line) > 1 else ""
+                chunks = []
+            elif name is not None:
+                chunks.append(line)
+    if name is not None:
+        yield (name, "".join(chunks))
+
+class MethMatrix():
+    """Per-read x per-site methylation state matrix. Entry [i, j] is 1 if
+read i has an unconverted C at site j, 0 otherwise."""
+    positions = None
+    context = []
+    names = []
+    matrix = None
+    nreads = 0
+
+    def __init__(self, rd):
+        self.positions = np.array(rd.CGpositions + rd.GCpositions, dtype=np.int64)
+        self.context = ["CG"]*rd.numCGs + ["GC"]*rd.numGCs
+        self.names = []
+        self.nreads = 0
+
+    def load(self, seqs):
+        """Fill the matrix from the (name, sequence) tuples in `seqs'."""
+        C = ord('C')
+        pos = self.positions
+        last = pos[-1] if len(pos) else -1
+        rows = []
+        for (name, seq) in seqs:
+            buf = np.frombuffer(seq, dtype=np.uint8)
+            if len(buf) > last:
+                rows.append(buf[pos] == C)
+            else:
+                # Read shorter than reference: missing sites count as converted
+                row = np.zeros(len(pos), dtype=np.bool_)
+                valid = pos < len(buf)
+                row[valid] = buf[pos[valid]] == C
+                rows.append(row)
+            self.names.append(name)
+        self.nreads = len(rows)
+        if rows:
+            self.matrix = np.array(rows, dtype=np.uint8)
+        else:
+            self.matrix = np.zeros((0, len(pos)), dtype=np.uint8)
+
+    def counts(self):
+        """Return the number of unconverted Cs at each site."""
+        return self.matrix.sum(axis=0)
+
+    def write(self, filename):
+        if filename.endswith(".npz"):
+            np.savez_compressed(filename, matrix=self.matrix, positions=self.positions,
+                                context=np.array(self.context), reads=np.array(self.names))
+        else:
+            with open(filename, "w") as out:
+                formatTabDelim(out, ["Read"] + [ "{}:{}".format(c, p) for (c, p) in zip(self.context, self.positions) ])
+                for i in range(self.nreads):
+                    out.write(self.names[i] + "\t" + "\t".join(map(str, self.matrix[i])) + "\n")
+
 def formatTabDelim(stream, l):
     stream.write("\t".join(l) + "\n")
 
 
 def main():
     global EXCLGCG
-    infile = None
+    infile = ""
     outfile = ""
+    fast = False
+    matfile = None
+    prev = ""
 
     # Parse arguments
     args = sys.argv[1:]
     P.standardOpts(args)
     for arg in args:
-        if arg == "-gcg":
+        if prev == "m":
+            matfile = arg
+            fast = True
+            prev = ""
+        elif arg == "-gcg":
             EXCLGCG = True
+        elif arg in ["-f", "--fast"]:
+            fast = True
+        elif arg in ["-m", "--matrix"]:
+            prev = "m"
         elif infile == "":
             infile = P.isFile(arg)
         else:
@@ -123,8 +216,12 @@ def main():
 
     nreads = 0
 
-    seqs = loadSequences(infile)
-    rd = refDesc(seqs.next())   # reference sequence
+    if fast:
+        seqs = readFasta(infile)
+        rd = refDesc(seqs.next()[1])
+    else:
+        seqs = loadSequences(infile)
+        rd = refDesc(seqs.next())   # reference sequence
 
     print("Reference sequence loaded from file `{}'.".format(infile))
     print("{}bp, {} CG positions, {} GC positions.".format(rd.length, rd.numCGs, rd.numGCs))
@@ -133,14 +230,26 @@ def main():
     GCarr = [ [p, 0] for p in rd.GCpositions ]
 
     print("Reading sequences...")
-    for s in seqs:
-        nreads += 1
-        for p in CGarr:
-            if s[p[0]] == 'C':
-                p[1] += 1
-        for p in GCarr:
-            if s[p[0]] == 'C':
-                p[1] += 1
+    if fast:
+        MM = MethMatrix(rd)
+        MM.load(seqs)
+        nreads = MM.nreads
+        counts = MM.counts()
+        for i in range(rd.numCGs):
+            CGarr[i][1] = int(counts[i])
+        for i in range(rd.numGCs):
+            GCarr[i][1] = int(counts[rd.numCGs + i])
+        if matfile:
+            MM.write(matfile)
+    else:
+        for s in seqs:
+            nreads += 1
+            for p in CGarr:
+                if s[p[0]] == 'C':
+                    p[1] += 1
+            for p in GCarr:
+                if s[p[0]] == 'C':
+                    p[1] += 1
                 
     if outfile:
         out = open(outfile, "w")
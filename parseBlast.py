@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 
 import sys
+import itertools
+import numpy as np
 import Script
 
 doc = """A simple script to parse BLAST output filtering hits for:
@@ -21,6 +23,10 @@ class BLASTlimits():
     evalue = None
     bitscore = None
 
+    def active(self):
+        """Return True if any limit is set."""
+        return bool(self.identity or self.alnlength or self.mismatches or self.evalue or self.bitscore)
+
     def checkRecord(self, record):
         """Return True if this blast record (a list) matches the limits in this object."""
         if self.identity:
@@ -40,18 +46,131 @@ class BLASTlimits():
                 return False
         return True
 
+    def checkChunk(self, fields, ncols):
+        """Vectorized version of checkRecord(). `fields' is the flat list of the fields of
+a block of records with `ncols' columns each. Returns a boolean array indicating which
+records match the limits in this object."""
+        mask = np.ones(len(fields) // ncols, dtype=np.bool_)
+        if self.identity:
+            mask &= (column(fields, ncols, 2) >= self.identity)
+        if self.alnlength:
+            mask &= (column(fields, ncols, 3) >= self.alnlength)
+        if self.mismatches:
+            mask &= (column(fields, ncols, 4) <= self.mismatches)
+        if self.evalue:
+            mask &= (column(fields, ncols, 10) <= self.evalue)
+        if self.bitscore:
+            mask &= (column(fields, ncols, 11) >= self.bitscore)
+        return mask
+
+def column(fields, ncols, idx):
+    """Return column `idx' of the records in the flat list `fields' as an array of floats."""
+    return np.fromstring(" ".join(fields[idx::ncols]), dtype=np.float64, sep=" ")
+
+def uniformColumns(text):
+    """Returns the number of columns of the lines in `text' (a block of lines without the final
+newline) if they all have the same number, otherwise 0. Delimiters are counted on each line,
+from the positions of tabs and newlines."""
+    codes = np.frombuffer(text + "\n", dtype=np.uint8)
+    ends = np.flatnonzero(codes == 10)
+    counts = np.diff(np.searchsorted(np.flatnonzero(codes == 9), ends), prepend=0)
+    if (counts != counts[0]).any():
+        return 0
+    return int(counts[0]) + 1
+
+def dropComments(text):
+    """Remove comment lines (starting with #) and empty lines from `text', a block of lines
+without the final newline. Comment lines are rare, so they are located with find() instead
+of splitting the whole block into lines."""
+    if text.startswith("#") or "\n#" in text:
+        text = "\n" + text     # Every line now follows a newline
+        parts = []
+        p = 0
+        while True:
+            c = text.find("\n#", p)
+            if c < 0:
+                parts.append(text[p:])
+                break
+            parts.append(text[p:c])
+            p = text.find("\n", c + 1)
+            if p < 0:
+                break
+        text = "".join(parts)
+    while "\n\n" in text:
+        text = text.replace("\n\n", "\n")
+    return text.strip("\n")
+
+OUTCOLS = [1, 8, 9, 2, 3, 10, 11, 0] # Columns written by formatHit(), in order
+
+def formatHit(parsed):
+    return "{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(parsed[1], parsed[8], parsed[9], parsed[2], parsed[3], parsed[10], parsed[11], parsed[0])
+
+class TopHits():
+    """Write only the best `n' hits (highest bit score) for each query. Relies on the hits for
+each query being consecutive, as they are in BLAST and DIAMOND tabular output, so only the
+hits for the current query are kept in memory."""
+    n = 1
+    out = None
+    query = None
+    hits = []
+    nout = 0
+
+    def __init__(self, n, out):
+        self.n = n
+        self.out = out
+        self.hits = []
+        self.nout = 0
+
+    def add(self, parsed):
+        if parsed[0] != self.query:
+            self.flush()
+            self.query = parsed[0]
+        self.hits.append((float(parsed[11]), parsed))
+
+    def flush(self):
+        if self.hits:
+            self.hits.sort(key=lambda h: h[0], reverse=True)
+            for h in self.hits[:self.n]:
+                self.out.write(formatHit(h[1]))
+                self.nout += 1
+            self.hits = []
+
 def usage():
-    sys.stderr.write("Coming soon\n")
+    sys.stderr.write("""parseBlast.py - Filter BLAST hits in tabular format (-outfmt 6).
+
+Usage: parseBlast.py [options] [files...]
+
+Reads standard input if no files are specified. Options:
+
+  -i I | Minimum % identity.
+  -l L | Minimum alignment length.
+  -m M | Maximum number of mismatches.
+  -e E | Maximum e-value.
+  -b B | Minimum bit score.
+  -n N | Only output the N hits with the highest bit score for each query.
+         Hits for the same query should be consecutive (as in BLAST output).
+  -o O | Write output to file O (default: standard output).
+  -r R | Write a report with the number of hits in and out to file R.
+  -f   | Fast mode: read input in chunks and filter them with numpy.
+  -c C | Size of input blocks in bytes in fast mode (implies -f, default: {}).
+         Accepts M and G suffixes.
+  --profile P | Write profiling statistics to P.prof and timings to P.json.
+
+""".format(ParseBlast.chunksize))
 
 class ParseBlast(Script.Script):
     limits = None
     infiles = []
     outfile = None
     reportfile = None
+    fast = False                # Use chunked, vectorized filtering (parseChunked)
+    chunksize = 65536           # Bytes per block in fast mode (small blocks keep the field lists in cache)
+    tophits = None              # If set, only output this many hits per query
 
     def parseArgs(self, args):
         if not args or "-h" in args or "--help" in args:
             return usage()
+        self.standardOpts(args)
         prev = ""
         self.limits = BLASTlimits()
         self.infiles = []
@@ -77,22 +196,99 @@ class ParseBlast(Script.Script):
             elif prev == "-r":
                 self.reportfile = a
                 prev = ""
-            elif a in ["-i", "-l", "-m", "-e", "-b", "-o", "-r"]:
+            elif prev == "-n":
+                self.tophits = self.toInt(a)
+                prev = ""
+            elif prev == "-c":
+                self.chunksize = self.toInt(a, units=True)
+                self.fast = True
+                prev = ""
+            elif a in ["-i", "-l", "-m", "-e", "-b", "-o", "-r", "-n", "-c"]:
                 prev = a
+            elif a == "-f":
+                self.fast = True
             else:
                 self.infiles.append(self.isFile(a))
 
     def parseOne(self, f, out):
+        if self.fast:
+            return self.parseChunked(f, out)
         nin = 0
         nout = 0
+        top = TopHits(self.tophits, out) if self.tophits else None
         for line in f:
             if line[0] == '#':
                 continue
             nin += 1
             parsed = line.rstrip("\r\n").split("\t")
             if self.limits.checkRecord(parsed):
-                out.write("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(parsed[1], parsed[8], parsed[9], parsed[2], parsed[3], parsed[10], parsed[11], parsed[0]))
-                nout += 1
+                if top:
+                    top.add(parsed)
+                else:
+                    out.write(formatHit(parsed))
+                    nout += 1
+        if top:
+            top.flush()
+            nout = top.nout
+        return (nin, nout)
+
+    def parseChunked(self, f, out):
+        """Like parseOne(), but reads the input in blocks of `chunksize' bytes. Each block
+is split into a flat list of fields with a single split() call and filtered with
+BLASTlimits.checkChunk(). Output lines are assembled from whole columns of the block
+(column slices of the field list), so no per-record Python code runs unless -n is used.
+Blocks with a variable number of columns are filtered one record at a time."""
+        nin = 0
+        nout = 0
+        top = TopHits(self.tophits, out) if self.tophits else None
+        filtering = self.limits.active()
+        rest = ""
+        while True:
+            data = f.read(self.chunksize)
+            if not data:
+                text = rest
+                rest = ""
+            else:
+                p = data.rfind("\n")
+                if p < 0:
+                    rest += data
+                    continue
+                text = rest + data[:p]
+                rest = data[p+1:]
+            if "\r" in text:
+                text = text.replace("\r", "")
+            text = dropComments(text)
+            nrecs = text.count("\n") + 1 if text else 0
+            if nrecs > 0:
+                nin += nrecs
+                ncols = uniformColumns(text)
+                if ncols > max(OUTCOLS):
+                    fields = text.replace("\n", "\t").split("\t")
+                    good = self.limits.checkChunk(fields, ncols) if filtering else None
+                    if top:
+                        starts = (np.flatnonzero(good) * ncols).tolist() if filtering else range(0, len(fields), ncols)
+                        for i in starts:
+                            top.add(fields[i:i+ncols])
+                    else:
+                        rows = zip(*[ fields[c::ncols] for c in OUTCOLS ])
+                        if filtering:
+                            rows = list(itertools.compress(rows, good.tolist()))
+                        if rows:
+                            out.write("\n".join(map("\t".join, rows)) + "\n")
+                        nout += len(rows)
+                else:
+                    records = [ parsed for parsed in [ line.split("\t") for line in text.split("\n") ] if self.limits.checkRecord(parsed) ]
+                    if top:
+                        for parsed in records:
+                            top.add(parsed)
+                    else:
+                        out.write("".join([ formatHit(parsed) for parsed in records ]))
+                        nout += len(records)
+            if not data:
+                break
+        if top:
+            top.flush()
+            nout = top.nout
         return (nin, nout)
 
     def run(self):
@@ -110,8 +306,10 @@ class ParseBlast(Script.Script):
         try:
             if self.infiles:
                 for filename in self.infiles:
-                    with open(filename, "r") as f:
+                    with open(filename, "r") as f, self.phase(filename):
                         (nin, nout) = self.parseOne(f, out)
+                        self.count("hits_in", nin)
+                        self.count("hits_out", nout)
                         totin += nin
                         totout += nout
                         if rep:
@@ -119,7 +317,10 @@ class ParseBlast(Script.Script):
                 if rep:
                     rep.write("Total\t{}\t{}\t{:.2f}%\n".format(totin, totout, 100.0 * totout / totin))
             else:
-                (nin, nout) = self.parseOne(sys.stdin, out)
+                with self.phase("(stdin)"):
+                    (nin, nout) = self.parseOne(sys.stdin, out)
+                    self.count("hits_in", nin)
+                    self.count("hits_out", nout)
                 if rep:
                     rep.write("(stdin)\t{}\t{}\t{:.2f}%\n".format(nin, nout, 100.0 * nout / nin))
         finally:
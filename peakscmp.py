@@ -3,6 +3,7 @@
 import sys
 import csv
 import math
+import bisect
 
 import Script
 
@@ -50,10 +51,12 @@ class macsDiff(Script.Script):
     ntags2 = 0
     factor = None
     regions = {}
+    indexes = {}
     minOverlap = 0.5
 
     def init(self):
         self.regions   = {}
+        self.indexes   = {}
 
     def parseArgs(self, args):
         next = ""
@@ -107,8 +110,38 @@ class macsDiff(Script.Script):
             self.ntags1 = self.readHeader(f)
             nregs = self.readRegions(f)
         sys.stderr.write("Tags 1: {}\n".format(self.ntags1))
+        self.buildIndexes()
         return nregs
 
+    def buildIndexes(self):
+        """For each chromosome whose regions are sorted by start position, store the list of
+starts and the running maximum of the ends, used by findRegionIndexed(). Chromosomes with
+unsorted regions are not indexed, and fall back to findRegion()."""
+        self.indexes = {}
+        for (chrom, regs) in self.regions.items():
+            starts = [ r[0] for r in regs ]
+            if any(starts[i] > starts[i+1] for i in range(len(starts)-1)):
+                continue
+            maxends = []
+            m = None
+            for r in regs:
+                if m is None or r[1] > m:
+                    m = r[1]
+                maxends.append(m)
+            self.indexes[chrom] = (starts, maxends)
+
+    def findRegionIndexed(self, regions, index, start, end):
+        """Same result as findRegion(), using binary search. The regions that findRegion() examines
+are the ones starting at or before `end'; among those, the first one that overlaps is the
+first one whose end is at least `start', ie the first position where the running maximum 
+of the ends reaches `start'."""
+        (starts, maxends) = index
+        hi = bisect.bisect_right(starts, end)
+        i = bisect.bisect_left(maxends, start, 0, hi)
+        if i < hi:
+            return regions[i]
+        return None
+
     def findRegion(self, regions, start, end):
         for r in regions:
             if r[0] > end:
@@ -127,6 +160,7 @@ class macsDiff(Script.Script):
     def readSecond(self, out):
         curr = ""
         currRegs = []
+        currIndex = None
 
         out.write("#Chrom\tStart1\tEnd1\tPileup1\tStart2\tEnd2\tPileup2\tlog2(FC)\n")
         with open(self.filename2, "r") as f:
@@ -147,14 +181,18 @@ class macsDiff(Script.Script):
                 chrom = fields[0]
                 if chrom != curr:
                     curr  = chrom
-                    currRegs = self.regions[chrom]
+                    currRegs = self.regions.get(chrom, [])
+                    currIndex = self.indexes.get(chrom)
                     if noutc > 0:
                         sys.stderr.write("{}: {}/{} common peaks.\n".format(chrom, noutc, ninc))
                     ninc = 0
                     noutc = 0
                 start = int(fields[1])
                 end   = int(fields[2])
-                reg = self.findRegion(currRegs, start, end)
+                if currIndex:
+                    reg = self.findRegionIndexed(currRegs, currIndex, start, end)
+                else:
+                    reg = self.findRegion(currRegs, start, end)
                 if reg:
                     ov = self.overlap(reg, start, end)
                     if ov > self.minOverlap:
@@ -21,6 +21,8 @@ import csv
 import math
 import ercc
 import os.path
+import multiprocessing
+import numpy as np
 import Utils
 import Script
 
@@ -42,6 +44,12 @@ rsem-generate-data-matrix, but handles ERCC-based normalization as well. Options
  -u             | Invert the meaning of -F: output only the high-variability genes.
  -n X,Y,Z,...   | Specifies the number of samples for each condition. Eg:
                   -n 2,3 = samples 1-2 from condition A, samples 3-5 from condition B.
+ -k             | Keyed mode: align rows by gene ID instead of requiring all 
+                  files to have the same row order. Genes missing from a file
+                  get a value of 0 in that file's column. In this mode ERCC
+                  normalization and filtering are performed on numpy matrices
+                  (results may differ from the default mode by rounding error).
+ -p P           | Parse input files using P parallel processes (implies -k).
 
 """.format(progname))
 
@@ -104,6 +112,60 @@ def linreg(xs, ys):
     intcp = ybar - (xbar * slope)
     return (slope, intcp)
 
+def isERCC(fields):
+    """Return the ERCC name if the row in `fields' is an ERCC control, False otherwise."""
+    if fields[0].startswith("ERCC-"):
+        return fields[0]
+    elif fields[1].startswith("ERCC-"):
+        return fields[1]
+    else:
+        return False
+
+def readResultsFile(args):
+    """Read the values in column `column' of RSEM results file `filename' (passed as a tuple, 
+to allow calling this through multiprocessing.Pool.map). Returns a tuple (ids, values, 
+erccids, erccvalues), where ids and erccids are lists and values and erccvalues are arrays."""
+    (filename, column, colidx) = args
+    ids = []
+    values = []
+    erccids = []
+    erccvalues = []
+    with open(filename, "r") as f:
+        hdr = Utils.parseLine(f.readline())
+        if column in hdr:
+            colidx = hdr.index(column)
+        for line in f:
+            fields = Utils.parseLine(line)
+            E = isERCC(fields)
+            if E:
+                erccids.append(E)
+                erccvalues.append(float(fields[colidx]))
+            else:
+                ids.append(fields[0])
+                values.append(float(fields[colidx]))
+    return (ids, np.array(values, dtype=np.float64), erccids, np.array(erccvalues, dtype=np.float64))
+
+def keyedMatrix(results, which):
+    """Assemble a matrix from the list of tuples returned by readResultsFile(), using
+elements `which' (ids) and `which'+1 (values) of each tuple. Rows are aligned by ID;
+IDs appear in the order in which they are first seen. Returns (ids, matrix, missing),
+where `missing' is the number of IDs absent from each file."""
+    index = {}
+    ids = []
+    for res in results:
+        for gid in res[which]:
+            if gid not in index:
+                index[gid] = len(ids)
+                ids.append(gid)
+    matrix = np.zeros((len(ids), len(results)), dtype=np.float64)
+    missing = []
+    for col in range(len(results)):
+        fids = results[col][which]
+        rowidx = np.fromiter((index[gid] for gid in fids), dtype=np.int64, count=len(fids))
+        matrix[rowidx, col] = results[col][which+1]
+        missing.append(len(ids) - len(set(fids)))
+    return (ids, matrix, missing)
+
 # Main class
 
 class MatrixGenerator():
@@ -124,6 +186,12 @@ class MatrixGenerator():
     minval = False
     condsmpls = []
     filtover = True             # Filter genes over maxfc threshold?
+    keyed = False               # Align rows by ID (loadFilesKeyed)
+    nprocs = 1                  # Number of processes used to parse input files in keyed mode
+    ids = []                    # In keyed mode, gene IDs and values are stored in numpy
+    matrix = None               # matrices (one column per input file) instead of rows,
+    erccids = []                # and normalization and filtering are done with the
+    erccmatrix = None           # *Matrix methods.
 
     def __init__(self):
         self.rows = []
@@ -163,10 +231,16 @@ class MatrixGenerator():
             elif next == '-m':
                 self.minval = float(a)
                 next = ""
-            elif a in ['-ercc', '-mix', '-c', '-n', '-f', '-m']:
+            elif next == '-p':
+                self.nprocs = S.toInt(a)
+                self.keyed = True
+                next = ""
+            elif a in ['-ercc', '-mix', '-c', '-n', '-f', '-m', '-p']:
                 next = a
             elif a == "-u":
                 self.filtover = False
+            elif a == "-k":
+                self.keyed = True
             else:
                 files.append(S.isFile(a))
         if files == []:
@@ -211,12 +285,7 @@ specified, in which case it gets loaded from that file."""
             self.ERCCdb.init(ERCCfile)
 
     def isERCC(self, fields):
-        if fields[0].startswith("ERCC-"):
-            return fields[0]
-        elif fields[1].startswith("ERCC-"):
-            return fields[1]
-        else:
-            return False
+        return isERCC(fields)
 
     def loadFiles(self):
         """Load the contents of the files listed in the infiles slot into this object. Values
@@ -263,6 +332,39 @@ for genes/transcripts and ERCC controls are stored separately."""
                     row[idx] = float(fields[self.colidx])
             idx += 1
 
+    def loadFilesKeyed(self):
+        """Like loadFiles(), but rows are aligned by ID, so input files may list genes in 
+any order. Genes and ERCC controls missing from a file are set to 0 in that file's column.
+Files are parsed by `nprocs' worker processes."""
+        args = [ (infile, self.column, self.colidx) for infile in self.infiles ]
+        if self.nprocs > 1:
+            ew("Reading {} files using {} processes...\n", self.ncols, self.nprocs)
+            pool = multiprocessing.Pool(self.nprocs)
+            try:
+                results = pool.map(readResultsFile, args)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = []
+            for a in args:
+                ew("Reading file {}...\n", a[0])
+                results.append(readResultsFile(a))
+
+        (ids, matrix, missing) = keyedMatrix(results, 0)
+        (eids, ematrix, emissing) = keyedMatrix(results, 2)
+        for i in range(self.ncols):
+            if missing[i]:
+                ew("Warning: {} genes missing from file {}.\n", missing[i], self.infiles[i])
+            if emissing[i] and eids:
+                ew("Warning: {} ERCC controls missing from file {}.\n", emissing[i], self.infiles[i])
+        self.ids = ids
+        self.matrix = matrix
+        self.nrows = len(ids)
+        self.erccids = eids
+        self.erccmatrix = ematrix
+        self.nercc = len(eids)
+
     def rowMaxFC(self, row):
         """Determine the highest log2(FC) between samples of the same condition."""
         maxfc = 0
@@ -308,7 +410,7 @@ for genes/transcripts and ERCC controls are stored separately."""
             if self.maxfc:
                 over = (self.rowMaxFC(r) > self.maxfc)
                 if over == self.filtover:
-                    nfiltered += 1
+                    nfiltered2 += 1
                     continue
             sys.stdout.write('"' + r[0] + '"\t' + "\t".join([str(x) for x in r[1:]]) + "\n")
         if nfiltered1 > 0:
@@ -386,11 +488,128 @@ Also handles different concentrations due to the use of different mixes."""
             if r[1] != 0 and r[idx] != 0:
                 r[idx] = max(0.0, (r[idx] - intercept) / slope) # RSEM doesn't like negative counts... ;)
 
+    def ERCCfactors(self):
+        """Return a matrix with one row for each ERCC control in erccmatrix and one column
+for each input file, containing the factor that makes the concentration of that control
+in the file's mix equivalent to the one in the mix of the first file."""
+        fcs = []
+        for name in self.erccids:
+            e = self.ERCCdb.find(name)
+            fcs.append(e.fc if e else 1.0)
+        fcs = np.array(fcs, dtype=np.float64)
+        factors = np.ones((self.nercc, self.ncols), dtype=np.float64)
+        for i in range(1, self.ncols):
+            if self.mixes[0] != self.mixes[i]:
+                if self.mixes[0] == '1':
+                    factors[:,i] = fcs
+                else:
+                    factors[:,i] = 1.0 / fcs
+        return factors
+
+    def ERCCregressionMatrix(self):
+        """Compute the linear regressions between the first column and all other columns of 
+erccmatrix in one pass. Rows in which either value is 0 are ignored. Returns (slopes, intercepts,
+good) arrays with one element for each column after the first; `good' is False for columns
+with too few ERCC controls to normalize."""
+        E = self.erccmatrix
+        x = E[:,0:1]
+        y = E[:,1:] * self.ERCCfactors()[:,1:]
+        mask = (x != 0) & (E[:,1:] != 0)
+        n = mask.sum(axis=0)
+        good = (n > 5)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xbar = np.where(mask, x, 0.0).sum(axis=0) / n
+            ybar = np.where(mask, y, 0.0).sum(axis=0) / n
+            dx = np.where(mask, x - xbar, 0.0)
+            dy = np.where(mask, y - ybar, 0.0)
+            Lxx = (dx * dx).sum(axis=0)
+            Lxy = (dx * dy).sum(axis=0)
+            slopes = Lxy / Lxx
+            intcps = ybar - (xbar * slopes)
+        return (slopes, intcps, good)
+
+    def ERCCnormalizeMatrix(self):
+        ew("Performing ERCC normalization. Mixes:\n")
+        for i in range(self.ncols):
+            ew("  {}: mix{}\n", self.infiles[i], self.mixes[i])
+        if self.nercc == 0:
+            ew("No ERCC controls found, unable to normalize.\n")
+            return
+        (slopes, intcps, good) = self.ERCCregressionMatrix()
+        for i in range(len(slopes)):
+            ew("Normalizing column {}:\n", i+2)
+            if good[i]:
+                ew("  ERCC regression: {} {}\n", slopes[i], intcps[i])
+            else:
+                ew("No ERCC controls found, unable to normalize.\n")
+        self.lnormMatrix(self.matrix, slopes, intcps, good)
+
+    def lnormMatrix(self, matrix, slopes, intercepts, good):
+        """Vectorized version of lnorm(), applied to all columns of `matrix' after the first at once.
+Columns for which `good' is False are left unchanged."""
+        M = matrix[:,1:]
+        mask = (matrix[:,0:1] != 0) & (M != 0) & good
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normed = np.maximum(0.0, (M - intercepts) / slopes)
+        matrix[:,1:] = np.where(mask, normed, M)
+
+    def matrixMaxFC(self):
+        """Vectorized version of rowMaxFC(): return the highest log2(FC) between samples of the 
+same condition for all rows of the matrix."""
+        maxfc = np.zeros(self.nrows, dtype=np.float64)
+        for idxs in self.condsmpls:
+            cols = self.matrix[:, [ i-1 for i in idxs ]]
+            vmin = cols.min(axis=1)
+            vmax = cols.max(axis=1)
+            pos = vmin > 0
+            fc = np.zeros(self.nrows, dtype=np.float64)
+            fc[pos] = np.log2(vmax[pos] / vmin[pos])
+            maxfc = np.maximum(maxfc, fc)
+        return maxfc
+
+    def matrixMinAvg(self):
+        """Vectorized version of rowMinAvg(): return the smallest average between samples of the 
+same condition for all rows of the matrix."""
+        minavg = np.full(self.nrows, 100000000.0)
+        for idxs in self.condsmpls:
+            minavg = np.minimum(minavg, self.matrix[:, [ i-1 for i in idxs ]].mean(axis=1))
+        return minavg
+
+    def writeMatrix(self):
+        """Write the full (normalized) data matrix to stdout, applying the min average and
+max FC filters to all rows at once."""
+        keep = np.ones(self.nrows, dtype=np.bool_)
+        nfiltered1 = 0
+        nfiltered2 = 0
+        if self.minval:
+            keep &= ~(self.matrixMinAvg() < self.minval)
+            nfiltered1 = self.nrows - keep.sum()
+        if self.maxfc:
+            over = (self.matrixMaxFC() > self.maxfc)
+            filt = keep & (over == self.filtover)
+            nfiltered2 = filt.sum()
+            keep &= ~filt
+
+        sys.stdout.write("\t" + "\t".join([ '"' + f + '"' for f in self.infiles]) + "\n")
+        values = self.matrix.tolist()
+        for i in np.flatnonzero(keep):
+            sys.stdout.write('"' + self.ids[i] + '"\t' + "\t".join([str(x) for x in values[i]]) + "\n")
+        if nfiltered1 > 0:
+            ew("{} genes filtered because value < {}.\n", nfiltered1, self.minval)
+        if nfiltered2 > 0:
+            ew("{} genes filtered because variability > {}.\n", nfiltered2, self.maxfc)
+
     def run(self):
-        self.loadFiles()
-        if self.doERCC:
-            self.ERCCnormalize()
-        self.writeDataMatrix()
+        if self.keyed:
+            self.loadFilesKeyed()
+            if self.doERCC:
+                self.ERCCnormalizeMatrix()
+            self.writeMatrix()
+        else:
+            self.loadFiles()
+            if self.doERCC:
+                self.ERCCnormalize()
+            self.writeDataMatrix()
 
 class DiffMerger():
     """Files are either .gdiff.csv or .idiff.csv"""
@@ -3,6 +3,8 @@
 import sys
 import csv
 import math
+import itertools
+import numpy as np
 
 def parseSlice(s):
     if "-" in s:
@@ -12,6 +14,28 @@ def parseSlice(s):
         p = int(s)
         return slice(p-1, p)
 
+def toFloats(rows):
+    """Convert `rows' (lists of strings, all of the same length) to a numpy matrix. Rows
+containing values that are not numbers (e.g. NA) are set to NaN."""
+    try:
+        return np.array(rows, dtype=np.float64)
+    except ValueError:
+        m = np.empty((len(rows), len(rows[0])))
+        for i, row in enumerate(rows):
+            try:
+                m[i] = [ float(v) for v in row ]
+            except ValueError:
+                m[i] = np.nan
+        return m
+
+def rowSums(m):
+    """Returns the sums of the rows of matrix `m', adding one column at a time so
+that the results are the same as with sum()."""
+    s = np.zeros(m.shape[0])
+    for j in range(m.shape[1]):
+        s += m[:, j]
+    return s
+
 class SimpleDiff():
     filename = None
     outfile = "/dev/stdout"
@@ -22,7 +46,53 @@ class SimpleDiff():
     slice1 = None
     slice2 = None
 
+    fast = False                # Use the chunked, vectorized engine
+    blocksize = 10000           # Rows per block in fast mode
+    minfc = None                # If set, minimum absolute log2(fold change)
+    minavg = None               # If set, minimum value for the higher of the two averages
+    nskipped = 0                # Rows skipped because of missing or non-numeric values
+
+    def writeRow(self, out, name, avg1, avg2):
+        """Write an output row for gene `name' if it passes the fold change filter.
+Returns True if the row was written."""
+        lfc = math.log(avg1/avg2, 2.0)
+        if self.minfc is not None and abs(lfc) < self.minfc:
+            return False
+        out.write("{}\t{}\t{}\t{}\n".format(name, avg1, avg2, lfc))
+        return True
+
+    def testRow(self, data1, data2, na, nb):
+        """Perform the separation test on the values `data1' and `data2' (lists of floats) for
+a single gene. Returns the tuple (avg1, avg2) if the gene passes, None otherwise."""
+        amin = min(data1)
+        amax = max(data1)
+        bmin = min(data2)
+        bmax = max(data2)
+        if amin > bmax:
+            # A over B
+            r1 = amax - amin
+            r2 = bmax - bmin
+            d = self.alpha * max(r1, r2)
+            if (amin - bmax) <= d:
+                return None
+        elif bmin > amax:
+            # B over A
+            r1 = amax - amin
+            r2 = bmax - bmin
+            d = self.alpha * max(r1, r2)
+            if (bmin - amax) <= d:
+                return None
+        else:
+            return None
+        avg1 = sum(data1) / na
+        avg2 = sum(data2) / nb
+        if avg1 > 0 and avg2 > 0 and (self.minavg is None or max(avg1, avg2) >= self.minavg):
+            return (avg1, avg2)
+        return None
+
     def process(self, f, out, header=True):
+        if self.fast:
+            return self.processChunked(f, out, header=header)
         nin = 0
         nout = 0
         na = self.slice1.stop - self.slice1.start
@@ -32,36 +102,78 @@ class SimpleDiff():
         c = csv.reader(f, delimiter='\t')
         for line in c:
             nin += 1
-            data1 = line[self.slice1]
-            data2 = line[self.slice2]
-            data1 = [ float(v) for v in data1 ]
-            data2 = [ float(v) for v in data2 ]
-            amin = min(data1)
-            amax = max(data1)
-            bmin = min(data2)
-            bmax = max(data2)
-            if amin > bmax:
-                # A over B
-                r1 = amax - amin
-                r2 = bmax - bmin
-                d = self.alpha * max(r1, r2)
-                if (amin - bmax) > d:
-                    avg1 = sum(data1) / na
-                    avg2 = sum(data2) / nb
-                    if avg1 > 0 and avg2 > 0:
-                        out.write("{}\t{}\t{}\t{}\n".format(line[0], avg1, avg2, math.log(avg1/avg2, 2.0)))
-                        nout += 1
-            elif bmin > amax:
-                # B over A
-                r1 = amax - amin
-                r2 = bmax - bmin
-                d = self.alpha * max(r1, r2)
-                if (bmin - amax) > d:
-                    avg1 = sum(data1) / na
-                    avg2 = sum(data2) / nb
-                    if avg1 > 0 and avg2 > 0:
-                        out.write("{}\t{}\t{}\t{}\n".format(line[0], avg1, avg2, math.log(avg1/avg2, 2.0)))
-                        nout += 1
+            try:
+                data1 = [ float(v) for v in line[self.slice1] ]
+                data2 = [ float(v) for v in line[self.slice2] ]
+            except ValueError:
+                self.nskipped += 1
+                continue
+            if not data1 or not data2:
+                self.nskipped += 1
+                continue
+            avgs = self.testRow(data1, data2, na, nb)
+            if avgs and self.writeRow(out, line[0], *avgs):
+                nout += 1
+        return (nin, nout)
+
+    def processChunked(self, f, out, header=True):
+        """Like process(), but reads the input in blocks of `blocksize' rows and performs
+the separation test on all rows of a block at once. Rows that are too short for the
+two slices are tested one at a time with testRow(), and skipped if one of the slices
+is empty."""
+        nin = 0
+        nout = 0
+        na = self.slice1.stop - self.slice1.start
+        nb = self.slice2.stop - self.slice2.start
+        if header:
+            f.readline()
+        c = csv.reader(f, delimiter='\t')
+        while True:
+            block = list(itertools.islice(c, self.blocksize))
+            if not block:
+                break
+            nin += len(block)
+            data1 = [ line[self.slice1] for line in block ]
+            data2 = [ line[self.slice2] for line in block ]
+            short = {}
+            nshort = 0
+            for i in range(len(block)):
+                if len(data1[i]) != na or len(data2[i]) != nb:
+                    nshort += 1
+                    try:
+                        d1 = [ float(v) for v in data1[i] ]
+                        d2 = [ float(v) for v in data2[i] ]
+                    except ValueError:
+                        d1 = d2 = None
+                    if d1 and d2:
+                        avgs = self.testRow(d1, d2, na, nb)
+                        if avgs:
+                            short[i] = avgs
+                    else:
+                        self.nskipped += 1
+                    data1[i] = ["nan"] * na
+                    data2[i] = ["nan"] * nb
+            A = toFloats(data1)
+            B = toFloats(data2)
+            bad = np.isnan(A).any(axis=1) | np.isnan(B).any(axis=1)
+            self.nskipped += int(bad.sum()) - nshort
+            amin = A.min(axis=1)
+            amax = A.max(axis=1)
+            bmin = B.min(axis=1)
+            bmax = B.max(axis=1)
+            d = self.alpha * np.maximum(amax - amin, bmax - bmin)
+            with np.errstate(invalid='ignore'):
+                good = ((amin > bmax) & ((amin - bmax) > d)) | ((bmin > amax) & ((bmin - amax) > d))
+                avg1 = rowSums(A) / na
+                avg2 = rowSums(B) / nb
+                good &= (avg1 > 0) & (avg2 > 0) & ~bad
+                if self.minavg is not None:
+                    good &= (np.maximum(avg1, avg2) >= self.minavg)
+            for i in np.flatnonzero(good).tolist():
+                short[i] = (float(avg1[i]), float(avg2[i]))
+            for i in sorted(short):
+                if self.writeRow(out, block[i][0], *short[i]):
+                    nout += 1
         return (nin, nout)
 
     def parseArgs(self, args):
@@ -84,8 +196,20 @@ class SimpleDiff():
             elif prev == "-c2":
                 self.colname2 = a
                 prev = ""
-            elif a in ["-a", "-o", "-l", "-c1", "-c2"]:
+            elif prev == "-fc":
+                self.minfc = float(a)
+                prev = ""
+            elif prev == "-m":
+                self.minavg = float(a)
+                prev = ""
+            elif prev == "-b":
+                self.blocksize = int(a)
+                self.fast = True
+                prev = ""
+            elif a in ["-a", "-o", "-l", "-c1", "-c2", "-fc", "-m", "-b"]:
                 prev = a
+            elif a == "-f":
+                self.fast = True
             elif self.filename is None:
                 self.filename = a
             elif self.slice1 is None:
@@ -113,6 +237,13 @@ Options:
   -o O  | Write output to file O.
   -c1 C | Set label for average of condition 1 values to C. Default: {}.
   -c1 C | Set label for average of condition 2 values to C. Default: {}.
+  -fc F | Only report genes with an absolute log2(fold change) of at least F.
+  -m M  | Only report genes in which the higher of the two averages is at least M.
+  -f    | Fast mode: read the input in blocks and test all genes in a block at once.
+  -b B  | Number of rows per block in fast mode (implies -f). Default: {}.
+
+Rows containing values that are not numbers (e.g. NA), or no values for one of the
+two conditions, are skipped.
 
 A gene is considered to be differentially expressed between two groups of samples (A and B)
 if the two following conditions hold:
@@ -135,7 +266,7 @@ The two sets are separated, because min(B) > max(A). The distance between the tw
 gene would NOT be considered significantly different, because the largest range is 6, 
 and 6 * alpha > 4. If alpha was set to 0.5, the gene would be called as different.
 
-""".format(self.alpha, self.colname1, self.colname2))
+""".format(self.alpha, self.colname1, self.colname2, self.blocksize))
 
 
     def run(self):
@@ -143,6 +274,8 @@ and 6 * alpha > 4. If alpha was set to 0.5, the gene would be called as differen
             with open(self.filename, "r") as f:
                 (nin, nout) = self.process(f, out)
                 sys.stderr.write("{} in, {} out\n".format(nin, nout))
+                if self.nskipped:
+                    sys.stderr.write("{} rows skipped because of missing or non-numeric values\n".format(self.nskipped))
 
 if __name__ == "__main__":
     SD = SimpleDiff()
@@ -2,6 +2,8 @@
 
 import sys
 import math
+import operator
+import numpy as np
 
 import Utils
 import Script
@@ -19,6 +21,9 @@ Options:
   -s S | Use method S to compute row score. Possible values are: 'A' (average),
          'a' (average, missing values ignored), 'S' (sum), 's' (sum, missing
          values ignored), 'm' (min), 'M' (max). Default: {}.
+  -f   | Fast mode: load all values into a numpy matrix and compute scores
+         for all rows at once.
+  -t K | Only output the top K rows (implies -f).
 
 A column specification C has the form C1,C2,...,Cn where each C can be either a 
 number (1-based column number), X-Y (from column X to column Y inclusive), X+K 
@@ -46,6 +51,9 @@ Options:
   -i I | Row identifiers are in column I (default: 1).
   -k K | Read row order from file K (default: stdin). This file should be in the
          format produced by the `rank' command.
+  -f   | Fast mode: load all values into numpy matrices and compute distances
+         for all rows at once.
+  -t K | Only output the top K rows (implies -f).
 
 """)
     else:
@@ -127,6 +135,82 @@ SCOREFUNCS = {'A': score_A,
               'M': score_M,
               'e': score_e}
 
+### Vectorized engine (-f)
+
+def readMatrix(rows, columns):
+    """Returns a numpy matrix containing the elements of each row in `rows' indexed by `columns'
+converted to floats (all elements if `columns' is None). Invalid entries are NaN."""
+    if not rows:
+        return np.zeros((0, len(columns) if columns else 0))
+    if columns:
+        get = operator.itemgetter(*columns)
+        data = [ get(row) for row in rows ] if len(columns) > 1 else [ (get(row),) for row in rows ]
+    else:
+        data = rows
+    try:
+        return np.array(data, dtype=np.float64)
+    except ValueError:
+        return np.array([ Utils.colsToFloat(row, columns) for row in rows ], dtype=np.float64)
+
+def rowSums(m):
+    """Returns the sums of the rows of matrix `m'. Columns are added one at a time, so
+each sum is accumulated in the same order (and has the same value) as with sum()."""
+    s = np.zeros(m.shape[0])
+    for j in range(m.shape[1]):
+        s += m[:, j]
+    return s
+
+def matrixScores(score, m):
+    """Vectorized version of the functions in SCOREFUNCS: returns the scores of all
+rows of matrix `m' using method `score'."""
+    missing = np.isnan(m)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if score in 'AaSs':
+            s = rowSums(np.where(missing, 0.0, m))
+            if score == 'A':
+                return s / m.shape[1]
+            elif score == 'a':
+                return s / (m.shape[1] - missing.sum(axis=1))
+            return s
+        elif score == 'm':
+            return np.where(missing | (m == 0), sys.float_info.max, m).min(axis=1)
+        elif score == 'M':
+            return np.where(missing | (m == 0), -sys.float_info.max, m).max(axis=1)
+        elif score == 'e':
+            cols = range(m.shape[1])[1:]
+            n = len(cols)
+            n2 = n / 2
+            a = rowSums(m[:, cols[:10]]) + rowSums(m[:, cols[-10:]])
+            b = rowSums(m[:, cols[n2-25:n2+25]])
+            a[a == 0.0] = 0.0001
+            return b / a
+
+def matrixDistance(m1, m2):
+    """Vectorized version of Utils.distance() on the rows of `m1' and `m2'."""
+    d = m1 - m2
+    d = np.where(np.isnan(d), 0.0, d)
+    return np.sqrt(rowSums(d * d))
+
+def matrixAvgdiff(m1, m2):
+    """Vectorized version of Utils.avgdiff() on the rows of `m1' and `m2'."""
+    d = m1 - m2
+    missing = np.isnan(d)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return rowSums(np.where(missing, 0.0, d)) / (d.shape[1] - missing.sum(axis=1))
+
+def rankOrder(scores, reverse=True, top=None):
+    """Returns the indexes of `scores' in sorted order (highest first if `reverse' is
+True). Ties keep their original order, as with list.sort(). If `top' is specified,
+only the first `top' indexes are returned, and a partial sort is used to find them."""
+    keys = -scores if reverse else scores
+    if top and top < len(keys):
+        part = np.argpartition(keys, top-1)[:top]
+        cand = np.flatnonzero(keys <= keys[part].max())
+        if len(cand) < top:          # NaNs among the top rows
+            cand = np.union1d(cand, part)
+        return cand[np.argsort(keys[cand], kind='mergesort')][:top]
+    return np.argsort(keys, kind='mergesort')
+
 ### Main class
 
 class Sorter(Script.Script):
@@ -141,6 +225,8 @@ class Sorter(Script.Script):
     scorecols = None
     distance = None
     reverse = True
+    fast = False                # Use the numpy engine
+    top = None                  # If set, only output this many rows
 
     def parseArgs(self, args):
         self.standardOpts(args)
@@ -169,10 +255,16 @@ class Sorter(Script.Script):
             elif next == '-d':
                 self.distance = self.toFloat(a)
                 next = ""
-            elif a in ['-o', '-i', '-c', '-s', '-k', '-d']:
+            elif next == '-t':
+                self.top = self.toInt(a)
+                self.fast = True
+                next = ""
+            elif a in ['-o', '-i', '-c', '-s', '-k', '-d', '-t']:
                 next = a
             elif a == '-r':
                 self.reverse = False
+            elif a == '-f':
+                self.fast = True
             elif self.infile == None:
                 self.infile = self.isFile(a)
             else:
@@ -190,11 +282,55 @@ class Sorter(Script.Script):
         elif self.mode == 'order':
             self.doOrder()
         elif self.mode == 'distance':
-            self.doDistance()
+            if self.fast:
+                self.doDistanceFast()
+            else:
+                self.doDistance()
         elif self.mode == 'avgdiff':
-            self.doDistance(distfun=Utils.avgdiff)
+            if self.fast:
+                self.doDistanceFast(distfun=matrixAvgdiff)
+            else:
+                self.doDistance(distfun=Utils.avgdiff)
+
+    def writeScores(self, ids, scores, order):
+        """Write the ids and scores in `order' (an array of indexes) to the output file."""
+        if self.outfile:
+            out = open(self.outfile, "w")
+        else:
+            out = sys.stdout
+        try:
+            for i, sc in zip(order.tolist(), scores[order].tolist()):
+                out.write("{}\t{}\n".format(ids[i], sc))
+        except IOError:
+            pass
+        finally:
+            out.close()
+
+    def doRankFast(self):
+        with open(self.infile, "r") as f:
+            rows = list(Utils.CSVreader(f))
+        ids = [ line[self.idcol] for line in rows ]
+        scores = matrixScores(self.score, readMatrix(rows, self.scorecols))
+        self.writeScores(ids, scores, rankOrder(scores, self.reverse, self.top))
+
+    def doDistanceFast(self, distfun=matrixDistance):
+        with open(self.infile, "r") as f1:
+            rows1 = list(Utils.CSVreader(f1))
+        with open(self.infile2, "r") as f2:
+            rows2 = list(Utils.CSVreader(f2))
+        n = min(len(rows1), len(rows2))
+        rows1 = rows1[:n]
+        rows2 = rows2[:n]
+        ids = [ line[self.idcol] for line in rows1 ]
+        if ids != [ line[self.idcol] for line in rows2 ]:
+            sys.stderr.write("Error: gene order is different!")
+            return
+        scores = distfun(readMatrix(rows1, self.scorecols), readMatrix(rows2, self.scorecols))
+        self.writeScores(ids, scores, rankOrder(scores, self.reverse, self.top))
 
     def doRank(self):
+        if self.fast:
+            return self.doRankFast()
         scorefunc = SCOREFUNCS[self.score]
         scores = []
         previous = None
@@ -2,10 +2,15 @@
 
 import sys
 import csv
+import os
 import ast
 import math
 import gzip
-from Utils import genOpen, convertValue, dget
+import copy
+import multiprocessing
+from cStringIO import StringIO
+from collections import OrderedDict
+from Utils import genOpen, convertValue, dget, ExternalSorter
 import Script
 
 ### filter C1=I set f=C1+C2 return avg(f)
@@ -104,6 +109,7 @@ class PrintTerm(Term):
     variables = []
 
     def init(self, source):
+        self.variables = []
         if source:
             self.addVariables(source)
     
@@ -126,24 +132,34 @@ class PrintTerm(Term):
     def dump(self):
         return "PRINT " + ",".join(self.variables)
 
+def rowSize(r):
+    """Approximate memory used by an entry (key, row) stored by SortTerm."""
+    return 64 + sys.getsizeof(r[1]) + sum([ sys.getsizeof(f) for f in r[1] ])
+
 class SortTerm(Term):
+    termtype = "sort"
     sortCol = 0
     sortColName = ""
-    rows = []
+    rows = None                 # ExternalSorter
     reverse = False
 
     def init(self, column):
-        self.rows = []
+        self.rows = None
         self.sortColName = column
         self.sortCol = parseCvar(column)
 
     def execute(self, row):
+        if self.rows is None:
+            # If the driver has a memory budget, rows exceeding it are spilled to disk
+            self.rows = ExternalSorter(key=lambda r: r[0], reverse=self.reverse, tmpdir=self.parent.tmpdir,
+                                       bufsize=sys.maxsize, maxbytes=self.parent.sortmem, sizefun=rowSize)
         x = convertValue(row[self.sortCol])
-        self.rows.append((x, row))
+        self.rows.add((x, row))
         raise SkipEntry
 
     def terminate(self):
-        self.rows.sort(key=lambda r: r[0], reverse=self.reverse)
+        if self.rows is None:
+            return
         for row in self.rows:
             sys.stdout.write("\t".join(row[1]))
             sys.stdout.write("\n")
@@ -178,6 +194,12 @@ class SumTerm(ReturnTerm):
         if not type(value).__name__ == 'str':
             self.sum += value
 
+    def partial(self):
+        return self.sum
+
+    def combine(self, partial):
+        self.sum += partial
+
     def result(self):
         return self.sum
 
@@ -199,6 +221,13 @@ class AvgTerm(ReturnTerm):
             self.sum += value
             self.nvals += 1
 
+    def partial(self):
+        return (self.sum, self.nvals)
+
+    def combine(self, partial):
+        self.sum += partial[0]
+        self.nvals += partial[1]
+
     def result(self):
         if self.nvals > 0:
             return 1.0*self.sum/self.nvals
@@ -206,13 +235,15 @@ class AvgTerm(ReturnTerm):
             return 0.0
         
 class StdevTerm(ReturnTerm):
-    sum = 0
-    sumsq = 0
+    """Standard deviation, computed with Welford's online method to avoid
+the loss of precision of the sum-of-squares formula."""
+    mean = 0.0
+    m2 = 0.0                    # Sum of squared differences from the mean
     nvals = 0
 
     def reset(self):
-        self.sum = 0
-        self.sumsq = 0
+        self.mean = 0.0
+        self.m2 = 0.0
         self.nvals = 0
 
     def execute(self, row):
@@ -222,13 +253,30 @@ class StdevTerm(ReturnTerm):
 
     def perform(self, value):
         if not type(value).__name__ == 'str':
-            self.sum += value
-            self.sumsq += value * value
             self.nvals += 1
+            delta = value - self.mean
+            self.mean += 1.0 * delta / self.nvals
+            self.m2 += delta * (value - self.mean)
+
+    def partial(self):
+        return (self.nvals, self.mean, self.m2)
+
+    def combine(self, partial):
+        """Merge the statistics of another set of values (Chan et al.'s pairwise update)."""
+        (n, mean, m2) = partial
+        if n == 0:
+            return
+        tot = self.nvals + n
+        delta = mean - self.mean
+        self.mean += 1.0 * delta * n / tot
+        self.m2 += m2 + 1.0 * delta * delta * self.nvals * n / tot
+        self.nvals = tot
 
     def result(self):
-        e = 1.0 * self.sum / self.nvals
-        return math.sqrt((1.0 * self.sumsq / self.nvals) - (e * e))
+        if self.nvals > 0:
+            return math.sqrt(self.m2 / self.nvals)
+        else:
+            return 0.0
     
 class MinTerm(ReturnTerm):
     minvalue = sys.float_info.max
@@ -239,20 +287,32 @@ class MinTerm(ReturnTerm):
     def perform(self, value):
         if not type(value).__name__ == 'str':
             self.minvalue = min(self.minvalue, value)
-    
+
+    def partial(self):
+        return self.minvalue
+
+    def combine(self, partial):
+        self.minvalue = min(self.minvalue, partial)
+
     def result(self):
         return self.minvalue
 
 class MaxTerm(ReturnTerm):
-    maxvalue = sys.float_info.min
+    maxvalue = -sys.float_info.max
 
     def reset(self):
-        self.minvalue = sys.float_info.min
+        self.maxvalue = -sys.float_info.max
 
     def perform(self, value):
         if not type(value).__name__ == 'str':
             self.maxvalue = max(self.maxvalue, value)
-    
+
+    def partial(self):
+        return self.maxvalue
+
+    def combine(self, partial):
+        self.maxvalue = max(self.maxvalue, partial)
+
     def result(self):
         return self.maxvalue
 
@@ -264,6 +324,86 @@ TERMMAP = [ ('SUM', SumTerm),
             ('MIN', MinTerm),
             ('MAX', MaxTerm) ]
 
+class GroupTerm(Term):
+    """Evaluate the return terms separately for each value of the key expression,
+printing one row per key (key values followed by the results). Each key gets its
+own copy of the return terms, so all groups are computed in a single pass. If
+`streaming' is True the input should be sorted (or at least grouped) by key:
+each group is printed as soon as the key changes, and only the current group
+is kept in memory."""
+    termtype = "group"
+    streaming = False
+    returnTerms = []            # Prototype return terms, copied for each key
+    groups = None               # Dictionary key -> list of return terms
+    currkey = None
+    headerDone = False
+
+    def init(self, source):
+        Term.init(self, source)
+        self.groups = OrderedDict()
+        self.currkey = None
+        self.headerDone = False
+
+    def newAccumulators(self):
+        accs = []
+        for rt in self.returnTerms:
+            acc = copy.copy(rt)
+            acc.reset()
+            accs.append(acc)
+        return accs
+
+    def execute(self, row):
+        key = eval(self.code, globals(), self.parent.bindings)
+        if self.streaming:
+            if key != self.currkey or not self.groups:
+                self.flush()
+                self.currkey = key
+                self.groups[key] = self.newAccumulators()
+            accs = self.groups[key]
+        else:
+            accs = self.groups.get(key)
+            if accs is None:
+                accs = self.newAccumulators()
+                self.groups[key] = accs
+        for acc in accs:
+            acc.execute(row)
+
+    def writeGroup(self, key, accs):
+        out = self.parent.out
+        if not self.headerDone:
+            if self.parent.printVariables:
+                out.write("\t".join([ k.strip(" \t") for k in self.source.split(",") ] +
+                                    [ rt.source for rt in self.returnTerms ]) + "\n")
+            self.headerDone = True
+        if type(key).__name__ == 'tuple':
+            fields = [ str(k) for k in key ]
+        else:
+            fields = [ str(key) ]
+        out.write("\t".join(fields + [ str(acc.result()) for acc in accs ]) + "\n")
+
+    def partial(self):
+        return [ (key, [ acc.partial() for acc in accs ]) for key, accs in self.groups.iteritems() ]
+
+    def combine(self, partial):
+        for key, parts in partial:
+            accs = self.groups.get(key)
+            if accs is None:
+                accs = self.newAccumulators()
+                self.groups[key] = accs
+            for acc, p in zip(accs, parts):
+                acc.combine(p)
+
+    def flush(self):
+        for key, accs in self.groups.iteritems():
+            self.writeGroup(key, accs)
+        self.groups.clear()
+
+    def terminate(self):
+        self.flush()
+
+    def dump(self):
+        return ("SGROUP " if self.streaming else "GROUP ") + self.source + " DO " + " ".join([ rt.source for rt in self.returnTerms ])
+
 def funcToTerm(source):
     global TERMMAP
     p = source.find("(")
@@ -308,6 +448,18 @@ Options:
   -p   | Skip the first line in the input file (header)
   -P   | Like -p, but prints the first line at the beginning of output.
   -q   | Do not print variable names in output.
+  -m M | Memory budget for sort and rsort, in bytes (accepts K, M, G suffixes).
+         Rows exceeding it are sorted in chunks written to temporary files,
+         which are then merged. Default: sort all rows in memory.
+  -T D | Write temporary files for sorting to directory D.
+  -t N | Process the input file in parallel using N processes. The file is
+         split into chunks, printed rows are written in the original order,
+         and return values are combined at the end. Only available for
+         uncompressed input files, and for recipes that do not use sort,
+         rsort, sgroup, or the CN and CM variables; otherwise the input is
+         processed serially.
+  -c C | Size of chunks in parallel mode, in bytes (accepts K, M, G suffixes,
+         default: 16M).
 
 """)
     elif what == 'terms':
@@ -343,6 +495,16 @@ min <column>       - Prints the smallest value in the specified column.
 
 max <column>       - Prints the largest value in the specified column.
 
+group <key>        - Compute the return terms separately for each distinct value of
+                     the key, printing one row per key: the key value(s) followed by
+                     the results, in order of first appearance. The key can be any
+                     expression, or several expressions separated by commas (e.g.
+                     C1,C2). Filters and assignments are applied before grouping.
+
+sgroup <key>       - Like group, for input that is sorted by key: each group is
+                     printed as soon as the key changes, so memory use does not
+                     depend on the number of keys.
+
 """)
     elif what == "functions":
         sys.stdout.write("""FUNCTIONS:
@@ -370,10 +532,16 @@ class Driver(Script.Script):
     skipHeader = False
     printHeader = False
     printVariables = True
+    sortmem = None              # Memory budget for SortTerm, in bytes
+    tmpdir = None               # Directory for temporary files
+    recipe = ""
+    nprocs = 1                  # Number of worker processes in parallel mode
+    chunksize = 16000000        # Bytes per chunk in parallel mode
 
     # Default terms
     printTerm = None
     returnTerms = []
+    groupTerm = None
 
     # Debugging
     dumpRecipe = False
@@ -394,7 +562,19 @@ class Driver(Script.Script):
             elif next == "-o":
                 self.outfile = a
                 next = ""
-            elif a in ["-n", "-o"]:
+            elif next == "-m":
+                self.sortmem = self.toInt(a, units=True)
+                next = ""
+            elif next == "-T":
+                self.tmpdir = a
+                next = ""
+            elif next == "-t":
+                self.nprocs = self.toInt(a)
+                next = ""
+            elif next == "-c":
+                self.chunksize = self.toInt(a, units=True)
+                next = ""
+            elif a in ["-n", "-o", "-m", "-T", "-t", "-c"]:
                 next = a
             elif a == '-d':
                 self.dumpRecipe = True
@@ -411,6 +591,7 @@ class Driver(Script.Script):
                         rec = f.read()
                 else:
                     rec = a
+                self.recipe = rec
                 self.parseRecipe(rec)
                 na += 1
             elif na == 1:
@@ -439,8 +620,13 @@ class Driver(Script.Script):
         words = recipe.split()
         mode = ""
         for w in words:
-            if w in ["filter", "if", "set", "print", "do", "return", "sort", "rsort"]:
+            if w in ["filter", "if", "set", "print", "do", "return", "sort", "rsort", "group", "sgroup"]:
                 mode = w
+            elif mode == "group" or mode == "sgroup":
+                gt = GroupTerm(w)
+                gt.streaming = (mode == "sgroup")
+                gt.parent = self
+                self.groupTerm = gt
             elif mode == "sort":
                 self.addTerm(SortTerm(w))
             elif mode == "rsort":
@@ -471,6 +657,11 @@ class Driver(Script.Script):
                     self.returnTerms.append(rt)
                 else:
                     sys.stderr.write("Warning: no function found in term `{}'.\n".format(w))
+        if self.groupTerm:
+            # Return terms are executed by the group term, after all other terms
+            self.terms = [ t for t in self.terms if t not in self.returnTerms ]
+            self.groupTerm.returnTerms = self.returnTerms
+            self.terms.append(self.groupTerm)
         if not (self.printTerm or self.returnTerms):
             pt = PrintTerm(None)
             self.addTerm(pt)
@@ -491,36 +682,134 @@ to their numeric representation if possible."""
             self.bindings[colname] = convertValue(val)
 
     def processAllRows(self):
+        if self.nprocs > 1:
+            why = self.notParallel()
+            if why:
+                sys.stderr.write("Warning: {}, processing input serially.\n".format(why))
+            else:
+                return self.processParallel()
         f = csv.reader(self.src, delimiter='\t')
         try:
             if self.skipHeader:
                 self.header = f.next()
-            for row in f:
-                if len(row) == 0:
-                    continue
-                if len(row[0]) > 0 and row[0][0] == '#':
-                    continue
-                if not self.ncols:
-                    self.setNcols(len(row))
-                self.bindings['CN'] += 1
-                try:
-                    self.processRow(row)
-                except SkipEntry:
-                    pass
+            self.processRows(f)
             if self.printHeader:
                 sys.stdout.write("\t".join(self.header) + "\n")
         except IOError:
             return
 
+    def processRows(self, f):
+        for row in f:
+            if len(row) == 0:
+                continue
+            if len(row[0]) > 0 and row[0][0] == '#':
+                continue
+            if not self.ncols:
+                self.setNcols(len(row))
+            self.bindings['CN'] += 1
+            try:
+                self.processRow(row)
+            except SkipEntry:
+                pass
+
     def processRow(self, row):
         self.bindColumnValues(row)
         self.execute(row)
 
+    ## Parallel mode
+
+    def notParallel(self):
+        """Returns the reason why the recipe cannot be executed in parallel, or None if it can."""
+        if not self.infile:
+            return "parallel mode requires an input file"
+        if self.infile.endswith(".gz"):
+            return "parallel mode does not support compressed input"
+        for term in self.terms:
+            if term.termtype not in ["filter", "set", "print", "return", "group"]:
+                return "{} terms cannot be executed in parallel".format(term.termtype)
+            if term.termtype == "group" and term.streaming:
+                return "sgroup terms cannot be executed in parallel"
+            names = term.variables if term.termtype == "print" else term.code.co_names
+            if "CN" in names or "CM" in names:
+                return "row counters cannot be used in parallel mode"
+        if self.groupTerm:
+            for term in self.returnTerms:
+                if "CN" in term.code.co_names or "CM" in term.code.co_names:
+                    return "row counters cannot be used in parallel mode"
+        return None
+
+    def findChunks(self):
+        """Split the input file into chunks of about `chunksize' bytes ending at line boundaries.
+Also reads the header line if requested, and sets the number of columns from the first row
+if not specified. Returns a list of (filename, start, end) tuples."""
+        chunks = []
+        size = os.path.getsize(self.infile)
+        with open(self.infile, "r") as f:
+            if self.skipHeader:
+                self.header = csv.reader([f.readline()], delimiter='\t').next()
+            start = f.tell()
+            if not self.ncols:
+                for row in csv.reader(f, delimiter='\t'):
+                    if len(row) > 0 and not (len(row[0]) > 0 and row[0][0] == '#'):
+                        self.setNcols(len(row))
+                        break
+            while start < size:
+                f.seek(start + self.chunksize)
+                f.readline()
+                end = min(f.tell(), size)
+                chunks.append((self.infile, start, end))
+                start = end
+        return chunks
+
+    def processChunk(self, filename, start, end):
+        """Process the rows of `filename' between byte offsets `start' and `end' (called in worker
+processes). Returns a tuple (printed output, number of rows, partial results of the return terms)."""
+        self.out = StringIO()
+        self.bindings['CN'] = 0
+        for rt in self.returnTerms:
+            rt.reset()
+        with open(filename, "r") as f:
+            f.seek(start)
+            lines = f.read(end - start).split("\n")
+        self.processRows(csv.reader(lines, delimiter='\t'))
+        if self.groupTerm:
+            partial = self.groupTerm.partial()
+            self.groupTerm.groups.clear()
+        else:
+            partial = [ rt.partial() for rt in self.returnTerms ]
+        return (self.out.getvalue(), self.bindings['CN'], partial)
+
+    def processParallel(self):
+        chunks = self.findChunks()
+        if chunks and self.ncols:
+            self.runChunks(chunks)
+        if self.printHeader:
+            sys.stdout.write("\t".join(self.header) + "\n")
+
+    def runChunks(self, chunks):
+        """Process `chunks' in a pool of worker processes and combine their results. If the input
+contains no data rows there is nothing to do, and workers must not be started (`ncols' is unknown)."""
+        pool = multiprocessing.Pool(self.nprocs, initWorker, (self.recipe, self.ncols))
+        try:
+            for (output, nrows, partial) in pool.imap(processChunk, chunks):
+                self.out.write(output)
+                self.bindings['CN'] += nrows
+                if self.groupTerm:
+                    self.groupTerm.combine(partial)
+                else:
+                    for rt, p in zip(self.returnTerms, partial):
+                        rt.combine(p)
+        finally:
+            pool.close()
+            pool.join()
+
     def terminateAll(self):
         for term in self.terms:
             term.terminate()
 
     def printReturns(self):
+        if self.groupTerm:
+            return
         if len(self.returnTerms) > 0:
             if self.printVariables:
                 self.out.write("\t".join([rt.source for rt in self.returnTerms]) + "\n")
@@ -533,6 +822,20 @@ to their numeric representation if possible."""
             sys.stderr.write("  " + term.dump() + "\n")
         sys.stderr.write("***\n")
             
+### Worker processes for parallel mode
+
+WORKER = None                   # Driver object in worker processes
+
+def initWorker(recipe, ncols):
+    global WORKER
+    WORKER = Driver("tcalc.py", version="1.0", usage=usage)
+    WORKER.parseRecipe(recipe)
+    WORKER.setNcols(ncols)
+
+def processChunk(args):
+    (filename, start, end) = args
+    return WORKER.processChunk(filename, start, end)
+
 ## Test
 
 def test():
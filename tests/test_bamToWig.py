@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+## Round-trip checks for bamToWig: bigWig tracks written by the -b engines must contain
+## the same intervals as the corresponding WIG tracks, and bigWig tracks converted from
+## unsorted diff files (-f, -m) must contain their sorted and flattened intervals.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pysam
+
+import BigWig
+import bamToWig
+
+CHROMS = [("chr1", 5000), ("chr2", 3000)]
+
+def writeBAM(filename, reads):
+    """Write a sorted and indexed BAM file containing `reads', a list of (chrom index, start, length)."""
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+              'SQ': [ {'SN': c, 'LN': l} for (c, l) in CHROMS ]}
+    with pysam.AlignmentFile(filename, "wb", header=header) as out:
+        for (i, (tid, start, length)) in enumerate(sorted(reads)):
+            r = pysam.AlignedSegment()
+            r.query_name = "r{}".format(i)
+            r.query_sequence = "A" * length
+            r.flag = 0
+            r.reference_id = tid
+            r.reference_start = start
+            r.mapping_quality = 60
+            r.cigartuples = [(0, length)]
+            r.query_qualities = pysam.qualitystring_to_array("I" * length)
+            out.write(r)
+    pysam.index(filename)
+
+def wigIntervals(filename):
+    """Returns the (chrom, start, end, value) intervals of a fixedStep WIG track written by the
+-b engines, whose block starts are 0-based pileup positions."""
+    result = []
+    with open(filename) as f:
+        for line in f:
+            if line.startswith("track"):
+                continue
+            if line.startswith("fixedStep"):
+                fields = dict(kv.split("=") for kv in line.split()[1:])
+                chrom = fields['chrom']
+                pos = int(fields['start'])
+                step = int(fields['step'])
+            else:
+                result.append((chrom, pos, pos + step, float(line)))
+                pos += step
+    return result
+
+def bigWigIntervals(filename):
+    result = []
+    with BigWig.BigWigReader(filename) as bw:
+        for (chrom, size) in CHROMS:
+            (starts, ends, values) = bw.intervals(chrom)
+            for (start, end, value) in zip(starts.tolist(), ends.tolist(), values.tolist()):
+                result.append((chrom, start, end, value))
+    return result
+
+class DiffRoundTrip(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        # Coverage starts at base 0 on chr1, and has a gap longer than a window
+        reads1 = [ (0, s, 50) for s in range(0, 600, 7) ] + [ (0, s, 50) for s in range(2000, 2400, 5) ] + \
+                 [ (1, s, 40) for s in range(100, 900, 3) ]
+        reads2 = [ (0, s, 50) for s in range(0, 700, 11) ] + [ (0, s, 50) for s in range(2100, 2300, 9) ] + \
+                 [ (1, s, 40) for s in range(0, 1000, 13) ]
+        self.bam1 = os.path.join(self.tmpdir, "z1.bam")
+        self.bam2 = os.path.join(self.tmpdir, "z2.bam")
+        writeBAM(self.bam1, reads1)
+        writeBAM(self.bam2, reads2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def runDiff(self, engine, outfile):
+        td = bamToWig.trackdata()
+        td.window = 20
+        td.outfile = outfile
+        td.bigwig = outfile.endswith(".bw")
+        engine(self.bam1, self.bam2, td)
+
+    def checkEngine(self, engine):
+        wig = os.path.join(self.tmpdir, "z.wig")
+        bw = os.path.join(self.tmpdir, "z.bw")
+        self.runDiff(engine, wig)
+        self.runDiff(engine, bw)
+        expected = wigIntervals(wig)
+        self.assertEqual(expected[0][1], 0)
+        actual = bigWigIntervals(bw)
+        self.assertEqual(len(actual), len(expected))
+        for (a, e) in zip(actual, expected):
+            self.assertEqual(a[:3], e[:3])
+            self.assertAlmostEqual(a[3], e[3], places=3)
+
+    def test_diff(self):
+        self.checkEngine(bamToWig.bamToWigDiff)
+
+    def test_diff_pileup(self):
+        self.checkEngine(bamToWig.bamToWigDiff_old)
+
+DIFF = """id\tcoords\tc3\tc4\tc5\tc6\tc7\tfc
+g3\tchr2:500-900\t.\t.\t.\t.\t.\t-1.5
+g1\tchr1:100-400\t.\t.\t.\t.\t.\t2.0
+g2\tchr1:300-600\t.\t.\t.\t.\t.\t1.0
+g4\tchr1:1000-1200\t.\t.\t.\t.\t.\tNA
+g5\tchr1:50-80\t.\t.\t.\t.\t.\t0.5
+g6\tchr2:100-200\t.\t.\t.\t.\t.\t3.0
+"""
+
+METH = """chrom\tpos\tc3\tc4\tfc
+chr2\t40\t.\t.\t0.25
+chr1\t10\t.\t.\t-0.5
+chr2\t20\t.\t.\tNA
+chr1\t5\t.\t.\t1.0
+"""
+
+class ConvertBigWig(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.outfile = os.path.join(self.tmpdir, "z.bw")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def convert(self, converter, text):
+        infile = os.path.join(self.tmpdir, "z.txt")
+        with open(infile, "w") as out:
+            out.write(text)
+        td = bamToWig.trackdata()
+        td.outfile = self.outfile
+        td.bigwig = True
+        converter(infile, td)
+        return bigWigIntervals(self.outfile)
+
+    def test_diff(self):
+        self.assertEqual(self.convert(bamToWig.diffToBedGraph, DIFF),
+                         [("chr1", 50, 80, 0.5), ("chr1", 100, 300, 2.0), ("chr1", 300, 400, 1.5),
+                          ("chr1", 400, 600, 1.0), ("chr2", 100, 200, 3.0), ("chr2", 500, 900, -1.5)])
+
+    def test_meth(self):
+        self.assertEqual(self.convert(bamToWig.methToBedGraph, METH),
+                         [("chr1", 5, 6, 1.0), ("chr1", 10, 11, -0.5), ("chr2", 40, 41, 0.25)])
+
+    def test_error(self):
+        # A malformed line must not leave a partial bigWig file behind
+        with self.assertRaises(ValueError):
+            self.convert(bamToWig.diffToBedGraph, DIFF + "g7\tchr1:x-y\t.\t.\t.\t.\t.\t1.0\n")
+        self.assertFalse(os.path.exists(self.outfile))
+
+    def test_flatten(self):
+        self.assertEqual(BigWig.flattenIntervals([(10, 20, 1.0), (0, 5, 2.0), (15, 30, 3.0), (15, 25, 5.0), (40, 40, 9.0)]),
+                         [(0, 5, 2.0), (10, 15, 1.0), (15, 20, 3.0), (20, 25, 4.0), (25, 30, 3.0)])
+
+if __name__ == "__main__":
+    unittest.main()
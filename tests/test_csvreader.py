@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+## Typed columns of the blocks returned by Utils.FastCSVreader: values must be converted
+## exactly, and any value that cannot be converted must raise ValueError.
+
+import os
+import sys
+import unittest
+from StringIO import StringIO
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import Utils
+
+def typedColumns(text, types):
+    """Returns the typed columns of the first block read from `text'."""
+    block = Utils.FastCSVreader(StringIO(text), types=types).blocks().next()
+    return [ block.column(c) for c in sorted(types) ]
+
+class TypedColumns(unittest.TestCase):
+
+    def test_values(self):
+        (ints, floats) = typedColumns("chr1\t10\t0.5\nchr1\t200\t-1e-3\nchr2\t7\tnan\n", {1: np.int64, 2: float})
+        self.assertEqual(ints.dtype, np.int64)
+        self.assertEqual(ints.tolist(), [10, 200, 7])
+        self.assertEqual(floats[:2].tolist(), [0.5, -1e-3])
+        self.assertTrue(np.isnan(floats[2]))
+
+    def test_ragged(self):
+        (ints,) = typedColumns("chr1\t10\t0.5\nchr1\t20\nchr2\t30\t1\tx\n", {1: np.int64})
+        self.assertEqual(ints.tolist(), [10, 20, 30])
+
+    def test_bad_values(self):
+        for (text, dtype) in [("1\n2x\n", float), ("1\n1e3\n", np.int64), ("1\n2.5\n", np.int64), ("1\nNA\n", float)]:
+            with self.assertRaises(ValueError):
+                typedColumns(text, {0: dtype})
+
+if __name__ == "__main__":
+    unittest.main()
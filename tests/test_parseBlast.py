@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+## Compare the chunked engine of parseBlast (-f) with the line-by-line engine, including blocks
+## whose lines have different numbers of fields.
+
+import os
+import sys
+import random
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import parseBlast
+
+def hit(query, subject, rnd, extra=0):
+    fields = [query, subject, "{:.2f}".format(rnd.uniform(60, 100)), str(rnd.randint(20, 150)),
+              str(rnd.randint(0, 10)), str(rnd.randint(0, 3)), "1", "100", str(rnd.randint(1, 9000)),
+              str(rnd.randint(1, 9000)), "{:.0e}".format(10 ** rnd.uniform(-30, 1)), "{:.1f}".format(rnd.uniform(20, 300))]
+    return "\t".join(fields + ["EXTRA"] * extra) + "\n"
+
+def blastTable(n, seed):
+    rnd = random.Random(seed)
+    lines = ["# BLASTN\n"]
+    for i in range(n):
+        lines.append(hit("q{}".format(i // 5), "s{}".format(rnd.randint(0, 500)), rnd))
+        if i % 997 == 0:
+            lines.append("# Query: q{}\n".format(i // 5))
+    return "".join(lines)
+
+def run(text, fast, chunksize=65536, tophits=None, **limits):
+    """Run parseBlast on `text'. Returns (output, nin, nout)."""
+    P = parseBlast.ParseBlast("parseBlast", version="1.0", usage=parseBlast.usage)
+    P.limits = parseBlast.BLASTlimits()
+    for (k, v) in limits.items():
+        setattr(P.limits, k, v)
+    P.fast = fast
+    P.chunksize = chunksize
+    P.tophits = tophits
+    out = StringIO()
+    (nin, nout) = P.parseOne(StringIO(text), out)
+    return (out.getvalue(), nin, nout)
+
+def outcome(*args, **kwargs):
+    """Like run(), but returns the type of the exception raised, if any."""
+    try:
+        return run(*args, **kwargs)
+    except Exception as e:
+        return type(e)
+
+LIMITS = [{}, {'identity': 90}, {'evalue': 1e-5, 'alnlength': 50}, {'bitscore': 100, 'mismatches': 3}]
+
+class Engines(unittest.TestCase):
+
+    def test_same_output(self):
+        text = blastTable(5000, 1)
+        for limits in LIMITS:
+            for tophits in [None, 2]:
+                expected = run(text, False, tophits=tophits, **limits)
+                self.assertTrue(expected[2] > 0)
+                for chunksize in [100, 4096, 65536]:
+                    self.assertEqual(run(text, True, chunksize=chunksize, tophits=tophits, **limits), expected)
+
+    def test_ragged_block(self):
+        # 12, 13 and 11 fields: the total number of fields is a multiple of 12
+        rnd = random.Random(2)
+        short = hit("q3", "s3", rnd).rstrip("\n").split("\t")[:11]
+        short[2] = "10.00"
+        text = hit("q1", "s1", rnd) + hit("q2", "s2", rnd, extra=1) + "\t".join(short) + "\n"
+        self.assertEqual(outcome(text, False), IndexError)
+        for limits in LIMITS:
+            self.assertEqual(outcome(text, True, **limits), outcome(text, False, **limits))
+        # The short row fails the identity test, so the line engine does not look at its missing columns
+        expected = run(text, False, identity=50)
+        self.assertEqual(expected[1:], (3, 2))
+        self.assertEqual(run(text, True, identity=50), expected)
+
+    def test_extra_columns(self):
+        rnd = random.Random(3)
+        text = "".join([ hit("q{}".format(i), "s{}".format(i), rnd, extra=2) for i in range(100) ])
+        for limits in LIMITS:
+            self.assertEqual(run(text, True, **limits), run(text, False, **limits))
+
+if __name__ == "__main__":
+    unittest.main()
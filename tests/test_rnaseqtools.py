@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+## Compare the keyed/matrix engine of `rnaseqtools.py matrix' (-k) with the default row-based
+## engine on synthetic RSEM results files. The keyed engine reads files whose rows have been
+## shuffled, and its output must match the row engine's within a small tolerance.
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import ercc
+import rnaseqtools
+
+HEADER = ["gene_id", "transcript_id(s)", "length", "effective_length", "expected_count", "TPM", "FPKM"]
+NGENES = 300
+MIXES = ['1', '1', '2', '2', '1']
+
+def makeSamples(rnd, nsamples):
+    """Returns a list of `nsamples' samples, each a tuple (genes, erccs) of lists of RSEM rows.
+ERCC counts follow the concentration of each control in the sample's mix, with a sample-specific
+scale and offset, so that ERCC normalization has something to correct."""
+    genes = [ "G{:05d}".format(i) for i in range(NGENES) ]
+    base = [ rnd.choice([0.0, rnd.uniform(1, 50), rnd.uniform(50, 5000)]) for g in genes ]
+    controls = sorted(ercc.ERCCdb.entries.keys())
+    samples = []
+    for s in range(nsamples):
+        scale = rnd.uniform(0.5, 2.0)
+        offset = rnd.uniform(0, 5)
+        grows = []
+        for (g, b) in zip(genes, base):
+            v = 0.0 if b == 0 or rnd.random() < 0.05 else round(b * scale * rnd.uniform(0.7, 1.4), 2)
+            grows.append(row(g, v))
+        erows = []
+        for name in controls:
+            e = ercc.ERCCdb.entries[name]
+            conc = e.concentration1 if MIXES[s] == '1' else e.concentration2
+            v = 0.0 if conc < 0.2 else round(conc * scale * rnd.uniform(0.9, 1.1) + offset, 2)
+            erows.append(row(name, v))
+        samples.append((grows, erows))
+    return samples
+
+def row(name, count):
+    return [name, name + ".1", "1500", "1350.5", str(count), str(count / 10.0), str(count / 20.0)]
+
+def writeResults(filename, rows):
+    with open(filename, "w") as out:
+        out.write("\t".join(HEADER) + "\n")
+        for r in rows:
+            out.write("\t".join(r) + "\n")
+
+def runMatrix(args):
+    """Run `rnaseqtools.py matrix' with arguments `args'. Returns a dictionary mapping each gene
+to its list of output values."""
+    stdout = sys.stdout
+    stderr = sys.stderr
+    sys.stdout = StringIO()
+    sys.stderr = StringIO()
+    try:
+        rnaseqtools.parseArgs("matrix", list(args)).run()
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+        sys.stderr = stderr
+    lines = output.splitlines()
+    result = {}
+    for line in lines[1:]:
+        fields = line.split("\t")
+        result[fields[0].strip('"')] = [ float(x) for x in fields[1:] ]
+    return result
+
+class KeyedMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rnd = random.Random(42)
+        samples = makeSamples(rnd, len(MIXES))
+        self.ordered = []
+        self.shuffled = []
+        for (i, (grows, erows)) in enumerate(samples):
+            name = os.path.join(self.tmpdir, "s{}.genes.results".format(i + 1))
+            writeResults(name, grows + erows)
+            self.ordered.append(name)
+            rows = grows + erows        # The keyed engine must not care about row order
+            rnd.shuffle(rows)
+            name = os.path.join(self.tmpdir, "k{}.genes.results".format(i + 1))
+            writeResults(name, rows)
+            self.shuffled.append(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def compare(self, opts):
+        expected = runMatrix(opts + self.ordered)
+        actual = runMatrix(["-k"] + opts + self.shuffled)
+        self.assertTrue(len(expected) > 0)
+        self.assertEqual(sorted(actual.keys()), sorted(expected.keys()))
+        for (gene, values) in expected.items():
+            for (a, e) in zip(actual[gene], values):
+                self.assertTrue(abs(a - e) <= 1e-6 * max(1.0, abs(e)), "{}: {} != {}".format(gene, a, e))
+
+    def test_plain(self):
+        self.compare([])
+
+    def test_ercc(self):
+        self.compare(["-e"])
+
+    def test_ercc_mix(self):
+        self.compare(["-e", "-mix", ",".join(MIXES)])
+
+    def test_filters(self):
+        self.compare(["-e", "-mix", ",".join(MIXES), "-n", "2,3", "-f", "0.5", "-m", "20"])
+
+    def test_filters_inverted(self):
+        self.compare(["-n", "2,3", "-f", "0.5", "-u"])
+
+    def test_parallel(self):
+        self.compare(["-p", "2", "-e", "-mix", ",".join(MIXES)])
+
+if __name__ == "__main__":
+    unittest.main()
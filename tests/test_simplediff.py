@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+## Regression tests for simplediff on mixed numeric and NA input: known results on a small
+## table, and identical output from the row-by-row and chunked (-f) engines.
+
+import os
+import sys
+import math
+import random
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import simplediff
+
+TABLE = """gene\ta1\ta2\ta3\tb1\tb2\tb3
+g1\t10\t12\t16\t20\t21\t22
+g2\t1\t1.1\t1.2\t10\t10.5\t11
+g3\t1\t2\t3\t10\tNA\t12
+g4\t1\t5\t9\t4\t6\t8
+g5\t1\t1\t1\t9
+g6\t1\t2\t3
+g7\tNA
+g8\t0\t0\t0\t5\t5\t5
+g9\t30\t31\t32\t2\t3\t2.5
+"""
+
+def run(text, fast, alpha=1.0, blocksize=10000, minfc=None, minavg=None):
+    """Run simplediff on `text' with slices 2-4 and 5-7. Returns (output, nin, nout, nskipped)."""
+    SD = simplediff.SimpleDiff()
+    SD.slice1 = simplediff.parseSlice("2-4")
+    SD.slice2 = simplediff.parseSlice("5-7")
+    SD.alpha = alpha
+    SD.fast = fast
+    SD.blocksize = blocksize
+    SD.minfc = minfc
+    SD.minavg = minavg
+    out = StringIO()
+    (nin, nout) = SD.process(StringIO(text), out)
+    return (out.getvalue(), nin, nout, SD.nskipped)
+
+def expectedRow(name, data1, data2):
+    avg1 = sum(data1) / 3.0
+    avg2 = sum(data2) / 3.0
+    return "{}\t{}\t{}\t{}\n".format(name, avg1, avg2, math.log(avg1/avg2, 2.0))
+
+def randomTable(n, seed):
+    """A table of `n' genes mixing separated and overlapping groups, NA values, short rows and
+rows with no values for the second group."""
+    rnd = random.Random(seed)
+    lines = ["gene\ta1\ta2\ta3\tb1\tb2\tb3"]
+    for i in range(n):
+        shift = rnd.choice([0, 0, 5, -5, 50])
+        a = [ round(rnd.uniform(10, 12), 2) for j in range(3) ]
+        b = [ round(max(0, rnd.uniform(10, 12) + shift), 2) for j in range(3) ]
+        values = [ str(v) for v in a + b ]
+        u = rnd.random()
+        if u < 0.05:
+            values[rnd.randrange(6)] = "NA"
+        elif u < 0.08:
+            values = values[:rnd.randrange(6)]
+        lines.append("\t".join(["g{}".format(i)] + values))
+    return "\n".join(lines) + "\n"
+
+class MixedInput(unittest.TestCase):
+
+    def test_known(self):
+        expected = expectedRow("g2", [1, 1.1, 1.2], [10, 10.5, 11]) + \
+                   expectedRow("g5", [1, 1, 1], [9]) + \
+                   expectedRow("g9", [30, 31, 32], [2, 3, 2.5])
+        for fast in [False, True]:
+            self.assertEqual(run(TABLE, fast), (expected, 9, 3, 3))
+
+    def test_alpha(self):
+        (output, nin, nout, nskipped) = run(TABLE, False, alpha=0.5)
+        self.assertTrue(output.startswith(expectedRow("g1", [10, 12, 16], [20, 21, 22])))
+        self.assertEqual((nout, nskipped), (4, 3))
+
+    def test_engines(self):
+        text = randomTable(3000, 1)
+        for (alpha, minfc, minavg) in [(1.0, None, None), (0.5, None, None), (0.5, 1.0, None), (0.5, None, 20.0)]:
+            expected = run(text, False, alpha=alpha, minfc=minfc, minavg=minavg)
+            self.assertTrue(expected[2] > 0 and expected[3] > 0)
+            for blocksize in [1, 7, 1000, 10000]:
+                self.assertEqual(run(text, True, alpha=alpha, blocksize=blocksize, minfc=minfc, minavg=minavg), expected)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+## Tests for the disk-backed sort used by tcalc's sort and rsort terms: Utils.ExternalSorter
+## with a budget small enough to force several spills must return the same records, in the
+## same order, as an in-memory sort (including ties and reverse order).
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+TOP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, TOP)
+import Utils
+
+def makeRecords(n, seed):
+    """Returns `n' records (key, serial number). Keys are drawn from a small range, so there
+are many ties, and the serial number tells whether ties keep their input order."""
+    rnd = random.Random(seed)
+    return [ (rnd.randint(0, 50), i) for i in range(n) ]
+
+class ExternalSorterSpills(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check(self, records, reverse, **kwargs):
+        sorter = Utils.ExternalSorter(key=lambda r: r[0], reverse=reverse, tmpdir=self.tmpdir, **kwargs)
+        for r in records:
+            sorter.add(r)
+        self.assertTrue(len(sorter.runs) > 2)
+        expected = sorted(records, key=lambda r: r[0], reverse=reverse)
+        self.assertEqual(list(sorter), expected)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_bufsize(self):
+        self.check(makeRecords(5000, 1), False, bufsize=700)
+
+    def test_bufsize_reverse(self):
+        self.check(makeRecords(5000, 2), True, bufsize=700)
+
+    def test_maxbytes(self):
+        self.check(makeRecords(5000, 3), False, bufsize=sys.maxsize, maxbytes=20000)
+
+    def test_maxbytes_reverse(self):
+        self.check(makeRecords(5000, 4), True, bufsize=sys.maxsize, maxbytes=20000)
+
+    def test_no_spill(self):
+        records = makeRecords(1000, 5)
+        sorter = Utils.ExternalSorter(key=lambda r: r[0], reverse=True, tmpdir=self.tmpdir)
+        for r in records:
+            sorter.add(r)
+        self.assertEqual(sorter.runs, [])
+        self.assertEqual(list(sorter), sorted(records, key=lambda r: r[0], reverse=True))
+
+class TcalcSort(unittest.TestCase):
+    """Run tcalc sort/rsort recipes with and without a memory budget (-m)."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.infile = os.path.join(self.tmpdir, "input.txt")
+        rnd = random.Random(6)
+        with open(self.infile, "w") as out:
+            for i in range(20000):
+                # Numeric key with ties in column 3, string key in column 1
+                out.write("{}\t{}\t{}\n".format(rnd.choice("ABCDEFG") * rnd.randint(1, 3), i, rnd.randint(0, 99)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def tcalc(self, args):
+        return subprocess.check_output([sys.executable, os.path.join(TOP, "tcalc.py")] + args + [self.infile])
+
+    def check(self, recipe):
+        expected = self.tcalc([recipe])
+        spilled = self.tcalc(["-m", "100K", "-T", self.tmpdir, recipe])
+        self.assertEqual(len(expected.splitlines()), 20000)
+        self.assertEqual(spilled, expected)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ["input.txt"])
+
+    def test_sort(self):
+        self.check("sort C3")
+
+    def test_rsort(self):
+        self.check("rsort C3")
+
+    def test_sort_strings(self):
+        self.check("sort C1")
+
+    def test_rsort_strings(self):
+        self.check("rsort C1")
+
+if __name__ == "__main__":
+    unittest.main()